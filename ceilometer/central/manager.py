@@ -16,40 +16,76 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import eventlet
 from keystoneclient.v2_0 import client as ksclient
 from oslo.config import cfg
 from stevedore import extension
 
 from ceilometer import agent
+from ceilometer.central import partition
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import service as os_service
 from ceilometer.openstack.common.rpc import service as rpc_service
+from ceilometer import plugin
 from ceilometer import service
 
+OPTS = [
+    cfg.IntOpt('pollster_workers',
+               default=8,
+               help='Number of pollsters polled concurrently by the '
+                    'central agent'),
+    cfg.IntOpt('pollster_timeout',
+               default=0,
+               help='Number of seconds after which a pollster is '
+                    'interrupted and its samples dropped (0 means no '
+                    'timeout)'),
+    cfg.IntOpt('keystone_token_expiry_margin',
+               default=600,
+               help='The keystone client is reused across polling '
+                    'intervals until its token expires within that many '
+                    'seconds'),
+]
+
+cfg.CONF.register_opts(OPTS, group='central')
 cfg.CONF.import_group('service_credentials', 'ceilometer.service')
 
 LOG = log.getLogger(__name__)
 
 
 class PollingTask(agent.PollingTask):
+    def _poll_and_publish_pollster(self, pollster, cache, publisher):
+        try:
+            LOG.info("Polling pollster %s", pollster.name)
+            with eventlet.Timeout(cfg.CONF.central.pollster_timeout or None):
+                # The pollsters only list the resources of this agent's
+                # partition, see PartitionCoordinator.
+                samples = list(pollster.obj.get_samples(
+                    self.manager,
+                    cache,
+                ))
+            publisher(samples)
+        except eventlet.Timeout:
+            LOG.warning('Pollster %s timed out after %d seconds',
+                        pollster.name, cfg.CONF.central.pollster_timeout)
+        except Exception as err:
+            LOG.warning('Continue after error from %s: %s',
+                        pollster.name, err)
+            LOG.exception(err)
+
     def poll_and_publish(self):
         """Tasks to be run at a periodic interval."""
         with self.publish_context as publisher:
             # TODO(yjiang5) passing samples into get_samples to avoid
             # polling all counters one by one
-            cache = {}
+            cache = plugin.new_cache(p.obj for p in self.pollsters)
+            # Pollsters run concurrently so that a slow endpoint does not
+            # delay the others, and each one publishes its samples as soon
+            # as it is done.
+            pool = eventlet.GreenPool(cfg.CONF.central.pollster_workers)
             for pollster in self.pollsters:
-                try:
-                    LOG.info("Polling pollster %s", pollster.name)
-                    samples = list(pollster.obj.get_samples(
-                        self.manager,
-                        cache,
-                    ))
-                    publisher(samples)
-                except Exception as err:
-                    LOG.warning('Continue after error from %s: %s',
-                                pollster.name, err)
-                    LOG.exception(err)
+                pool.spawn_n(self._poll_and_publish_pollster,
+                             pollster, cache, publisher)
+            pool.waitall()
 
 
 class AgentManager(agent.AgentManager):
@@ -62,23 +98,52 @@ class AgentManager(agent.AgentManager):
             )
         )
 
+        self.keystone = None
+
+        url = cfg.CONF.central.membership_url
+        self.partition_coordinator = partition.PartitionCoordinator(
+            partition.get_backend(url) if url else None)
+
     def create_polling_task(self):
         return PollingTask(self)
 
+    def initialize_service_hook(self, service):
+        super(AgentManager, self).initialize_service_hook(service)
+        if self.partition_coordinator.backend is not None:
+            self.partition_coordinator.heartbeat()
+            self.service.tg.add_timer(
+                cfg.CONF.central.membership_heartbeat,
+                self.partition_coordinator.heartbeat)
+
+    def _keystone_expires_soon(self):
+        auth_ref = getattr(self.keystone, 'auth_ref', None)
+        return auth_ref is None or auth_ref.will_expire_soon(
+            cfg.CONF.central.keystone_token_expiry_margin)
+
     def interval_task(self, task):
-        self.keystone = ksclient.Client(
-            username=cfg.CONF.service_credentials.os_username,
-            password=cfg.CONF.service_credentials.os_password,
-            tenant_id=cfg.CONF.service_credentials.os_tenant_id,
-            tenant_name=cfg.CONF.service_credentials.os_tenant_name,
-            cacert=cfg.CONF.service_credentials.os_cacert,
-            auth_url=cfg.CONF.service_credentials.os_auth_url)
+        if self._keystone_expires_soon():
+            self.keystone = ksclient.Client(
+                username=cfg.CONF.service_credentials.os_username,
+                password=cfg.CONF.service_credentials.os_password,
+                tenant_id=cfg.CONF.service_credentials.os_tenant_id,
+                tenant_name=cfg.CONF.service_credentials.os_tenant_name,
+                cacert=cfg.CONF.service_credentials.os_cacert,
+                auth_url=cfg.CONF.service_credentials.os_auth_url)
 
         super(AgentManager, self).interval_task(task)
 
 
+class AgentService(rpc_service.Service):
+
+    def stop(self):
+        super(AgentService, self).stop()
+        # Hand the resources of this agent over to the other members
+        # right away rather than after the membership timeout.
+        self.manager.partition_coordinator.leave()
+
+
 def agent_central():
     service.prepare_service()
-    os_service.launch(rpc_service.Service(cfg.CONF.host,
-                                          'ceilometer.agent.central',
-                                          AgentManager())).wait()
+    os_service.launch(AgentService(cfg.CONF.host,
+                                   'ceilometer.agent.central',
+                                   AgentManager())).wait()
@@ -0,0 +1,240 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Partitioning of the polled resources between several central agents.
+
+Every central agent registers itself in a group membership backend and
+sends heartbeats to it. The live members are placed on a consistent hash
+ring, and each agent only polls the resources hashing to itself, so
+agents joining or leaving the group only move a small share of the
+resources around.
+"""
+
+import abc
+import bisect
+import hashlib
+import sqlite3
+import time
+import urlparse
+import uuid
+
+from oslo.config import cfg
+from stevedore import driver
+
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+OPTS = [
+    cfg.StrOpt('membership_url',
+               default=None,
+               help='URL of the group membership backend shared by the '
+                    'central agents, e.g. '
+                    'sqlite:////var/lib/ceilometer/central.db. When set, '
+                    'the polled resources are partitioned between the '
+                    'members of the group, otherwise this agent polls all '
+                    'of them'),
+    cfg.IntOpt('membership_heartbeat',
+               default=10,
+               help='Number of seconds between two heartbeats of this '
+                    'agent to the group membership backend'),
+    cfg.IntOpt('membership_timeout',
+               default=60,
+               help='Number of seconds without heartbeat after which an '
+                    'agent is considered to have left the group'),
+    cfg.IntOpt('partition_replicas',
+               default=100,
+               help='Number of points of each agent on the consistent '
+                    'hash ring'),
+]
+
+cfg.CONF.register_opts(OPTS, group='central')
+
+MEMBERSHIP_NAMESPACE = 'ceilometer.central.membership'
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys to members."""
+
+    def __init__(self, members, replicas=100):
+        self._ring = {}
+        for member in members:
+            for r in range(replicas):
+                self._ring[self._hash('%s-%d' % (member, r))] = member
+        self._sorted_keys = sorted(self._ring)
+
+    @staticmethod
+    def _hash(key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return int(hashlib.md5(str(key)).hexdigest(), 16)
+
+    def get_node(self, key):
+        """Return the member owning a key, or None if the ring is empty."""
+        if not self._sorted_keys:
+            return None
+        position = bisect.bisect(self._sorted_keys, self._hash(key))
+        return self._ring[self._sorted_keys[position %
+                                            len(self._sorted_keys)]]
+
+
+class MembershipBackend(object):
+    """Base class for group membership backends."""
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, url):
+        self.url = url
+
+    @abc.abstractmethod
+    def heartbeat(self, member_id):
+        """Record that a member is alive, joining the group if needed.
+
+        :param member_id: the identifier of the member
+        """
+
+    @abc.abstractmethod
+    def get_members(self, timeout):
+        """Return the sorted identifiers of the live members.
+
+        :param timeout: number of seconds since the last heartbeat after
+                        which a member is not considered alive anymore
+        """
+
+    @abc.abstractmethod
+    def leave(self, member_id):
+        """Remove a member from the group.
+
+        :param member_id: the identifier of the member
+        """
+
+
+class SQLiteMembership(MembershipBackend):
+    """Group membership stored in a SQLite database file.
+
+    This is meant for agents running on the same host or sharing a
+    filesystem, and for testing; "sqlite://" keeps the group in memory.
+    """
+
+    def __init__(self, url):
+        super(SQLiteMembership, self).__init__(url)
+        # sqlite:////abs/path.db and sqlite:///rel/path.db, as SQLAlchemy
+        path = urlparse.urlparse(url).path[1:] or ':memory:'
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS members '
+                              '(member_id TEXT PRIMARY KEY, '
+                              'heartbeat REAL NOT NULL)')
+
+    def heartbeat(self, member_id):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO members '
+                              'VALUES (?, ?)', (member_id, time.time()))
+
+    def get_members(self, timeout):
+        cursor = self.conn.execute('SELECT member_id FROM members '
+                                   'WHERE heartbeat >= ? '
+                                   'ORDER BY member_id',
+                                   (time.time() - timeout,))
+        return [row[0] for row in cursor]
+
+    def leave(self, member_id):
+        with self.conn:
+            self.conn.execute('DELETE FROM members WHERE member_id = ?',
+                              (member_id,))
+
+
+def get_backend(url):
+    """Load the membership backend handling an URL."""
+    name = urlparse.urlparse(url).scheme
+    LOG.debug(_('looking for %(name)r driver in %(namespace)r') %
+              {'name': name, 'namespace': MEMBERSHIP_NAMESPACE})
+    mgr = driver.DriverManager(MEMBERSHIP_NAMESPACE,
+                               name,
+                               invoke_on_load=True,
+                               invoke_args=(url,))
+    return mgr.driver
+
+
+class PartitionCoordinator(object):
+    """Split the polled resources between the members of the group.
+
+    Without backend, this agent is alone and owns every resource.
+    """
+
+    def __init__(self, backend=None, member_id=None):
+        self.backend = backend
+        self.member_id = member_id or '%s-%s' % (cfg.CONF.host,
+                                                 uuid.uuid4())
+        self._members = None
+        self._ring = None
+
+    def heartbeat(self):
+        if self.backend is None:
+            return
+        try:
+            self.backend.heartbeat(self.member_id)
+        except Exception:
+            LOG.exception(_('Unable to send heartbeat to the group '
+                            'membership backend'))
+
+    def leave(self):
+        if self.backend is None:
+            return
+        try:
+            self.backend.leave(self.member_id)
+        except Exception:
+            LOG.exception(_('Unable to leave the group membership backend'))
+
+    def _get_ring(self):
+        try:
+            members = self.backend.get_members(
+                cfg.CONF.central.membership_timeout)
+        except Exception:
+            LOG.exception(_('Unable to get the members of the group, '
+                            'keeping the previous partitioning'))
+            members = self._members or []
+        if self.member_id not in members:
+            members = sorted(members + [self.member_id])
+        if members != self._members:
+            LOG.info(_('Group members changed to %s, rebalancing') %
+                     members)
+            self._members = members
+            self._ring = HashRing(members,
+                                  cfg.CONF.central.partition_replicas)
+        return self._ring
+
+    def iter_my_subset(self, iterable, key=None):
+        """Iterate lazily over the items of an iterable owned by this
+        member.
+
+        :param iterable: the resources to partition
+        :param key: optional function returning the partitioning key of
+                    an item, which defaults to the item itself
+        """
+        if self.backend is None:
+            return iter(iterable)
+        ring = self._get_ring()
+        return (item for item in iterable
+                if ring.get_node(key(item) if key else item) ==
+                self.member_id)
+
+    def extract_my_subset(self, iterable, key=None):
+        """Return the items of an iterable owned by this member.
+
+        See iter_my_subset.
+        """
+        return list(self.iter_my_subset(iterable, key))
@@ -20,6 +20,8 @@
 
 from ceilometer import plugin
 
+get_cached = plugin.get_cached
+
 
 class CentralPollster(plugin.PollsterBase):
     """Base class for plugins that support the polling API."""
@@ -46,6 +46,7 @@ class DatabaseDispatcher(dispatcher.Base):
         if not isinstance(data, list):
             data = [data]
 
+        samples = []
         for meter in data:
             LOG.debug('metering data %s for %s @ %s: %s',
                       meter['counter_name'],
@@ -62,14 +63,29 @@ class DatabaseDispatcher(dispatcher.Base):
                     if meter.get('timestamp'):
                         ts = timeutils.parse_isotime(meter['timestamp'])
                         meter['timestamp'] = timeutils.normalize_time(ts)
-                    self.storage_conn.record_metering_data(meter)
                 except Exception as err:
                     LOG.exception('Failed to record metering data: %s', err)
+                else:
+                    samples.append(meter)
             else:
                 LOG.warning(
                     'message signature invalid, discarding message: %r',
                     meter)
 
+        if samples:
+            try:
+                self.storage_conn.record_metering_data_batch(samples)
+            except Exception as err:
+                LOG.warning('Failed to record %d samples at once, recording '
+                            'them one at a time: %s', len(samples), err)
+                # Only lose the samples that cannot be recorded
+                for meter in samples:
+                    try:
+                        self.storage_conn.record_metering_data(meter)
+                    except Exception as err:
+                        LOG.exception('Failed to record metering data: %s',
+                                      err)
+
     def record_events(self, events):
         if not isinstance(events, list):
             events = [events]
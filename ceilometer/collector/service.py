@@ -32,6 +32,7 @@ from ceilometer.openstack.common.rpc import service as rpc_service
 
 from ceilometer.openstack.common import timeutils
 from ceilometer import pipeline
+from ceilometer import plugin
 from ceilometer import storage
 from ceilometer.storage import models
 from ceilometer import transformer
@@ -53,6 +54,26 @@ OPTS = [
     cfg.MultiStrOpt('dispatcher',
                     default=['database'],
                     help='dispatcher to process metering data'),
+    cfg.IntOpt('workers',
+               default=1,
+               help='Number of collector processes consuming the '
+                    'notifications and metering messages'),
+    cfg.IntOpt('notification_batch_size',
+               default=1,
+               help='Number of samples generated from notifications to '
+                    'gather before pushing them through the pipelines. '
+                    'The notifications are acknowledged before their '
+                    'samples are published, so pending samples are lost '
+                    'if the collector dies'),
+    cfg.IntOpt('notification_batch_timeout',
+               default=5,
+               help='Number of seconds after which the pending samples '
+                    'are published even if the batch is not full'),
+    cfg.IntOpt('prefetch_count',
+               default=0,
+               help='Maximum number of unacknowledged messages delivered '
+                    'to the consumers of a collector process by RabbitMQ '
+                    '(the default of 0 implies no limit)'),
 ]
 
 cfg.CONF.register_opts(OPTS, group="collector")
@@ -121,10 +142,21 @@ class CollectorService(rpc_service.Service):
     COLLECTOR_NAMESPACE = 'ceilometer.collector'
     DISPATCHER_NAMESPACE = 'ceilometer.dispatcher'
 
+    def __init__(self, *args, **kwargs):
+        super(CollectorService, self).__init__(*args, **kwargs)
+        self.pending_samples = []
+
     def start(self):
         super(CollectorService, self).start()
         # Add a dummy thread to have wait() working
         self.tg.add_timer(604800, lambda: None)
+        if cfg.CONF.collector.notification_batch_size > 1:
+            self.tg.add_timer(cfg.CONF.collector.notification_batch_timeout,
+                              self.flush_samples)
+
+    def stop(self):
+        self.flush_samples()
+        super(CollectorService, self).stop()
 
     def initialize_service_hook(self, service):
         '''Consumers must be declared before consume_thread start.'''
@@ -147,6 +179,8 @@ class CollectorService(rpc_service.Service):
             LOG.warning('Failed to load any notification handlers for %s',
                         self.COLLECTOR_NAMESPACE)
         self.notification_manager.map(self._setup_subscription)
+        self.event_type_index = plugin.EventTypeIndex(
+            self.notification_manager)
 
         LOG.debug('loading dispatchers from %s',
                   self.DISPATCHER_NAMESPACE)
@@ -166,6 +200,28 @@ class CollectorService(rpc_service.Service):
             rpc_dispatcher.RpcDispatcher([self]),
             'ceilometer.collector.' + cfg.CONF.publisher_rpc.metering_topic,
         )
+        self._set_qos()
+
+    def _set_qos(self):
+        """Limit the number of messages prefetched by the consumers.
+
+        The limit is set on the channel of the kombu connection before
+        the consumers start, and again on the new channel opened when
+        the connection is reestablished. Other drivers are left alone.
+        """
+        prefetch_count = cfg.CONF.collector.prefetch_count
+        connection = getattr(self.conn, 'connection', None)
+        if prefetch_count <= 0 or not hasattr(connection, 'channel'):
+            return
+
+        reconnect = connection.reconnect
+
+        def reconnect_with_qos():
+            reconnect()
+            connection.channel.basic_qos(0, prefetch_count, False)
+
+        connection.reconnect = reconnect_with_qos
+        connection.channel.basic_qos(0, prefetch_count, False)
 
     def _setup_subscription(self, ext, *args, **kwds):
         """Connect to message bus to get notifications
@@ -214,13 +270,38 @@ class CollectorService(rpc_service.Service):
         bus, this method receives it. See _setup_subscription().
 
         """
-        LOG.debug('notification %r', notification.get('event_type'))
-        self.notification_manager.map(self._process_notification_for_ext,
-                                      notification=notification)
+        event_type = notification.get('event_type')
+        LOG.debug('notification %r', event_type)
+        # Gather the samples of every plugin handling this event type so
+        # that the pipelines are flushed once per batch of notifications
+        # rather than once per plugin.
+        samples = []
+        for ext in self.event_type_index.get_extensions(event_type):
+            try:
+                samples.extend(ext.obj.process_notification(notification))
+            except Exception:
+                LOG.exception(_('Error processing notification %(event)s '
+                                'with %(plugin)s') %
+                              {'event': event_type, 'plugin': ext.name})
+        if samples:
+            self.pending_samples.extend(samples)
+            if (len(self.pending_samples) >=
+                    cfg.CONF.collector.notification_batch_size):
+                self.flush_samples()
 
         if cfg.CONF.collector.store_events:
             self._message_to_event(notification)
 
+    def flush_samples(self):
+        """Push the pending samples through the pipelines at once."""
+        # NOTE: the list is swapped before publishing since the
+        # publishers may yield to other green threads adding samples.
+        samples, self.pending_samples = self.pending_samples, []
+        if samples:
+            with self.pipeline_manager.publisher(
+                    context.get_admin_context()) as p:
+                p(samples)
+
     @staticmethod
     def _extract_when(body):
         """Extract the generated datetime from the notification.
@@ -278,20 +359,12 @@ class CollectorService(rpc_service.Service):
         """
         ext.obj.record_metering_data(context, data)
 
-    def _process_notification_for_ext(self, ext, notification):
-        """Wrapper for calling pipelines when a notification arrives
-
-        When a message is received by process_notification(), it calls
-        this method with each notification plugin to allow all the
-        plugins process the notification.
-
-        """
-        with self.pipeline_manager.publisher(context.get_admin_context()) as p:
-            # FIXME(dhellmann): Spawn green thread?
-            p(list(ext.obj.to_samples(notification)))
-
 
 def collector():
     prepare_service()
+    workers = cfg.CONF.collector.workers
+    # Each worker process has its own AMQP connection and joins the same
+    # consumer pools, so the messages are shared between them.
     os_service.launch(CollectorService(cfg.CONF.host,
-                                       'ceilometer.collector')).wait()
+                                       'ceilometer.collector'),
+                      workers=workers if workers > 1 else None).wait()
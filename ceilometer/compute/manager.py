@@ -25,10 +25,82 @@ from ceilometer import nova_client
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import service as os_service
 from ceilometer.openstack.common.rpc import service as rpc_service
+from ceilometer.openstack.common import timeutils
 from ceilometer import service
 
 LOG = log.getLogger(__name__)
 
+OPTS = [
+    cfg.StrOpt('instance_discovery_method',
+               default='nova',
+               help='Method used to discover the instances to poll: '
+                    '"nova" lists them from the Nova API on every interval, '
+                    '"inventory" keeps a local inventory seeded from Nova '
+                    'and kept current with the hypervisor inspector'),
+    cfg.IntOpt('instance_inventory_resync_interval',
+               default=3600,
+               help='Number of seconds after which the local instance '
+                    'inventory is seeded again from Nova (0 means never)'),
+]
+
+cfg.CONF.register_opts(OPTS)
+
+
+class InstanceInventory(object):
+    """Local inventory of the instances hosted on this node.
+
+    The inventory is seeded with a single Nova listing. Afterwards only
+    the instances whose domain appeared or disappeared on the hypervisor
+    since the previous poll are looked up again in Nova, instead of
+    listing every instance and its flavor and image on each interval.
+    """
+
+    def __init__(self, nv, inspector):
+        self.nv = nv
+        self.inspector = inspector
+        self._instances = {}
+        self._active = set()
+        self._seeded_at = None
+
+    def _get_active(self):
+        return set(i.UUID for i in self.inspector.inspect_instances())
+
+    def _seed(self):
+        instances = self.nv.instance_get_all_by_host(cfg.CONF.host)
+        self._active = self._get_active()
+        self._instances = dict((i.id, i) for i in instances)
+        self._seeded_at = timeutils.utcnow()
+
+    def _refresh(self, uuid):
+        instance = self.nv.instance_get(uuid)
+        host = getattr(instance, 'OS-EXT-SRV-ATTR:host', cfg.CONF.host)
+        if instance is None or host != cfg.CONF.host:
+            LOG.debug('Removing instance %s from the inventory', uuid)
+            self._instances.pop(uuid, None)
+        else:
+            LOG.debug('Refreshing instance %s in the inventory', uuid)
+            self._instances[uuid] = instance
+        invalidate = getattr(self.inspector, 'invalidate_topology', None)
+        if invalidate:
+            invalidate(uuid)
+
+    def get_instances(self):
+        """Return the instances hosted on this node."""
+        resync = cfg.CONF.instance_inventory_resync_interval
+        if self._seeded_at is None or (
+                resync > 0 and
+                timeutils.is_older_than(self._seeded_at, resync)):
+            self._seed()
+        else:
+            active = self._get_active()
+            # Domains that started or stopped since the last poll
+            # (boot, deletion, migration, resize...) are the only ones
+            # that need their Nova metadata to be refreshed.
+            for uuid in active ^ self._active:
+                self._refresh(uuid)
+            self._active = active
+        return self._instances.values()
+
 
 class PollingTask(agent.PollingTask):
     def poll_and_publish_instances(self, instances):
@@ -53,7 +125,7 @@ class PollingTask(agent.PollingTask):
 
     def poll_and_publish(self):
         try:
-            instances = self.manager.nv.instance_get_all_by_host(cfg.CONF.host)
+            instances = self.manager.get_instances()
         except Exception as err:
             LOG.exception('Unable to retrieve instances: %s', err)
         else:
@@ -71,10 +143,17 @@ class AgentManager(agent.AgentManager):
         )
         self._inspector = virt_inspector.get_hypervisor_inspector()
         self.nv = nova_client.Client()
+        self.inventory = InstanceInventory(self.nv, self._inspector)
 
     def create_polling_task(self):
         return PollingTask(self)
 
+    def get_instances(self):
+        """Return the instances to poll on this host."""
+        if cfg.CONF.instance_discovery_method == 'inventory':
+            return self.inventory.get_instances()
+        return self.nv.instance_get_all_by_host(cfg.CONF.host)
+
     def setup_notifier_task(self):
         """For nova notifier usage."""
         task = PollingTask(self)
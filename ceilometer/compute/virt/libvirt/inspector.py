@@ -22,6 +22,7 @@ from oslo.config import cfg
 
 from ceilometer.compute.virt import inspector as virt_inspector
 from ceilometer.openstack.common import log as logging
+from ceilometer.openstack.common import timeutils
 
 libvirt = None
 
@@ -36,6 +37,11 @@ libvirt_opts = [
                default='',
                help='Override the default libvirt URI '
                     '(which is dependent on libvirt_type)'),
+    cfg.IntOpt('libvirt_topology_cache_ttl',
+               default=600,
+               help='Number of seconds the parsed device topology of a '
+                    'domain is reused before its XML description is read '
+                    'again (0 disables the cache)'),
 ]
 
 CONF = cfg.CONF
@@ -49,6 +55,10 @@ class LibvirtInspector(virt_inspector.Inspector):
     def __init__(self):
         self.uri = self._get_uri()
         self.connection = None
+        # Parsed device topology per domain UUID, see _get_topology()
+        self._topology_cache = {}
+        self.topology_cache_hits = 0
+        self.topology_cache_misses = 0
 
     def _get_uri(self):
         return CONF.libvirt_uri or self.per_type_uris.get(CONF.libvirt_type,
@@ -97,7 +107,7 @@ class LibvirtInspector(virt_inspector.Inspector):
                     if domain_id != 0:
                         domain = self._get_connection().lookupByID(domain_id)
                         yield virt_inspector.Instance(name=domain.name(),
-                                                      uuid=domain.UUIDString())
+                                                      UUID=domain.UUIDString())
                 except libvirt.libvirtError:
                     # Instance was deleted while listing... ignore it
                     pass
@@ -107,9 +117,16 @@ class LibvirtInspector(virt_inspector.Inspector):
         (_, _, _, num_cpu, cpu_time) = domain.info()
         return virt_inspector.CPUStats(number=num_cpu, time=cpu_time)
 
-    def inspect_vnics(self, instance_name):
-        domain = self._lookup_by_name(instance_name)
-        tree = etree.fromstring(domain.XMLDesc(0))
+    @staticmethod
+    def _parse_topology(xml):
+        """Extract the vNICs and disk devices from a domain XML description.
+
+        :param xml: the XML description of the domain
+        :return: a tuple of the list of Interfaces and the list of disk
+                 device names
+        """
+        tree = etree.fromstring(xml)
+        interfaces = []
         for iface in tree.findall('devices/interface'):
             target = iface.find('target')
             if target is not None:
@@ -127,10 +144,77 @@ class LibvirtInspector(virt_inspector.Inspector):
 
             params = dict((p.get('name').lower(), p.get('value'))
                           for p in iface.findall('filterref/parameter'))
-            interface = virt_inspector.Interface(name=name, mac=mac_address,
-                                                 fref=fref, parameters=params)
+            interfaces.append(virt_inspector.Interface(name=name,
+                                                       mac=mac_address,
+                                                       fref=fref,
+                                                       parameters=params))
+        disks = [target.get('dev')
+                 for target in tree.findall('devices/disk/target')
+                 if target.get('dev')]
+        return interfaces, disks
+
+    def _get_topology(self, domain):
+        """Return the (possibly cached) device topology of a domain.
+
+        The topology is cached per domain UUID along with the domain ID,
+        which libvirt changes whenever the domain is restarted or migrated,
+        so those lifecycle changes invalidate the entry without having to
+        fetch the XML. Entries also expire after libvirt_topology_cache_ttl
+        seconds to pick up hot-plugged devices, and the expired entries are
+        dropped whenever a topology is parsed, so that the domains which
+        are gone do not stay in the cache.
+        """
+        ttl = CONF.libvirt_topology_cache_ttl
+        if ttl <= 0:
+            self.topology_cache_misses += 1
+            return self._parse_topology(domain.XMLDesc(0))
+
+        uuid = domain.UUIDString()
+        generation = domain.ID()
+        entry = self._topology_cache.get(uuid)
+        if (entry is not None and entry['generation'] == generation and
+                not timeutils.is_older_than(entry['timestamp'], ttl)):
+            self.topology_cache_hits += 1
+            return entry['topology']
+
+        self.topology_cache_misses += 1
+        topology = self._parse_topology(domain.XMLDesc(0))
+        self._prune_topology_cache(ttl)
+        self._topology_cache[uuid] = {'generation': generation,
+                                      'timestamp': timeutils.utcnow(),
+                                      'topology': topology}
+        return topology
+
+    def _prune_topology_cache(self, ttl):
+        """Drop the cached topologies older than ttl seconds."""
+        for uuid, entry in self._topology_cache.items():
+            if timeutils.is_older_than(entry['timestamp'], ttl):
+                del self._topology_cache[uuid]
+
+    def invalidate_topology(self, uuid=None):
+        """Drop the cached device topology of a domain.
+
+        :param uuid: the UUID of the domain, or None to drop all the
+                     cached topologies
+        """
+        if uuid is None:
+            self._topology_cache.clear()
+        else:
+            self._topology_cache.pop(uuid, None)
+
+    def get_topology_cache_stats(self):
+        """Return the hit and miss counters of the topology cache."""
+        return {'hits': self.topology_cache_hits,
+                'misses': self.topology_cache_misses,
+                'size': len(self._topology_cache)}
+
+    def inspect_vnics(self, instance_name):
+        domain = self._lookup_by_name(instance_name)
+        interfaces, _ = self._get_topology(domain)
+        for interface in interfaces:
             rx_bytes, rx_packets, _, _, \
-                tx_bytes, tx_packets, _, _ = domain.interfaceStats(name)
+                tx_bytes, tx_packets, _, _ = domain.interfaceStats(
+                    interface.name)
             stats = virt_inspector.InterfaceStats(rx_bytes=rx_bytes,
                                                   rx_packets=rx_packets,
                                                   tx_bytes=tx_bytes,
@@ -139,11 +223,8 @@ class LibvirtInspector(virt_inspector.Inspector):
 
     def inspect_disks(self, instance_name):
         domain = self._lookup_by_name(instance_name)
-        tree = etree.fromstring(domain.XMLDesc(0))
-        for device in filter(
-                bool,
-                [target.get("dev")
-                 for target in tree.findall('devices/disk/target')]):
+        _, devices = self._get_topology(domain)
+        for device in devices:
             disk = virt_inspector.Disk(device=device)
             block_stats = domain.blockStats(device)
             stats = virt_inspector.DiskStats(read_requests=block_stats[0],
@@ -15,6 +15,8 @@
 # under the License.
 
 import datetime
+import operator
+
 from oslo.config import cfg
 
 from keystoneclient import exceptions
@@ -64,11 +66,17 @@ class _Base(plugin.CentralPollster):
 
     CACHE_KEY_PROBE = 'kwapi.probes'
 
-    def _iter_probes(self, ksclient, cache):
-        """Iterate over all probes."""
-        if self.CACHE_KEY_PROBE not in cache:
-            cache[self.CACHE_KEY_PROBE] = self._get_probes(ksclient)
-        return iter(cache[self.CACHE_KEY_PROBE])
+    def _iter_probes(self, ksclient, cache, partition_coordinator=None):
+        """Iterate over the probes polled by this agent."""
+        def get_probes():
+            probes = self._get_probes(ksclient)
+            if partition_coordinator is not None:
+                probes = partition_coordinator.extract_my_subset(
+                    probes, key=operator.itemgetter('id'))
+            return probes
+
+        return iter(plugin.get_cached(cache, self.CACHE_KEY_PROBE,
+                                      get_probes))
 
     def _get_probes(self, ksclient):
         try:
@@ -84,7 +92,8 @@ class EnergyPollster(_Base):
 
     def get_samples(self, manager, cache):
         """Returns all samples."""
-        for probe in self._iter_probes(manager.keystone, cache):
+        for probe in self._iter_probes(manager.keystone, cache,
+                                       manager.partition_coordinator):
             yield sample.Sample(
                 name='energy',
                 type=sample.TYPE_CUMULATIVE,
@@ -104,7 +113,8 @@ class PowerPollster(_Base):
 
     def get_samples(self, manager, cache):
         """Returns all samples."""
-        for probe in self._iter_probes(manager.keystone, cache):
+        for probe in self._iter_probes(manager.keystone, cache,
+                                       manager.partition_coordinator):
             yield sample.Sample(
                 name='power',
                 type=sample.TYPE_GAUGE,
@@ -20,7 +20,10 @@
 
 from __future__ import absolute_import
 
-import itertools
+import collections
+import operator
+
+from eventlet import semaphore
 import glanceclient
 from oslo.config import cfg
 
@@ -28,6 +31,92 @@ from ceilometer import sample
 from ceilometer.openstack.common import timeutils
 from ceilometer import plugin
 
+OPTS = [
+    cfg.IntOpt('glance_page_size',
+               default=20,
+               help='Number of images requested to glance in each page '
+                    'while polling'),
+]
+
+cfg.CONF.register_opts(OPTS)
+
+_Image = collections.namedtuple('_Image', ['id', 'owner', 'size',
+                                           'metadata'])
+
+
+class _SharedIterator(object):
+    """Items of an iterator, shared by several readers.
+
+    The items are only taken from the iterator, and so the glance pages
+    fetched, when the first reader gets to them. When the number of
+    readers is known, the items are dropped once they all passed them.
+    An error of the iterator is raised to every reader getting to it,
+    rather than ending their iteration early.
+    """
+
+    def __init__(self, iterator, readers=None):
+        self._iterator = iterator
+        self._items = collections.deque()
+        # Position of the first item kept in the iteration
+        self._offset = 0
+        # Number of the readers not started yet, None if unknown
+        self._pending = readers
+        # Positions of the started readers in the iteration
+        self._positions = {}
+        self._done = False
+        self._error = None
+        self._lock = semaphore.Semaphore()
+
+    def reader(self):
+        """Return a new iterator over the items.
+
+        Returns None once items were dropped, as it could not get them.
+        """
+        if self._offset:
+            return None
+        if self._pending:
+            self._pending -= 1
+        reader = object()
+        self._positions[reader] = 0
+        return self._read(reader)
+
+    def _drop_passed(self):
+        if self._pending is None or self._pending > 0:
+            return
+        end = self._offset + len(self._items)
+        first = min(self._positions.values()) if self._positions else end
+        while self._offset < first:
+            self._items.popleft()
+            self._offset += 1
+
+    def _read(self, reader):
+        try:
+            while True:
+                with self._lock:
+                    position = self._positions[reader]
+                    if (position == self._offset + len(self._items) and
+                            not self._done and self._error is None):
+                        try:
+                            self._items.append(next(self._iterator))
+                        except StopIteration:
+                            self._done = True
+                        except BaseException as err:
+                            # Timeouts included, the iterator is over
+                            self._error = err
+                    if position == self._offset + len(self._items):
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    item = self._items[position - self._offset]
+                    self._positions[reader] = position + 1
+                    self._drop_passed()
+                yield item
+        finally:
+            # Not locked, as it may run when the reader is garbage
+            # collected; no other greenthread runs meanwhile.
+            del self._positions[reader]
+            self._drop_passed()
+
 
 class _Base(plugin.PollsterBase):
 
@@ -43,14 +132,6 @@ class _Base(plugin.PollsterBase):
 
     def _get_images(self, ksclient):
         client = self.get_glance_client(ksclient)
-        #TODO(eglynn): use pagination to protect against unbounded
-        #              memory usage
-        rawImageList = list(itertools.chain(
-            client.images.list(filters={"is_public": True}),
-            #TODO(eglynn): extend glance API with all_tenants logic to
-            #              avoid second call to retrieve private images
-            client.images.list(filters={"is_public": False})))
-
         # When retrieving images from glance, glance will check
         # whether the user is of 'admin_role' which is
         # configured in glance-api.conf. If the user is of
@@ -61,20 +142,42 @@ class _Base(plugin.PollsterBase):
         # As a result, if the user/tenant has an admin role
         # for ceilometer to collect image list,
         # the _Base.iter_images method will return a image list
-        # which contains duplicate images. Add the following
-        # code to avoid recording down duplicate image events.
-        imageIdSet = set(image.id for image in rawImageList)
-
-        for image in rawImageList:
-            if image.id in imageIdSet:
-                imageIdSet -= set([image.id])
-                yield image
-
-    def _iter_images(self, ksclient, cache):
-        """Iterate over all images."""
-        if 'images' not in cache:
-            cache['images'] = list(self._get_images(ksclient))
-        return iter(cache['images'])
+        # which contains duplicate images. Skip the images already
+        # seen to avoid recording down duplicate image events.
+        seen = set()
+        #TODO(eglynn): extend glance API with all_tenants logic to
+        #              avoid second call to retrieve private images
+        for is_public in (True, False):
+            # glanceclient fetches the next page only once the previous
+            # one is consumed
+            for image in client.images.list(
+                    filters={"is_public": is_public},
+                    page_size=cfg.CONF.glance_page_size):
+                if image.id not in seen:
+                    seen.add(image.id)
+                    yield image
+
+    def _iter_images(self, ksclient, cache, partition_coordinator=None):
+        """Iterate over the images polled by this agent."""
+        def get_images():
+            images = self._get_images(ksclient)
+            if partition_coordinator is not None:
+                images = partition_coordinator.iter_my_subset(
+                    images, key=operator.attrgetter('id'))
+            # Only keep what the pollsters need rather than the whole
+            # glanceclient resources.
+            return _SharedIterator(
+                (_Image(image.id, image.owner, image.size,
+                        self.extract_image_metadata(image))
+                 for image in images),
+                plugin.count_cache_readers(cache, _Base))
+
+        images = plugin.get_cached(cache, 'images', get_images).reader()
+        if images is None:
+            # More readers than expected, the first images are gone
+            cache['images'] = get_images()
+            images = cache['images'].reader()
+        return images
 
     @staticmethod
     def extract_image_metadata(image):
@@ -102,7 +205,8 @@ class _Base(plugin.PollsterBase):
 class ImagePollster(_Base):
 
     def get_samples(self, manager, cache):
-        for image in self._iter_images(manager.keystone, cache):
+        for image in self._iter_images(manager.keystone, cache,
+                                       manager.partition_coordinator):
             yield sample.Sample(
                 name='image',
                 type=sample.TYPE_GAUGE,
@@ -112,14 +216,15 @@ class ImagePollster(_Base):
                 project_id=image.owner,
                 resource_id=image.id,
                 timestamp=timeutils.isotime(),
-                resource_metadata=self.extract_image_metadata(image),
+                resource_metadata=image.metadata,
             )
 
 
 class ImageSizePollster(_Base):
 
     def get_samples(self, manager, cache):
-        for image in self._iter_images(manager.keystone, cache):
+        for image in self._iter_images(manager.keystone, cache,
+                                       manager.partition_coordinator):
             yield sample.Sample(
                 name='image.size',
                 type=sample.TYPE_GAUGE,
@@ -129,5 +234,5 @@ class ImageSizePollster(_Base):
                 project_id=image.owner,
                 resource_id=image.id,
                 timestamp=timeutils.isotime(),
-                resource_metadata=self.extract_image_metadata(image),
+                resource_metadata=image.metadata,
             )
@@ -19,6 +19,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import operator
+
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import timeutils
 
@@ -35,13 +37,20 @@ class FloatingIPPollster(plugin.CentralPollster):
         nv = nova_client.Client()
         return nv.floating_ip_get_all()
 
-    def _iter_floating_ips(self, cache):
-        if 'floating_ips' not in cache:
-            cache['floating_ips'] = list(self._get_floating_ips())
-        return iter(cache['floating_ips'])
+    def _iter_floating_ips(self, cache, partition_coordinator=None):
+        def get_floating_ips():
+            ips = self._get_floating_ips()
+            if partition_coordinator is not None:
+                return partition_coordinator.extract_my_subset(
+                    ips, key=operator.attrgetter('id'))
+            return list(ips)
+
+        return iter(plugin.get_cached(cache, 'floating_ips',
+                                      get_floating_ips))
 
     def get_samples(self, manager, cache):
-        for ip in self._iter_floating_ips(cache):
+        for ip in self._iter_floating_ips(cache,
+                                          manager.partition_coordinator):
             self.LOG.info("FLOATING IP USAGE: %s" % ip.ip)
             # FIXME (flwang) Now Nova API /os-floating-ips can't provide those
             # attributes were used by Ceilometer, such as project id, host.
@@ -21,7 +21,17 @@ from novaclient.v1_1 import client as nova_client
 from oslo.config import cfg
 
 from ceilometer.openstack.common import log
+from ceilometer.openstack.common import timeutils
 
+OPTS = [
+    cfg.IntOpt('nova_metadata_cache_ttl',
+               default=300,
+               help='Number of seconds flavor and image lookups made by '
+                    'the Nova client are cached, including the ones not '
+                    'found (0 disables the cache)'),
+]
+
+cfg.CONF.register_opts(OPTS)
 cfg.CONF.import_group('service_credentials', 'ceilometer.service')
 
 LOG = log.getLogger(__name__)
@@ -54,6 +64,43 @@ class Client(object):
             endpoint_type=conf.os_endpoint_type,
             cacert=conf.os_cacert,
             no_cache=True)
+        # Flavors and images looked up by id, shared by all the polling
+        # tasks using this client, see _cached_get()
+        self._flavors = {}
+        self._images = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _cached_get(self, cache, manager, key):
+        """Get a resource by id from a novaclient manager through a cache.
+
+        :param cache: the dict caching the resources of that manager
+        :param manager: the novaclient manager, e.g. flavors or images
+        :param key: the id of the resource
+        :return: the resource, or None if it was not found
+        """
+        ttl = cfg.CONF.nova_metadata_cache_ttl
+        entry = cache.get(key)
+        if entry is not None and not timeutils.is_older_than(entry[0], ttl):
+            self.cache_hits += 1
+            return entry[1]
+
+        self.cache_misses += 1
+        try:
+            value = manager.get(key)
+        except novaclient.exceptions.NotFound:
+            value = None
+        if ttl > 0:
+            cache[key] = (timeutils.utcnow(), value)
+        return value
+
+    def get_cache_stats(self):
+        """Return the hit and miss counters of the flavor and image cache."""
+        lookups = self.cache_hits + self.cache_misses
+        return {'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'hit_rate': (float(self.cache_hits) / lookups
+                             if lookups else 0.0)}
 
     def _with_flavor_and_image(self, instances):
         for instance in instances:
@@ -64,10 +111,8 @@ class Client(object):
 
     def _with_flavor(self, instance):
         fid = instance.flavor['id']
-        try:
-            flavor = self.nova_client.flavors.get(fid)
-        except novaclient.exceptions.NotFound:
-            flavor = None
+        flavor = self._cached_get(self._flavors,
+                                  self.nova_client.flavors, fid)
 
         attr_defaults = [('name', 'unknown-id-%s' % fid),
                          ('vcpus', 0), ('ram', 0), ('disk', 0),
@@ -81,9 +126,8 @@ class Client(object):
 
     def _with_image(self, instance):
         iid = instance.image['id']
-        try:
-            image = self.nova_client.images.get(iid)
-        except novaclient.exceptions.NotFound:
+        image = self._cached_get(self._images, self.nova_client.images, iid)
+        if image is None:
             instance.image['name'] = 'unknown-id-%s' % iid
             instance.kernel_id = None
             instance.ramdisk_id = None
@@ -104,6 +148,15 @@ class Client(object):
             detailed=True,
             search_opts=search_opts))
 
+    @logged
+    def instance_get(self, uuid):
+        """Returns the instance with the given UUID, or None if not found."""
+        try:
+            instance = self.nova_client.servers.get(uuid)
+        except novaclient.exceptions.NotFound:
+            return None
+        return self._with_flavor_and_image([instance])[0]
+
     @logged
     def floating_ip_get_all(self):
         """Returns all floating ips."""
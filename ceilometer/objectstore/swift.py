@@ -20,6 +20,11 @@
 
 from __future__ import absolute_import
 
+import functools
+import operator
+
+import eventlet
+from eventlet import pools
 from oslo.config import cfg
 from swiftclient import client as swift
 from keystoneclient import exceptions
@@ -30,7 +35,7 @@ from ceilometer.openstack.common import log
 from ceilometer.openstack.common import timeutils
 from ceilometer import plugin
 
-from urlparse import urljoin
+from urlparse import urljoin, urlparse
 
 
 LOG = log.getLogger(__name__)
@@ -40,25 +45,54 @@ OPTS = [
                default='AUTH_',
                help="Swift reseller prefix. Must be on par with "
                "reseller_prefix in proxy-server.conf."),
+    cfg.IntOpt('swift_account_workers',
+               default=8,
+               help="Number of concurrent Swift account HEAD requests, "
+               "which is also the number of keep-alive connections "
+               "opened to the Swift endpoint."),
+    cfg.IntOpt('swift_account_timeout',
+               default=30,
+               help="Number of seconds after which a Swift account HEAD "
+               "request is abandoned (0 means no timeout)."),
 ]
 
 cfg.CONF.register_opts(OPTS)
 
 
+class _ConnectionPool(pools.Pool):
+    """Pool of keep-alive HTTP connections to a Swift endpoint."""
+
+    def __init__(self, url, max_size):
+        self.url = url
+        super(_ConnectionPool, self).__init__(max_size=max_size)
+
+    def create(self):
+        return swift.http_connection(self.url)[1]
+
+    def close(self):
+        while self.free_items:
+            self.free_items.popleft().close()
+
+
 class _Base(plugin.PollsterBase):
 
     CACHE_KEY_TENANT = 'tenants'
     CACHE_KEY_HEAD = 'swift.head_account'
 
-    def _iter_accounts(self, ksclient, cache):
-        if self.CACHE_KEY_TENANT not in cache:
-            cache[self.CACHE_KEY_TENANT] = ksclient.tenants.list()
-        if self.CACHE_KEY_HEAD not in cache:
-            cache[self.CACHE_KEY_HEAD] = list(self._get_account_info(ksclient,
-                                                                     cache))
-        return iter(cache[self.CACHE_KEY_HEAD])
+    def _iter_accounts(self, ksclient, cache, partition_coordinator=None):
+        def head_accounts():
+            tenants = plugin.get_cached(cache, self.CACHE_KEY_TENANT,
+                                        ksclient.tenants.list)
+            if partition_coordinator is not None:
+                # Only HEAD the accounts this agent is responsible for
+                tenants = partition_coordinator.extract_my_subset(
+                    tenants, key=operator.attrgetter('id'))
+            return list(self._get_account_info(ksclient, tenants))
+
+        return iter(plugin.get_cached(cache, self.CACHE_KEY_HEAD,
+                                      head_accounts))
 
-    def _get_account_info(self, ksclient, cache):
+    def _get_account_info(self, ksclient, tenants):
         try:
             endpoint = ksclient.service_catalog.url_for(
                 service_type='object-store',
@@ -67,9 +101,43 @@ class _Base(plugin.PollsterBase):
             LOG.debug(_("Swift endpoint not found"))
             raise StopIteration()
 
-        for t in cache['tenants']:
-            yield (t.id, swift.head_account(self._neaten_url(endpoint, t.id),
-                                            ksclient.auth_token))
+        workers = max(cfg.CONF.swift_account_workers, 1)
+        conn_pool = _ConnectionPool(endpoint, workers)
+        head = functools.partial(self._head_account, conn_pool, endpoint,
+                                 ksclient.auth_token)
+        try:
+            for result in eventlet.GreenPool(workers).imap(
+                    head, [t.id for t in tenants]):
+                if result is not None:
+                    yield result
+        finally:
+            conn_pool.close()
+
+    def _head_account(self, conn_pool, endpoint, token, tenant_id):
+        """HEAD the account of a tenant using a pooled connection.
+
+        A failing or timed out request only skips the tenant, so the
+        accounts fetched successfully are still published.
+        """
+        url = self._neaten_url(endpoint, tenant_id)
+        with conn_pool.item() as conn:
+            timeout = eventlet.Timeout(cfg.CONF.swift_account_timeout or None)
+            try:
+                account = swift.head_account(url, token,
+                                             http_conn=(urlparse(url), conn))
+            except (Exception, eventlet.Timeout) as err:
+                if isinstance(err, eventlet.Timeout) and err is not timeout:
+                    raise
+                # The connection is in an unknown state, httplib will
+                # open a new one on the next request.
+                conn.close()
+                LOG.warning(_("Unable to get Swift account of tenant "
+                              "%(tenant)s: %(err)s") %
+                            {'tenant': tenant_id, 'err': err})
+                return None
+            finally:
+                timeout.cancel()
+        return tenant_id, account
 
     @staticmethod
     def _neaten_url(endpoint, tenant_id):
@@ -83,7 +151,8 @@ class ObjectsPollster(_Base):
     """
 
     def get_samples(self, manager, cache):
-        for tenant, account in self._iter_accounts(manager.keystone, cache):
+        for tenant, account in self._iter_accounts(
+                manager.keystone, cache, manager.partition_coordinator):
             yield sample.Sample(
                 name='storage.objects',
                 type=sample.TYPE_GAUGE,
@@ -102,7 +171,8 @@ class ObjectsSizePollster(_Base):
     """
 
     def get_samples(self, manager, cache):
-        for tenant, account in self._iter_accounts(manager.keystone, cache):
+        for tenant, account in self._iter_accounts(
+                manager.keystone, cache, manager.partition_coordinator):
             yield sample.Sample(
                 name='storage.objects.size',
                 type=sample.TYPE_GAUGE,
@@ -121,7 +191,8 @@ class ObjectsContainersPollster(_Base):
     """
 
     def get_samples(self, manager, cache):
-        for tenant, account in self._iter_accounts(manager.keystone, cache):
+        for tenant, account in self._iter_accounts(
+                manager.keystone, cache, manager.partition_coordinator):
             yield sample.Sample(
                 name='storage.objects.containers',
                 type=sample.TYPE_GAUGE,
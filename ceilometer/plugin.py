@@ -21,6 +21,9 @@
 import abc
 import collections
 import fnmatch
+import re
+
+from eventlet import semaphore
 from oslo.config import cfg
 
 # Import this option so every Notification plugin can use it freely.
@@ -31,6 +34,42 @@ cfg.CONF.import_opt('notification_topics',
 ExchangeTopics = collections.namedtuple('ExchangeTopics',
                                         ['exchange', 'topics'])
 
+# Key of the cache entry holding the locks of the other entries
+_CACHE_LOCKS = '_locks'
+# Key of the cache entry holding the pollsters sharing the cache
+_CACHE_POLLSTERS = '_pollsters'
+
+
+def new_cache(pollsters):
+    """Return the cache shared by the pollsters of a polling cycle."""
+    return {_CACHE_POLLSTERS: list(pollsters)}
+
+
+def count_cache_readers(cache, cls):
+    """Return how many pollsters of the cache are instances of cls, so that
+    the entries they share can be released once they all used them.
+
+    Returns None if the pollsters of the cache are unknown.
+    """
+    pollsters = cache.get(_CACHE_POLLSTERS)
+    if pollsters is None:
+        return None
+    return len([p for p in pollsters if isinstance(p, cls)])
+
+
+def get_cached(cache, key, fill):
+    """Return the cache entry of key, calling fill() to set it if missing.
+
+    The pollsters of a polling cycle run concurrently and share the cache,
+    so the entry is set under a lock of its own: the other pollsters
+    wait for the first one to fill it instead of fetching it again.
+    """
+    locks = cache.setdefault(_CACHE_LOCKS, {})
+    with locks.setdefault(key, semaphore.Semaphore()):
+        if key not in cache:
+            cache[key] = fill()
+    return cache[key]
+
 
 class PluginBase(object):
     """Base class for all plugins.
@@ -85,6 +124,49 @@ class NotificationBase(PluginBase):
         return []
 
 
+class EventTypeIndex(object):
+    """Route event types to the notification plugins handling them.
+
+    Event types without wildcard are looked up in a dict, the wildcard
+    ones are compiled into one regular expression per plugin, and the
+    plugins matching a given event type are memoized.
+    """
+
+    WILDCARDS = re.compile(r'[*?[]')
+
+    def __init__(self, extensions):
+        self.extensions = list(extensions)
+        self._exact = collections.defaultdict(set)
+        self._wildcards = []
+        for ext in self.extensions:
+            patterns = []
+            for event_type in ext.obj.event_types:
+                if self.WILDCARDS.search(event_type):
+                    patterns.append(fnmatch.translate(event_type))
+                else:
+                    self._exact[event_type].add(ext)
+            if patterns:
+                self._wildcards.append((ext, re.compile('|'.join(patterns))))
+        self._matches = {}
+
+    def get_extensions(self, event_type):
+        """Return the extensions handling an event type, in load order.
+
+        :param event_type: The event type of the notification.
+        """
+        try:
+            return self._matches[event_type]
+        except KeyError:
+            pass
+        handlers = set(self._exact.get(event_type, ()))
+        if event_type is not None:
+            handlers.update(ext for ext, regex in self._wildcards
+                            if regex.match(event_type))
+        matches = [ext for ext in self.extensions if ext in handlers]
+        self._matches[event_type] = matches
+        return matches
+
+
 class PollsterBase(PluginBase):
     """Base class for plugins that support the polling API."""
 
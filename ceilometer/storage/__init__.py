@@ -19,11 +19,13 @@
 """
 
 
+import time
 import urlparse
 
 from oslo.config import cfg
 from stevedore import driver
 
+from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer import utils
 from ceilometer import service
@@ -49,6 +51,41 @@ STORAGE_OPTS = [
                default=-1,
                help="""number of seconds that samples are kept
 in the database for (<= 0 means forever)"""),
+    cfg.IntOpt('expirer_batch_size',
+               default=10000,
+               help="number of expired samples deleted per transaction, "
+                    "by the drivers deleting them in batches"),
+    cfg.StrOpt('meter_partition_period',
+               default=None,
+               help="period of the time range partitions of the SQL meter "
+                    "table, daily or weekly (none if unset), the expirer "
+                    "dropping the expired partitions as a whole"),
+    cfg.BoolOpt('deduplicate_metadata',
+                default=False,
+                help="store each distinct resource metadata of the SQL "
+                     "samples once, rather than in every sample"),
+    cfg.BoolOpt('compress_metadata',
+                default=False,
+                help="compress the deduplicated resource metadata"),
+    cfg.IntOpt('hbase_pool_size',
+               default=10,
+               help="number of connections of the HBase connection pool"),
+    cfg.IntOpt('hbase_batch_size',
+               default=1000,
+               help="number of samples sent to HBase at once"),
+    cfg.IntOpt('hbase_cache_size',
+               default=10000,
+               help="number of users, projects and resources whose state "
+                    "is remembered by an HBase connection, so that it is "
+                    "not read nor written again"),
+    cfg.IntOpt('hbase_meter_buckets',
+               default=0,
+               help="number of buckets, up to 999, the HBase meter rows "
+                    "are spread over so that the writes of a meter do not "
+                    "all go to one region (0 means no buckets); the rows "
+                    "are moved by ceilometer-hbase-rekey after a change, "
+                    "which also reindexes the metadata of the rows written "
+                    "before nested metaqueries were supported"),
 ]
 
 cfg.CONF.register_opts(STORAGE_OPTS, group='database')
@@ -125,13 +162,19 @@ class EventFilter(object):
                     't_datetime': <value>
                     't_float': <value>}
                    currently, only one trait dict is supported.
+    :param limit: maximum number of events to return. None for all.
+    :param marker: message_id of the last event of the previous page, the
+                   events generated after it are returned.
     """
 
-    def __init__(self, start, end, event_name=None, traits={}):
+    def __init__(self, start, end, event_name=None, traits={}, limit=None,
+                 marker=None):
         self.start = utils.sanitize_timestamp(start)
         self.end = utils.sanitize_timestamp(end)
         self.event_name = event_name
         self.traits = traits
+        self.limit = limit
+        self.marker = marker
 
 
 def dbsync():
@@ -143,5 +186,26 @@ def expirer():
     service.prepare_service()
     LOG.debug("Clearing expired metering data")
     storage_conn = get_connection(cfg.CONF)
-    storage_conn.clear_expired_metering_data(
+    start = time.time()
+    count = storage_conn.clear_expired_metering_data(
         cfg.CONF.database.time_to_live)
+    duration = time.time() - start
+    if count is None:
+        LOG.info(_("Cleared expired metering data in %.2fs") % duration)
+    else:
+        LOG.info(_("Cleared %(count)d expired samples in %(duration).2fs "
+                   "(%(rate).1f samples/s)") %
+                 {'count': count, 'duration': duration,
+                  'rate': count / duration if duration else 0.0})
+
+
+def rekey():
+    """Move the HBase meter rows to the configured number of buckets, and
+    rewrite the metadata columns of the rows in the current format.
+    """
+    service.prepare_service()
+    storage_conn = get_connection(cfg.CONF)
+    LOG.info(_("Moving the meter rows to %d buckets") %
+             cfg.CONF.database.hbase_meter_buckets)
+    count = storage_conn.rekey_meter_rows()
+    LOG.info(_("Moved or rewrote %d meter rows") % count)
@@ -22,8 +22,12 @@ import abc
 import datetime
 import math
 
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
 from ceilometer.openstack.common import timeutils
 
+LOG = log.getLogger(__name__)
+
 
 def iter_period(start, end, period):
     """Split a time from start to end in periods of a number of seconds. This
@@ -135,6 +139,25 @@ class Connection(object):
         All timestamps must be naive utc datetime object.
         """
 
+    def record_metering_data_batch(self, samples):
+        """Write the samples to the backend storage system.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+
+        Drivers able to write several samples at once override this.
+        Here the samples are written one at a time, the ones failing
+        being logged and skipped.
+
+        Overrides raise an error only when none of the samples was
+        stored, so that the caller may retry them all one at a time.
+        """
+        for data in samples:
+            try:
+                self.record_metering_data(data)
+            except Exception as err:
+                LOG.exception(_('Failed to record metering data: %s') % err)
+
     @abc.abstractmethod
     def clear_expired_metering_data(self, ttl):
         """Clear expired data from the backend storage system according to the
@@ -142,6 +165,7 @@ class Connection(object):
 
         :param ttl: Number of seconds to keep records for.
 
+        Returns the number of samples cleared, or None if unknown.
         """
 
     @abc.abstractmethod
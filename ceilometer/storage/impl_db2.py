@@ -21,7 +21,6 @@
 """DB2 storage backend
 """
 
-import copy
 import weakref
 import itertools
 
@@ -34,6 +33,7 @@ from ceilometer.openstack.common import log
 from ceilometer import storage
 from ceilometer.storage import base
 from ceilometer.storage import models
+from ceilometer.storage import pymongo_base
 
 LOG = log.getLogger(__name__)
 
@@ -157,7 +157,7 @@ class ConnectionPool(object):
         return client
 
 
-class Connection(base.Connection):
+class Connection(pymongo_base.Connection):
     """DB2 connection.
     """
 
@@ -212,6 +212,8 @@ class Connection(base.Connection):
             self.db.authenticate(connection_options['username'],
                                  connection_options['password'])
 
+        self._forget_known_sources()
+
         self.upgrade()
 
     @classmethod
@@ -291,55 +293,15 @@ class Connection(base.Connection):
         # removal of all the empty dbs created during the test runs since
         # test run is against mongodb on Jenkins
         self.conn.drop_database(self.db)
+        self._forget_known_sources()
 
-    def record_metering_data(self, data):
-        """Write the data to the backend storage system.
-
-        :param data: a dictionary such as returned by
-                     ceilometer.meter.meter_message_from_counter
-        """
-        # Make sure we know about the user and project
-        self.db.user.update(
-            {'_id': data['user_id']},
-            {'$addToSet': {'source': data['source'],
-                           },
-             },
-            upsert=True,
-        )
-        self.db.project.update(
-            {'_id': data['project_id']},
-            {'$addToSet': {'source': data['source'],
-                           },
-             },
-            upsert=True,
-        )
-
-        # Record the updated resource metadata
-        self.db.resource.update(
-            {'_id': data['resource_id']},
-            {'$set': {'project_id': data['project_id'],
-                      'user_id': data['user_id'],
-                      'metadata': data['resource_metadata'],
-                      'source': data['source'],
-                      },
-             '$addToSet': {'meter': {'counter_name': data['counter_name'],
-                                     'counter_type': data['counter_type'],
-                                     'counter_unit': data['counter_unit'],
-                                     },
-                           },
-             },
-            upsert=True,
-        )
-
-        # Record the raw data for the meter. Use a copy so we do not
-        # modify a data structure owned by our caller (the driver adds
-        # a new key '_id').
-        record = copy.copy(data)
+    def _insert_meter_records(self, records):
         # Make sure that the data does have field _id which db2 wont add
         # automatically.
-        if record.get('_id') is None:
-            record['_id'] = str(bson.objectid.ObjectId())
-        self.db.meter.insert(record)
+        for record in records:
+            if record.get('_id') is None:
+                record['_id'] = str(bson.objectid.ObjectId())
+        super(Connection, self)._insert_meter_records(records)
 
     def clear_expired_metering_data(self, ttl):
         """Clear expired data from the backend storage system according to the
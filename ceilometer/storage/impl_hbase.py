@@ -18,25 +18,45 @@
 # under the License.
 """HBase storage backend
 """
+import collections
+import contextlib
 import json
 import hashlib
 import itertools
 import copy
 import datetime
 import happybase
+import heapq
 import os
 import re
 import urlparse
 
+from oslo.config import cfg
+
 from ceilometer.openstack.common.gettextutils import _
 from ceilometer.openstack.common import log
 from ceilometer.openstack.common import timeutils
 from ceilometer.openstack.common import network_utils
 from ceilometer.storage import base
 from ceilometer.storage import models
+from ceilometer import utils
+
+cfg.CONF.import_opt('time_to_live', 'ceilometer.storage',
+                    group="database")
+cfg.CONF.import_opt('hbase_pool_size', 'ceilometer.storage',
+                    group="database")
+cfg.CONF.import_opt('hbase_batch_size', 'ceilometer.storage',
+                    group="database")
+cfg.CONF.import_opt('hbase_cache_size', 'ceilometer.storage',
+                    group="database")
+cfg.CONF.import_opt('hbase_meter_buckets', 'ceilometer.storage',
+                    group="database")
 
 LOG = log.getLogger(__name__)
 
+# Granularity of the cell timestamps of the samples, in milliseconds
+CELL_TIMESTAMP_PERIOD = 60 * 1000
+
 
 class HBaseStorage(base.StorageEngine):
     """Put the data into a HBase database
@@ -81,6 +101,7 @@ class Connection(base.Connection):
     USER_TABLE = "user"
     RESOURCE_TABLE = "resource"
     METER_TABLE = "meter"
+    EVENT_TABLE = "event"
 
     def __init__(self, conf):
         """Hbase Connection Initialization."""
@@ -91,51 +112,74 @@ class Connection(base.Connection):
             if url:
                 # Reparse URL, but from the env variable now
                 opts = self._parse_connection_url(url)
-                self.conn = self._get_connection(opts)
+                self.conn_pool = self._get_connection_pool(opts)
             else:
                 # This is a in-memory usage for unit tests
                 if Connection._memory_instance is None:
                     LOG.debug('Creating a new in-memory HBase '
                               'Connection object')
-                    Connection._memory_instance = MConnection()
-                self.conn = Connection._memory_instance
+                    Connection._memory_instance = MConnectionPool()
+                self.conn_pool = Connection._memory_instance
         else:
-            self.conn = self._get_connection(opts)
-        self.conn.open()
+            self.conn_pool = self._get_connection_pool(opts)
+        # Fail early on an invalid number of buckets
+        _meter_buckets()
+        self._reset_caches()
+
+    def _reset_caches(self):
+        # The sources of the users and projects, and the state and meters
+        # of the resources, last read or written by this connection
+        cache_size = cfg.CONF.database.hbase_cache_size
+        self._users = LRUCache(cache_size)
+        self._projects = LRUCache(cache_size)
+        self._resources = LRUCache(cache_size)
 
     def upgrade(self):
-        self.conn.create_table(self.PROJECT_TABLE, {'f': dict()})
-        self.conn.create_table(self.USER_TABLE, {'f': dict()})
-        self.conn.create_table(self.RESOURCE_TABLE, {'f': dict()})
-        self.conn.create_table(self.METER_TABLE, {'f': dict()})
+        with self.conn_pool.connection() as conn:
+            conn.create_table(self.PROJECT_TABLE, {'f': dict()})
+            conn.create_table(self.USER_TABLE, {'f': dict()})
+            conn.create_table(self.RESOURCE_TABLE, {'f': dict()})
+            # Samples are expired by HBase itself, according to the
+            # timestamp of their cells. This only applies to the tables
+            # created here.
+            meter_family = dict()
+            ttl = cfg.CONF.database.time_to_live
+            if ttl > 0:
+                meter_family['time_to_live'] = ttl
+            conn.create_table(self.METER_TABLE, {'f': meter_family})
+            conn.create_table(self.EVENT_TABLE, {'f': dict()})
 
     def clear(self):
         LOG.debug('Dropping HBase schema...')
-        for table in [self.PROJECT_TABLE,
-                      self.USER_TABLE,
-                      self.RESOURCE_TABLE,
-                      self.METER_TABLE]:
-            try:
-                self.conn.disable_table(table)
-            except Exception:
-                LOG.debug('Cannot disable table but ignoring error')
-            try:
-                self.conn.delete_table(table)
-            except Exception:
-                LOG.debug('Cannot delete table but ignoring error')
+        with self.conn_pool.connection() as conn:
+            for table in [self.PROJECT_TABLE,
+                          self.USER_TABLE,
+                          self.RESOURCE_TABLE,
+                          self.METER_TABLE,
+                          self.EVENT_TABLE]:
+                try:
+                    conn.disable_table(table)
+                except Exception:
+                    LOG.debug('Cannot disable table but ignoring error')
+                try:
+                    conn.delete_table(table)
+                except Exception:
+                    LOG.debug('Cannot delete table but ignoring error')
+        self._reset_caches()
 
     @staticmethod
-    def _get_connection(conf):
-        """Return a connection to the database.
+    def _get_connection_pool(conf):
+        """Return a connection pool to the database.
 
         .. note::
 
           The tests use a subclass to override this and return an
-          in-memory connection.
+          in-memory connection pool.
         """
         LOG.debug('connecting to HBase on %s:%s', conf['host'], conf['port'])
-        return happybase.Connection(host=conf['host'], port=conf['port'],
-                                    table_prefix=conf['table_prefix'])
+        return happybase.ConnectionPool(size=cfg.CONF.database.hbase_pool_size,
+                                        host=conf['host'], port=conf['port'],
+                                        table_prefix=conf['table_prefix'])
 
     @staticmethod
     def _parse_connection_url(url):
@@ -165,93 +209,138 @@ class Connection(base.Connection):
         :param data: a dictionary such as returned by
                      ceilometer.meter.meter_message_from_counter
         """
-        project_table = self.conn.table(self.PROJECT_TABLE)
-        user_table = self.conn.table(self.USER_TABLE)
-        resource_table = self.conn.table(self.RESOURCE_TABLE)
-        meter_table = self.conn.table(self.METER_TABLE)
+        self.record_metering_data_batch([data])
 
-        # store metadata fields with prefix "r_"
-        resource_metadata = {}
-        if data['resource_metadata']:
-            resource_metadata = dict(('f:r_%s' % k, v)
-                                     for (k, v)
-                                     in data['resource_metadata'].iteritems())
-
-        # Make sure we know about the user and project
-        if data['user_id']:
-            user = user_table.row(data['user_id'])
-            sources = _load_hbase_list(user, 's')
-            # Update if source is new
-            if data['source'] not in sources:
-                user['f:s_%s' % data['source']] = "1"
-                user_table.put(data['user_id'], user)
-
-        project = project_table.row(data['project_id'])
-        sources = _load_hbase_list(project, 's')
-        # Update if source is new
-        if data['source'] not in sources:
-            project['f:s_%s' % data['source']] = "1"
-            project_table.put(data['project_id'], project)
-
-        rts = reverse_timestamp(data['timestamp'])
-
-        resource = resource_table.row(data['resource_id'])
-
-        new_meter = _format_meter_reference(
+    def record_metering_data_batch(self, samples):
+        """Write the samples to the backend storage system.
+
+        The users, projects and resources are only read and written when
+        this connection does not know them in their current state, and the
+        samples are put in batches.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+        """
+        records = collections.defaultdict(list)
+        with self.conn_pool.connection() as conn:
+            project_table = conn.table(self.PROJECT_TABLE)
+            user_table = conn.table(self.USER_TABLE)
+            resource_table = conn.table(self.RESOURCE_TABLE)
+            meter_table = conn.table(self.METER_TABLE)
+
+            for data in samples:
+                # Make sure we know about the user and project
+                if data['user_id']:
+                    self._record_source(user_table, self._users,
+                                        data['user_id'], data['source'])
+                self._record_source(project_table, self._projects,
+                                    data['project_id'], data['source'])
+                self._record_resource(resource_table, data)
+                row, record = _make_meter_record(data)
+                records[_cell_timestamp(data['timestamp'])].append(
+                    (row, record))
+
+            # The cells carry the sample timestamp for the TTL to apply to
+            # it, and a batch has a single timestamp.
+            for timestamp, rows in sorted(records.iteritems()):
+                with meter_table.batch(
+                        timestamp=timestamp,
+                        batch_size=cfg.CONF.database.hbase_batch_size
+                ) as batch:
+                    for row, record in rows:
+                        batch.put(row, record)
+
+    @staticmethod
+    def _record_source(table, known, key, source):
+        """Add the source to the user or project row, if new."""
+        sources = known.get(key)
+        if sources is None:
+            sources = frozenset(_load_hbase_list(table.row(key), 's'))
+        if source not in sources:
+            table.put(key, {'f:s_%s' % source: "1"})
+            sources = sources | frozenset([source])
+        known[key] = sources
+
+    def _record_resource(self, resource_table, data):
+        """Update the resource row, unless already in this state."""
+        meter = _format_meter_reference(
             data['counter_name'], data['counter_type'], data['counter_unit'])
-        new_resource = {'f:resource_id': data['resource_id'],
-                        'f:project_id': data['project_id'],
-                        'f:user_id': data['user_id'],
-                        'f:source': data["source"],
-                        # store meters with prefix "m_"
-                        'f:m_%s' % new_meter: "1"
-                        }
-        new_resource.update(resource_metadata)
-
-        # Update if resource has new information
-        if new_resource != resource:
-            meters = _load_hbase_list(resource, 'm')
-            if new_meter not in meters:
-                new_resource['f:m_%s' % new_meter] = "1"
-
-            resource_table.put(data['resource_id'], new_resource)
-
-        # Rowkey consists of reversed timestamp, meter and an md5 of
-        # user+resource+project for purposes of uniqueness
-        m = hashlib.md5()
-        m.update("%s%s%s" % (data['user_id'], data['resource_id'],
-                             data['project_id']))
-
-        # We use reverse timestamps in rowkeys as they are sorted
-        # alphabetically.
-        row = "%s_%d_%s" % (data['counter_name'], rts, m.hexdigest())
-
-        # Convert timestamp to string as json.dumps won't
-        ts = timeutils.strtime(data['timestamp'])
-
-        record = {'f:timestamp': ts,
-                  'f:counter_name': data['counter_name'],
-                  'f:counter_type': data['counter_type'],
-                  'f:counter_volume': str(data['counter_volume']),
-                  'f:counter_unit': data['counter_unit'],
-                  # TODO(shengjie) consider using QualifierFilter
-                  # keep dimensions as column qualifier for quicker look up
-                  # TODO(shengjie) extra dimensions need to be added as CQ
-                  'f:user_id': data['user_id'],
-                  'f:project_id': data['project_id'],
-                  'f:resource_id': data['resource_id'],
-                  'f:source': data['source'],
-                  # add in reversed_ts here for time range scan
-                  'f:rts': str(rts)
-                  }
-        # Need to record resource_metadata for more robust filtering.
-        record.update(resource_metadata)
-        # Don't want to be changing the original data object.
-        data = copy.copy(data)
-        data['timestamp'] = ts
-        # Save original meter.
-        record['f:message'] = json.dumps(data)
-        meter_table.put(row, record)
+        # store metadata fields with prefix "r_", flattened so that the
+        # metaqueries are filters on these columns
+        resource = {'f:resource_id': data['resource_id'],
+                    'f:project_id': data['project_id'],
+                    'f:user_id': data['user_id'],
+                    'f:source': data["source"]}
+        if data['resource_metadata']:
+            resource.update(_metadata_columns(data['resource_metadata']))
+
+        state, meters = self._resources.get(data['resource_id'],
+                                            (None, frozenset()))
+        if state == resource and meter in meters:
+            return
+        if state != resource:
+            meters = frozenset()
+        record = dict(resource)
+        # store meters with prefix "m_"
+        record['f:m_%s' % meter] = "1"
+        resource_table.put(data['resource_id'], record)
+        self._resources[data['resource_id']] = (resource,
+                                                meters | frozenset([meter]))
+
+    def rekey_meter_rows(self):
+        """Move the meter rows to their rowkey for the configured number of
+        buckets, after it changed, and rewrite the metadata columns of the
+        meter and resource rows in the flattened format of the metaqueries.
+
+        Returns the number of meter rows moved or rewritten.
+        """
+        count = 0
+        # The metadata of the latest sample of each resource
+        latest = {}
+        with self.conn_pool.connection() as conn:
+            meter_table = conn.table(self.METER_TABLE)
+            for key, data in meter_table.scan():
+                timestamp = timeutils.parse_strtime(data['f:timestamp'])
+                metadata = json.loads(data['f:message'])['resource_metadata']
+                resource_id = data['f:resource_id']
+                if (resource_id not in latest or
+                        timestamp >= latest[resource_id][0]):
+                    latest[resource_id] = (timestamp, metadata)
+                row = _meter_rowkey(data['f:counter_name'],
+                                    long(data['f:rts']),
+                                    data['f:user_id'],
+                                    resource_id,
+                                    data['f:project_id'])
+                columns = _metadata_columns(metadata or {})
+                stale = _stale_metadata_columns(data, columns)
+                if row == key and not stale and all(
+                        data.get(c) == v for c, v in columns.iteritems()):
+                    continue
+                record = dict((c, v) for c, v in data.iteritems()
+                              if not c.startswith('f:r_'))
+                record.update(columns)
+                # Written before deleted, so that an interrupted run loses
+                # nothing and is completed by the next one.
+                if row != key:
+                    meter_table.put(row, record,
+                                    timestamp=_cell_timestamp(timestamp))
+                    meter_table.delete(key)
+                else:
+                    meter_table.put(row, columns,
+                                    timestamp=_cell_timestamp(timestamp))
+                    meter_table.delete(key, columns=stale)
+                count += 1
+
+            resource_table = conn.table(self.RESOURCE_TABLE)
+            for resource_id, (ignored, metadata) in latest.iteritems():
+                data = resource_table.row(resource_id)
+                columns = _metadata_columns(metadata or {})
+                stale = _stale_metadata_columns(data, columns)
+                if any(data.get(c) != v for c, v in columns.iteritems()):
+                    resource_table.put(resource_id, columns)
+                if stale:
+                    resource_table.delete(resource_id, columns=stale)
+        return count
 
     def clear_expired_metering_data(self, ttl):
         """Clear expired data from the backend storage system according to the
@@ -260,31 +349,34 @@ class Connection(base.Connection):
         :param ttl: Number of seconds to keep records for.
 
         """
-        raise NotImplementedError
+        LOG.debug(_("Samples are expired by the time to live of the "
+                    "%s table column family") % self.METER_TABLE)
 
     def get_users(self, source=None):
         """Return an iterable of user id strings.
 
         :param source: Optional source filter.
         """
-        user_table = self.conn.table(self.USER_TABLE)
-        LOG.debug("source: %s" % source)
-        scan_args = {}
-        if source:
-            scan_args['columns'] = ['f:s_%s' % source]
-        return sorted(key for key, ignored in user_table.scan(**scan_args))
+        with self.conn_pool.connection() as conn:
+            user_table = conn.table(self.USER_TABLE)
+            LOG.debug("source: %s" % source)
+            scan_args = {}
+            if source:
+                scan_args['columns'] = ['f:s_%s' % source]
+            return sorted(key for key, ignored in user_table.scan(**scan_args))
 
     def get_projects(self, source=None):
         """Return an iterable of project id strings.
 
         :param source: Optional source filter.
         """
-        project_table = self.conn.table(self.PROJECT_TABLE)
-        LOG.debug("source: %s" % source)
-        scan_args = {}
-        if source:
-            scan_args['columns'] = ['f:s_%s' % source]
-        return (key for key, ignored in project_table.scan(**scan_args))
+        with self.conn_pool.connection() as conn:
+            project_table = conn.table(self.PROJECT_TABLE)
+            LOG.debug("source: %s" % source)
+            scan_args = {}
+            if source:
+                scan_args['columns'] = ['f:s_%s' % source]
+            return [key for key, ignored in project_table.scan(**scan_args)]
 
     def get_resources(self, user=None, project=None, source=None,
                       start_timestamp=None, start_timestamp_op=None,
@@ -309,8 +401,7 @@ class Connection(base.Connection):
 
         def make_resource(data, first_ts, last_ts, meter_refs):
             """Transform HBase fields to Resource model."""
-            # convert HBase metadata e.g. f:r_display_name to display_name
-            data['f:metadata'] = _metadata_from_document(data)
+            message = json.loads(data['f:message'])
 
             return models.Resource(
                 resource_id=data['f:resource_id'],
@@ -319,14 +410,12 @@ class Connection(base.Connection):
                 project_id=data['f:project_id'],
                 source=data['f:source'],
                 user_id=data['f:user_id'],
-                metadata=data['f:metadata'],
+                metadata=message['resource_metadata'],
                 meter=[
                     models.ResourceMeter(*(m.split("!")))
                     for m in meter_refs
                 ],
             )
-        meter_table = self.conn.table(self.METER_TABLE)
-
         q, start_row, stop_row = make_query(user=user,
                                             project=project,
                                             source=source,
@@ -335,16 +424,19 @@ class Connection(base.Connection):
                                             start_op=start_timestamp_op,
                                             end=end_timestamp,
                                             end_op=end_timestamp_op,
+                                            metaquery=metaquery,
                                             require_meter=False,
                                             query_only=False)
         LOG.debug("Query Meter table: %s" % q)
-        meters = meter_table.scan(filter=q, row_start=start_row,
-                                  row_stop=stop_row)
+        with self.conn_pool.connection() as conn:
+            meter_table = conn.table(self.METER_TABLE)
+            meters = _scan_meter_table(meter_table, q, start_row, stop_row)
 
-        # We have to sort on resource_id before we can group by it. According
-        # to the itertools documentation a new group is generated when the
-        # value of the key function changes (it breaks there).
-        meters = sorted(meters, key=_resource_id_from_record_tuple)
+            # We have to sort on resource_id before we can group by it.
+            # According to the itertools documentation a new group is
+            # generated when the value of the key function changes (it
+            # breaks there).
+            meters = sorted(meters, key=_resource_id_from_record_tuple)
 
         for resource_id, r_meters in itertools.groupby(
                 meters, key=_resource_id_from_record_tuple):
@@ -359,22 +451,12 @@ class Connection(base.Connection):
             latest_data = meter_rows[-1]
             min_ts = timeutils.parse_strtime(meter_rows[0]['f:timestamp'])
             max_ts = timeutils.parse_strtime(latest_data['f:timestamp'])
-            if metaquery:
-                for k, v in metaquery.iteritems():
-                    if latest_data['f:r_' + k.split('.', 1)[1]] == v:
-                        yield make_resource(
-                            latest_data,
-                            min_ts,
-                            max_ts,
-                            meter_references
-                        )
-            else:
-                yield make_resource(
-                    latest_data,
-                    min_ts,
-                    max_ts,
-                    meter_references
-                )
+            yield make_resource(
+                latest_data,
+                min_ts,
+                max_ts,
+                meter_references
+            )
 
     def get_meters(self, user=None, project=None, resource=None, source=None,
                    metaquery={}, pagination=None):
@@ -391,48 +473,31 @@ class Connection(base.Connection):
         if pagination:
             raise NotImplementedError(_('Pagination not implemented'))
 
-        resource_table = self.conn.table(self.RESOURCE_TABLE)
-        q = make_query(user=user, project=project, resource=resource,
-                       source=source, require_meter=False, query_only=True)
-        LOG.debug("Query Resource table: %s" % q)
-
-        # handle metaquery
-        if len(metaquery) > 0:
-            meta_q = []
-            for k, v in metaquery.iteritems():
-                meta_q.append(
-                    "SingleColumnValueFilter ('f', '%s', =, 'binary:%s')"
-                    % ('r_' + k.split('.', 1)[1], v))
-            meta_q = " AND ".join(meta_q)
-            # join query and metaquery
-            if q is not None:
-                q += " AND " + meta_q
-            else:
-                q = meta_q   # metaquery only
+        with self.conn_pool.connection() as conn:
+            resource_table = conn.table(self.RESOURCE_TABLE)
+            q = make_query(user=user, project=project, resource=resource,
+                           source=source, metaquery=metaquery,
+                           require_meter=False, query_only=True)
+            LOG.debug("Query Resource table: %s" % q)
 
-        gen = resource_table.scan(filter=q)
+            # Read before the connection goes back to the pool
+            rows = list(resource_table.scan(filter=q))
 
-        for ignored, data in gen:
+        for ignored, data in rows:
             # Meter columns are stored like this:
-            # "m_{counter_name}|{counter_type}|{counter_unit}" => "1"
+            # "m_{counter_name}!{counter_type}!{counter_unit}" => "1"
             # where 'm' is a prefix (m for meter), value is always set to 1
-            meter = None
-            for m in data:
-                if m.startswith('f:m_'):
-                    meter = m
-                    break
-            if meter is None:
-                continue
-            name, type, unit = meter[4:].split("!")
-            yield models.Meter(
-                name=name,
-                type=type,
-                unit=unit,
-                resource_id=data['f:resource_id'],
-                project_id=data['f:project_id'],
-                source=data['f:source'],
-                user_id=data['f:user_id'],
-            )
+            for meter in sorted(_load_hbase_list(data, 'm')):
+                name, type, unit = meter.split("!")
+                yield models.Meter(
+                    name=name,
+                    type=type,
+                    unit=unit,
+                    resource_id=data['f:resource_id'],
+                    project_id=data['f:project_id'],
+                    source=data['f:source'],
+                    user_id=data['f:user_id'],
+                )
 
     def get_samples(self, sample_filter, limit=None):
         """Return an iterable of models.Sample instances.
@@ -446,47 +511,22 @@ class Connection(base.Connection):
             data['timestamp'] = timeutils.parse_strtime(data['timestamp'])
             return models.Sample(**data)
 
-        meter_table = self.conn.table(self.METER_TABLE)
+        with self.conn_pool.connection() as conn:
+            meter_table = conn.table(self.METER_TABLE)
 
-        q, start, stop = make_query_from_filter(sample_filter,
-                                                require_meter=False)
-        LOG.debug("Query Meter Table: %s" % q)
+            q, start, stop = make_query_from_filter(sample_filter,
+                                                    require_meter=False)
+            LOG.debug("Query Meter Table: %s" % q)
 
-        gen = meter_table.scan(filter=q, row_start=start, row_stop=stop)
+            # Read before the connection goes back to the pool, up to the
+            # limit.
+            rows = list(itertools.islice(
+                _scan_meter_table(meter_table, q, start, stop), limit))
 
-        for ignored, meter in gen:
-            # TODO(shengjie) put this implementation here because it's failing
-            # the test. bp hbase-meter-table-enhancement will address this
-            # properly.
-            # handle metaquery
-            metaquery = sample_filter.metaquery
-            # TODO(jd) implements using HBase capabilities
-            if limit == 0:
-                break
-            if len(metaquery) > 0:
-                for k, v in metaquery.iteritems():
-                    message = json.loads(meter['f:message'])
-                    metadata = message['resource_metadata']
-                    keys = k.split('.')
-                    # Support the dictionary type of metadata
-                    for key in keys[1:]:
-                        if key in metadata:
-                            metadata = metadata[key]
-                        else:
-                            break
-                    # NOTE (flwang) For multiple level searching, the matadata
-                    # object will be drilled down to check if it's matched
-                    # with the searched value.
-                    if metadata != v:
-                        break
-                else:
-                    if limit:
-                        limit -= 1
-                    yield make_sample(meter)
-            else:
-                if limit:
-                    limit -= 1
-                yield make_sample(meter)
+        # The metaquery is part of the scan filter, so that only the
+        # returned samples are decoded.
+        for ignored, meter in rows:
+            yield make_sample(meter)
 
     @staticmethod
     def _update_meter_stats(stat, meter):
@@ -528,14 +568,12 @@ class Connection(base.Connection):
         if groupby:
             raise NotImplementedError("Group by not implemented.")
 
-        meter_table = self.conn.table(self.METER_TABLE)
-
         q, start, stop = make_query_from_filter(sample_filter)
 
-        meters = list(meter for (ignored, meter) in
-                      meter_table.scan(filter=q, row_start=start,
-                                       row_stop=stop)
-                      )
+        with self.conn_pool.connection() as conn:
+            meter_table = conn.table(self.METER_TABLE)
+            meters = list(meter for (ignored, meter) in
+                          _scan_meter_table(meter_table, q, start, stop))
 
         if sample_filter.start:
             start_time = sample_filter.start
@@ -646,19 +684,149 @@ class Connection(base.Connection):
         """
         raise NotImplementedError('Alarms not implemented')
 
-    def record_events(self, events):
-        """Write the events.
+    def record_events(self, event_models):
+        """Write the events to HBase.
+
+        :param event_models: a list of models.Event objects.
 
-        :param events: a list of model.Event objects.
+        Returns a list of events that could not be saved in a
+        (reason, event) tuple. Reasons are enumerated in
+        storage.models.Event
         """
-        raise NotImplementedError('Events not implemented.')
+        problem_events = []
+
+        rows = [(_make_event_rowkey(event_model), event_model)
+                for event_model in event_models]
+        with self.conn_pool.connection() as conn:
+            event_table = conn.table(self.EVENT_TABLE)
+            stored = set(key for key, data in event_table.rows(
+                [_event_id_index_rowkey(event_model.message_id)
+                 for ignored, event_model in rows])
+                if data)
+        message_ids = set()
+        records = []
+        for row, event_model in rows:
+            if (_event_id_index_rowkey(event_model.message_id) in stored
+                    or event_model.message_id in message_ids):
+                problem_events.append((models.Event.DUPLICATE,
+                                       event_model))
+                continue
+            message_ids.add(event_model.message_id)
+            record = {
+                'f:message_id': event_model.message_id,
+                'f:event_type': _encode_event_value(event_model.event_name),
+                'f:generated': timeutils.strtime(event_model.generated),
+            }
+            for trait in event_model.traits or []:
+                record[_event_trait_column(trait.name, trait.dtype)] = \
+                    _encode_event_value(trait.value)
+            records.append((row, record, event_model))
+
+        try:
+            with self.conn_pool.connection() as conn:
+                event_table = conn.table(self.EVENT_TABLE)
+                with event_table.batch() as batch:
+                    for row, record, event_model in records:
+                        batch.put(row, record)
+                        index = {'f:row': row}
+                        batch.put(_event_time_index_rowkey(event_model),
+                                  index)
+                        batch.put(_event_id_index_rowkey(
+                            event_model.message_id), index)
+        except Exception as e:
+            LOG.exception(_('Failed to record events: %s') % e)
+            problem_events.extend((models.Event.UNKNOWN_PROBLEM, event_model)
+                                  for ignored, ignored, event_model
+                                  in records)
+        return problem_events
 
     def get_events(self, event_filter):
-        """Return an iterable of model.Event objects.
+        """Return an iterable of model.Event objects, ordered by
+        generation time.
+
+        The events of a type are scanned from their own rows, the others
+        from the index rows in the order of the times, so that the scan
+        stops once the page is filled. The marker is looked up by the
+        index row of its message id.
 
         :param event_filter: EventFilter instance
         """
-        raise NotImplementedError('Events not implemented.')
+        marker = None
+        if event_filter.marker:
+            with self.conn_pool.connection() as conn:
+                event_table = conn.table(self.EVENT_TABLE)
+                index = event_table.row(
+                    _event_id_index_rowkey(event_filter.marker))
+                data = index and event_table.row(index['f:row'])
+            if not data:
+                raise base.NoResultFound(
+                    _('Event %s not found') % event_filter.marker)
+            marker = _event_from_record(data)
+
+        # Both the rows of an event type and the index rows are in the
+        # order of the results.
+        if event_filter.event_name:
+            prefix = "%s_" % _encode_event_value(event_filter.event_name)
+        else:
+            prefix = EVENT_TIME_INDEX
+        start_row = prefix + _event_timestamp(event_filter.start)
+        # The stop row is excluded from the scan
+        stop_row = prefix + _event_timestamp(
+            event_filter.end + datetime.timedelta(microseconds=1))
+        if marker is not None:
+            # Skip the events up to the marker
+            start_row = max(start_row, "%s%s_%s\0" % (
+                prefix, _event_timestamp(marker.generated),
+                marker.message_id))
+
+        q = None
+        trait_filter = dict(event_filter.traits or {})
+        trait_name = trait_filter.pop('key', None)
+        trait_value = None
+        if trait_filter:
+            field, trait_value = trait_filter.items()[0]
+            trait_type = EVENT_TRAIT_TYPES[field]
+            # Only the rows of the events have the trait columns
+            if trait_name is not None and event_filter.event_name:
+                column = _event_trait_column(trait_name, trait_type)
+                value = _encode_event_value(trait_value).replace("'", "''")
+                q = ("SingleColumnValueFilter ('f', '%s', =, "
+                     "'binary:%s')" % (column[2:], value))
+
+        def event_matches(event):
+            if (event_filter.event_name and
+                    event.event_name != event_filter.event_name):
+                return False
+            if not event_filter.start <= event.generated <= event_filter.end:
+                return False
+            if not event_filter.traits:
+                return True
+            for trait in event.traits:
+                if trait_name is not None and trait.name != trait_name:
+                    continue
+                if trait_value is not None and (
+                        trait.dtype != trait_type or
+                        trait.value != trait_value):
+                    continue
+                return True
+            return False
+
+        events = []
+        with self.conn_pool.connection() as conn:
+            event_table = conn.table(self.EVENT_TABLE)
+            rows = event_table.scan(filter=q, row_start=start_row,
+                                    row_stop=stop_row)
+            if not event_filter.event_name:
+                rows = _read_event_index(event_table, rows,
+                                         event_filter.limit or 100)
+            for ignored, data in rows:
+                event = _event_from_record(data)
+                if not event_matches(event):
+                    continue
+                events.append(event)
+                if len(events) == event_filter.limit:
+                    break
+        return events
 
 
 ###############
@@ -679,8 +847,20 @@ class MTable(object):
     def rows(self, keys):
         return ((k, self.row(k)) for k in keys)
 
-    def put(self, key, data):
-        self._rows[key] = data
+    def put(self, key, data, timestamp=None):
+        # Like HBase, only the columns given are written
+        self._rows.setdefault(key, {}).update(data)
+
+    def delete(self, key, columns=None):
+        if columns is None:
+            self._rows.pop(key, None)
+        else:
+            for column in columns:
+                self._rows.get(key, {}).pop(column, None)
+
+    @contextlib.contextmanager
+    def batch(self, timestamp=None, batch_size=None):
+        yield MBatch(self, timestamp)
 
     def scan(self, filter=None, columns=[], row_start=None, row_stop=None):
         sorted_keys = sorted(self._rows)
@@ -752,6 +932,17 @@ class MTable(object):
         return r
 
 
+class MBatch(object):
+    """HappyBase.Batch mock
+    """
+    def __init__(self, table, timestamp=None):
+        self.table = table
+        self.timestamp = timestamp
+
+    def put(self, key, data):
+        self.table.put(key, data, timestamp=self.timestamp)
+
+
 class MConnection(object):
     """HappyBase.Connection mock
     """
@@ -775,8 +966,44 @@ class MConnection(object):
         return self.create_table(name)
 
 
+class MConnectionPool(object):
+    """HappyBase.ConnectionPool mock
+    """
+    def __init__(self):
+        self.conn = MConnection()
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.conn
+
+
 #################################################
 # Here be various HBase helpers
+class LRUCache(object):
+    """Dictionary keeping only its most recently used entries.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            return default
+        self._entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
 def reverse_timestamp(dt):
     """Reverse timestamp so that newer timestamps are represented by smaller
     numbers than older ones.
@@ -795,7 +1022,8 @@ def reverse_timestamp(dt):
 
 def make_query(user=None, project=None, meter=None,
                resource=None, source=None, start=None, start_op=None,
-               end=None, end_op=None, require_meter=True, query_only=False):
+               end=None, end_op=None, metaquery=None, require_meter=True,
+               query_only=False):
     """Return a filter query string based on the selected parameters.
 
     :param user: Optional user-id
@@ -807,6 +1035,7 @@ def make_query(user=None, project=None, meter=None,
     :param start_op: Optional start timestamp operator, like gt, ge
     :param end: Optional end timestamp
     :param end_op: Optional end timestamp operator, like lt, le
+    :param metaquery: Optional dict with metadata to match on
     :param require_meter: If true and the filter does not have a meter,
             raise an error.
     :param query_only: If true only returns the filter query,
@@ -826,6 +1055,12 @@ def make_query(user=None, project=None, meter=None,
     if source:
         q.append("SingleColumnValueFilter "
                  "('f', 'source', =, 'binary:%s')" % source)
+    for key, value in sorted((metaquery or {}).iteritems()):
+        # Skip the rows without the metadata, rather than keeping them
+        q.append("SingleColumnValueFilter ('f', '%s', =, 'binary:%s', "
+                 "true, true)"
+                 % (_escape_filter_value('r_' + key.split('.', 1)[1]),
+                    _escape_filter_value(_encode_metadata_value(value))))
 
     start_row, end_row = "", ""
     rts_start = str(reverse_timestamp(start) + 1) if start else ""
@@ -880,6 +1115,7 @@ def make_query_from_filter(sample_filter, require_meter=True):
                       sample_filter.start_timestamp_op,
                       sample_filter.end,
                       sample_filter.end_timestamp_op,
+                      sample_filter.metaquery,
                       require_meter)
 
 
@@ -895,6 +1131,106 @@ def _make_rowkey_scan(meter, rts_start=None, rts_end=None):
     return start_row, end_row
 
 
+EVENT_TRAIT_TYPES = {'t_string': models.Trait.TEXT_TYPE,
+                     't_int': models.Trait.INT_TYPE,
+                     't_float': models.Trait.FLOAT_TYPE,
+                     't_datetime': models.Trait.DATETIME_TYPE}
+
+# Prefixes of the index rows of the events, by time and by message id
+EVENT_TIME_INDEX = '\0t_'
+EVENT_ID_INDEX = '\0m_'
+
+
+def _event_timestamp(dt):
+    """Timestamp of an event, with a microsecond precision, padded so
+    that the timestamps sort in the order of the times.
+    """
+    epoch = datetime.datetime(1970, 1, 1)
+    td = dt - epoch
+    return "%019d" % (td.microseconds +
+                      (td.seconds + td.days * 24 * 3600) * 1000000)
+
+
+def _make_event_rowkey(event):
+    """Rowkey of an event: its type, so that the events of a type are
+    stored together, then the timestamp for time range scans and the
+    message id for uniqueness, so that the events of a type are scanned
+    in the order they are returned.
+    """
+    return "%s_%s_%s" % (_encode_event_value(event.event_name),
+                         _event_timestamp(event.generated),
+                         event.message_id)
+
+
+def _event_time_index_rowkey(event):
+    """Rowkey of the index row of an event in the order of the times,
+    which the scans of all the event types go through.
+
+    It starts with a NUL byte, so that it is never in the range of the
+    rows of an event type.
+    """
+    return "%s%s_%s" % (EVENT_TIME_INDEX,
+                        _event_timestamp(event.generated),
+                        event.message_id)
+
+
+def _event_id_index_rowkey(message_id):
+    """Rowkey of the index row of an event by its message id, to look up
+    the markers and the duplicates.
+    """
+    return EVENT_ID_INDEX + message_id
+
+
+def _read_event_index(event_table, index_rows, batch_size):
+    """Read the events of the index rows in their order, a batch of rows
+    at a time.
+    """
+    while True:
+        rows = [data['f:row'] for ignored, data
+                in itertools.islice(index_rows, batch_size)]
+        if not rows:
+            break
+        for row, data in event_table.rows(rows):
+            if data:
+                yield row, data
+
+
+def _event_trait_column(name, dtype):
+    """Column storing an event trait, so that it can be filtered on.
+    """
+    return "f:t_%s+%d" % (_encode_event_value(name), dtype)
+
+
+def _encode_event_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, datetime.datetime):
+        return timeutils.strtime(value)
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _event_from_record(data):
+    """Transform an event row to an Event model.
+    """
+    decoders = {models.Trait.TEXT_TYPE: lambda v: v.decode('utf-8'),
+                models.Trait.INT_TYPE: int,
+                models.Trait.FLOAT_TYPE: float,
+                models.Trait.DATETIME_TYPE: timeutils.parse_strtime}
+    traits = []
+    for column, value in sorted(data.iteritems()):
+        if column.startswith('f:t_'):
+            name, dtype = column[4:].rsplit('+', 1)
+            dtype = int(dtype)
+            traits.append(models.Trait(name.decode('utf-8'), dtype,
+                                       decoders[dtype](value)))
+    return models.Event(data['f:message_id'],
+                        data['f:event_type'].decode('utf-8'),
+                        timeutils.parse_strtime(data['f:generated']),
+                        traits)
+
+
 def _load_hbase_list(d, prefix):
     """Deserialise dict stored as HBase column family
     """
@@ -911,12 +1247,139 @@ def _format_meter_reference(counter_name, counter_type, counter_unit):
     return "%s!%s!%s" % (counter_name, counter_type, counter_unit)
 
 
-def _metadata_from_document(doc):
-    """Extract resource metadata from HBase document using prefix specific
-    to HBase implementation.
+def _make_meter_record(data):
+    """Return the rowkey and the columns of a sample in the meter table.
+    """
+    rts = reverse_timestamp(data['timestamp'])
+    row = _meter_rowkey(data['counter_name'], rts, data['user_id'],
+                        data['resource_id'], data['project_id'])
+
+    # Convert timestamp to string as json.dumps won't
+    ts = timeutils.strtime(data['timestamp'])
+
+    record = {'f:timestamp': ts,
+              'f:counter_name': data['counter_name'],
+              'f:counter_type': data['counter_type'],
+              'f:counter_volume': str(data['counter_volume']),
+              'f:counter_unit': data['counter_unit'],
+              # TODO(shengjie) consider using QualifierFilter
+              # keep dimensions as column qualifier for quicker look up
+              # TODO(shengjie) extra dimensions need to be added as CQ
+              'f:user_id': data['user_id'],
+              'f:project_id': data['project_id'],
+              'f:resource_id': data['resource_id'],
+              'f:source': data['source'],
+              # add in reversed_ts here for time range scan
+              'f:rts': str(rts)
+              }
+    # Need to record resource_metadata for more robust filtering.
+    if data['resource_metadata']:
+        record.update(_metadata_columns(data['resource_metadata']))
+    # Don't want to be changing the original data object.
+    data = copy.copy(data)
+    data['timestamp'] = ts
+    # Save original meter.
+    record['f:message'] = json.dumps(data)
+    return row, record
+
+
+def _meter_rowkey(counter_name, rts, user_id, resource_id, project_id):
+    """Rowkey of a sample in the meter table.
+    """
+    # Rowkey consists of reversed timestamp, meter and an md5 of
+    # user+resource+project for purposes of uniqueness
+    m = hashlib.md5()
+    m.update("%s%s%s" % (user_id, resource_id, project_id))
+
+    # We use reverse timestamps in rowkeys as they are sorted
+    # alphabetically.
+    row = "%s_%d_%s" % (counter_name, rts, m.hexdigest())
+
+    # The rows of a meter are spread over buckets, so that the latest
+    # samples are not all written to the same region.
+    buckets = _meter_buckets()
+    if buckets:
+        bucket = int(hashlib.md5(row).hexdigest()[:8], 16) % buckets
+        row = _bucket_prefix(bucket) + row
+    return row
+
+
+def _meter_buckets():
+    """Return the configured number of meter row buckets."""
+    buckets = cfg.CONF.database.hbase_meter_buckets
+    # The bucket prefixes have three digits, to be sorted as the buckets
+    if not 0 <= buckets <= 999:
+        raise ValueError(_('The number of HBase meter buckets must be '
+                           'between 0 and 999, not %d') % buckets)
+    return buckets
+
+
+def _bucket_prefix(bucket):
+    return "%03d_" % bucket
+
+
+def _scan_meter_table(meter_table, q, start_row, stop_row):
+    """Scan the meter table, one range per bucket if the rows are spread
+    over buckets, merging the scans in the order of unbucketed rowkeys.
+    """
+    buckets = _meter_buckets()
+    if not buckets:
+        return meter_table.scan(filter=q, row_start=start_row,
+                                row_stop=stop_row)
+
+    def scan_bucket(bucket):
+        prefix = _bucket_prefix(bucket)
+        for key, data in meter_table.scan(
+                filter=q, row_start=prefix + (start_row or ''),
+                row_stop=(prefix + stop_row if stop_row
+                          else _bucket_prefix(bucket + 1))):
+            yield key[len(prefix):], key, data
+
+    return ((key, data) for ignored, key, data in heapq.merge(
+        *[scan_bucket(bucket) for bucket in range(buckets)]))
+
+
+def _cell_timestamp(dt):
+    """Timestamp of the cells of a sample, in milliseconds.
+
+    It is rounded up to CELL_TIMESTAMP_PERIOD, so that the samples of a
+    period are put in a single batch, and never expire too early.
+    """
+    ts = int(utils.dt_to_decimal(dt) * 1000)
+    return ts + (-ts) % CELL_TIMESTAMP_PERIOD
+
+
+def _encode_metadata_value(value):
+    """Encode a metadata value as stored in its column, and thus as compared
+    by the metaquery filters.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _metadata_columns(metadata):
+    """Return the columns of the resource metadata, the nested keys being
+    joined with dots as in the metaqueries.
+    """
+    return dict(('f:r_%s' % k, _encode_metadata_value(v))
+                for k, v in utils.recursive_keypairs(metadata, separator='.'))
+
+
+def _stale_metadata_columns(data, columns):
+    """Return the metadata columns of a row which are not in the given
+    columns, such as the ones of nested metadata written before they were
+    flattened.
+    """
+    return [c for c in data if c.startswith('f:r_') and c not in columns]
+
+
+def _escape_filter_value(value):
+    """Escape the quotes of a value of the filter language.
     """
-    return dict(
-        (k[4:], v) for k, v in doc.iteritems() if k.startswith('f:r_'))
+    return value.replace("'", "''")
 
 
 def _timestamp_from_record_tuple(record):
@@ -21,7 +21,6 @@
 """
 
 import calendar
-import copy
 import operator
 import weakref
 
@@ -36,6 +35,7 @@ from ceilometer.openstack.common import log
 from ceilometer import storage
 from ceilometer.storage import base
 from ceilometer.storage import models
+from ceilometer.storage import pymongo_base
 from ceilometer.openstack.common.gettextutils import _
 
 cfg.CONF.import_opt('time_to_live', 'ceilometer.storage',
@@ -68,6 +68,13 @@ class MongoDBStorage(base.StorageEngine):
               meter: [ array of {counter_name: string, counter_type: string,
                                  counter_unit: string} ]
             }
+        - event
+          - { _id: message id
+              event_type: event type
+              generated: generation datetime
+              traits: [ array of {trait_name: string, trait_type: int,
+                                  trait_value: value} ]
+            }
     """
 
     def get_connection(self, conf):
@@ -163,7 +170,7 @@ class ConnectionPool(object):
         return client
 
 
-class Connection(base.Connection):
+class Connection(pymongo_base.Connection):
     """MongoDB connection.
     """
 
@@ -298,6 +305,11 @@ class Connection(base.Connection):
         return value;
     }""")
 
+    EVENT_TRAIT_TYPES = {'t_string': models.Trait.TEXT_TYPE,
+                         't_int': models.Trait.INT_TYPE,
+                         't_float': models.Trait.FLOAT_TYPE,
+                         't_datetime': models.Trait.DATETIME_TYPE}
+
     SORT_OPERATION_MAPPING = {'desc': (pymongo.DESCENDING, '$lt'),
                               'asc': (pymongo.ASCENDING, '$gt')}
 
@@ -320,6 +332,8 @@ class Connection(base.Connection):
             self.db.authenticate(connection_options['username'],
                                  connection_options['password'])
 
+        self._forget_known_sources()
+
         # NOTE(jd) Upgrading is just about creating index, so let's do this
         # on connection to be sure at least the TTL is correcly updated if
         # needed.
@@ -347,6 +361,18 @@ class Connection(base.Connection):
             ], name='meter_idx')
         self.db.meter.ensure_index([('timestamp', pymongo.DESCENDING)],
                                    name='timestamp_idx')
+        # Events are queried by time range, usually for an event type
+        self.db.event.ensure_index([
+            ('event_type', pymongo.ASCENDING),
+            ('generated', pymongo.ASCENDING),
+        ], name='event_type_idx')
+        self.db.event.ensure_index([('generated', pymongo.ASCENDING)],
+                                   name='event_generated_idx')
+        self.db.event.ensure_index([
+            ('traits.trait_name', pymongo.ASCENDING),
+            ('traits.trait_value', pymongo.ASCENDING),
+            ('generated', pymongo.ASCENDING),
+        ], name='event_trait_idx')
 
         indexes = self.db.meter.index_information()
 
@@ -374,54 +400,10 @@ class Connection(base.Connection):
 
     def clear(self):
         self.conn.drop_database(self.db)
+        self._forget_known_sources()
         # Connection will be reopened automatically if needed
         self.conn.close()
 
-    def record_metering_data(self, data):
-        """Write the data to the backend storage system.
-
-        :param data: a dictionary such as returned by
-                     ceilometer.meter.meter_message_from_counter
-        """
-        # Make sure we know about the user and project
-        self.db.user.update(
-            {'_id': data['user_id']},
-            {'$addToSet': {'source': data['source'],
-                           },
-             },
-            upsert=True,
-        )
-        self.db.project.update(
-            {'_id': data['project_id']},
-            {'$addToSet': {'source': data['source'],
-                           },
-             },
-            upsert=True,
-        )
-
-        # Record the updated resource metadata
-        self.db.resource.update(
-            {'_id': data['resource_id']},
-            {'$set': {'project_id': data['project_id'],
-                      'user_id': data['user_id'],
-                      'metadata': data['resource_metadata'],
-                      'source': data['source'],
-                      },
-             '$addToSet': {'meter': {'counter_name': data['counter_name'],
-                                     'counter_type': data['counter_type'],
-                                     'counter_unit': data['counter_unit'],
-                                     },
-                           },
-             },
-            upsert=True,
-        )
-
-        # Record the raw data for the meter. Use a copy so we do not
-        # modify a data structure owned by our caller (the driver adds
-        # a new key '_id').
-        record = copy.copy(data)
-        self.db.meter.insert(record)
-
     def clear_expired_metering_data(self, ttl):
         """Clear expired data from the backend storage system according to the
         time-to-live.
@@ -919,18 +901,104 @@ class Connection(base.Connection):
         """
         self.db.alarm_history.insert(alarm_change)
 
-    @staticmethod
-    def record_events(events):
-        """Write the events.
+    def record_events(self, event_models):
+        """Write the events to MongoDB.
 
-        :param events: a list of model.Event objects.
+        :param event_models: a list of models.Event objects.
+
+        Returns a list of events that could not be saved in a
+        (reason, event) tuple. Reasons are enumerated in
+        storage.models.Event
         """
-        raise NotImplementedError('Events not implemented.')
+        problem_events = []
+
+        # Report the events already stored or repeated in the batch
+        # upfront, so that they don't abort the batch insertion.
+        stored = set(e['_id'] for e in self.db.event.find(
+            {'_id': {'$in': [m.message_id for m in event_models]}},
+            fields=['_id']))
+        to_record = []
+        for event_model in event_models:
+            if event_model.message_id in stored:
+                problem_events.append((models.Event.DUPLICATE,
+                                       event_model))
+            else:
+                stored.add(event_model.message_id)
+                to_record.append(event_model)
+        if not to_record:
+            return problem_events
+
+        try:
+            self.db.event.insert([self._event_record(m) for m in to_record])
+        except pymongo.errors.PyMongoError:
+            # Find out which events are the problem by recording the
+            # ones the batch did not insert one at a time.
+            inserted = set(e['_id'] for e in self.db.event.find(
+                {'_id': {'$in': [m.message_id for m in to_record]}},
+                fields=['_id']))
+            for event_model in to_record:
+                if event_model.message_id in inserted:
+                    continue
+                try:
+                    self.db.event.insert(self._event_record(event_model))
+                except pymongo.errors.DuplicateKeyError:
+                    problem_events.append((models.Event.DUPLICATE,
+                                           event_model))
+                except Exception as e:
+                    LOG.exception(_('Failed to record event: %s') % e)
+                    problem_events.append((models.Event.UNKNOWN_PROBLEM,
+                                           event_model))
+        return problem_events
 
     @staticmethod
-    def get_events(event_filter):
-        """Return an iterable of model.Event objects.
+    def _event_record(event_model):
+        """Return the document storing an event, with its traits embedded.
+        """
+        return {'_id': event_model.message_id,
+                'event_type': event_model.event_name,
+                'generated': event_model.generated,
+                'traits': [{'trait_name': trait.name,
+                            'trait_type': trait.dtype,
+                            'trait_value': trait.value}
+                           for trait in event_model.traits or []]}
+
+    def get_events(self, event_filter):
+        """Return an iterable of model.Event objects, ordered by
+        generation time.
 
         :param event_filter: EventFilter instance
         """
-        raise NotImplementedError('Events not implemented.')
+        q = {'generated': {'$gte': event_filter.start,
+                           '$lte': event_filter.end}}
+        if event_filter.event_name:
+            q['event_type'] = event_filter.event_name
+
+        trait_filter = dict(event_filter.traits or {})
+        trait_q = {}
+        if 'key' in trait_filter:
+            trait_q['trait_name'] = trait_filter.pop('key')
+        if trait_filter:
+            field, value = trait_filter.items()[0]
+            trait_q['trait_type'] = self.EVENT_TRAIT_TYPES[field]
+            trait_q['trait_value'] = value
+        if trait_q:
+            q['traits'] = {'$elemMatch': trait_q}
+
+        if event_filter.marker:
+            marker = self.db.event.find_one({'_id': event_filter.marker})
+            if marker is None:
+                raise base.NoResultFound(
+                    _('Event %s not found') % event_filter.marker)
+            q['$or'] = [{'generated': {'$gt': marker['generated']}},
+                        {'generated': marker['generated'],
+                         '_id': {'$gt': marker['_id']}}]
+
+        sort = [('generated', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+        for event in self.db.event.find(q, sort=sort,
+                                        limit=event_filter.limit or 0):
+            yield models.Event(event['_id'], event['event_type'],
+                               event['generated'],
+                               [models.Trait(trait['trait_name'],
+                                             trait['trait_type'],
+                                             trait['trait_value'])
+                                for trait in event['traits']])
@@ -20,11 +20,22 @@
 from __future__ import absolute_import
 
 import datetime
+import hashlib
+import itertools
+import json
 import operator
 import os
+import zlib
+
+from oslo.config import cfg
+from sqlalchemy import and_
 from sqlalchemy import func
 from sqlalchemy import desc
+from sqlalchemy import exists
+from sqlalchemy import or_
+from sqlalchemy import select
 from sqlalchemy.orm import aliased
+from sqlalchemy.orm import subqueryload
 
 from ceilometer.openstack.common.db import exception as dbexc
 import ceilometer.openstack.common.db.sqlalchemy.session as sqlalchemy_session
@@ -34,21 +45,46 @@ from ceilometer.openstack.common import timeutils
 from ceilometer.storage import base
 from ceilometer.storage import models as api_models
 from ceilometer.storage.sqlalchemy import migration
+from ceilometer.storage.sqlalchemy import partition
 from ceilometer.storage.sqlalchemy.models import Alarm
 from ceilometer.storage.sqlalchemy.models import AlarmChange
 from ceilometer.storage.sqlalchemy.models import Base
 from ceilometer.storage.sqlalchemy.models import Event
+from ceilometer.storage.sqlalchemy.models import MetadataBlob
+from ceilometer.storage.sqlalchemy.models import MetaBigInt
+from ceilometer.storage.sqlalchemy.models import MetaBool
+from ceilometer.storage.sqlalchemy.models import MetaFloat
+from ceilometer.storage.sqlalchemy.models import MetaText
 from ceilometer.storage.sqlalchemy.models import Meter
 from ceilometer.storage.sqlalchemy.models import Project
 from ceilometer.storage.sqlalchemy.models import Resource
+from ceilometer.storage.sqlalchemy.models import ResourceMeter
 from ceilometer.storage.sqlalchemy.models import Source
 from ceilometer.storage.sqlalchemy.models import Trait
 from ceilometer.storage.sqlalchemy.models import UniqueName
 from ceilometer.storage.sqlalchemy.models import User
 from ceilometer import utils
 
+cfg.CONF.import_opt('expirer_batch_size', 'ceilometer.storage',
+                    group='database')
+cfg.CONF.import_opt('meter_partition_period', 'ceilometer.storage',
+                    group='database')
+cfg.CONF.import_opt('deduplicate_metadata', 'ceilometer.storage',
+                    group='database')
+cfg.CONF.import_opt('compress_metadata', 'ceilometer.storage',
+                    group='database')
+
 LOG = log.getLogger(__name__)
 
+# The metadata table of each type of metadata value
+META_TYPE_MAP = {bool: MetaBool,
+                 str: MetaText,
+                 unicode: MetaText,
+                 int: MetaBigInt,
+                 long: MetaBigInt,
+                 float: MetaFloat}
+META_TABLES = [MetaText, MetaBool, MetaBigInt, MetaFloat]
+
 
 class SQLAlchemyStorage(base.StorageEngine):
     """Put the data into a SQLAlchemy database.
@@ -68,6 +104,7 @@ class SQLAlchemyStorage(base.StorageEngine):
               user_id: user uuid            (->user.id)
               project_id: project uuid      (->project.id)
               resource_id: resource uuid    (->resource.id)
+              source_id: source id          (->source.id)
               resource_metadata: metadata dictionaries
               counter_type: counter type
               counter_unit: counter unit
@@ -82,12 +119,22 @@ class SQLAlchemyStorage(base.StorageEngine):
               resource_metadata: metadata dictionaries
               project_id: project uuid      (->project.id)
               user_id: user uuid            (->user.id)
+              source_id: source id          (->source.id)
+              first_sample_timestamp: datetime
+              last_sample_timestamp: datetime
               }
-        - sourceassoc
-          - the relationships
-          - { meter_id: meter id            (->meter.id)
-              project_id: project uuid      (->project.id)
+        - resource_meter
+          - the catalog of the meters of the resources
+          - { id: resource meter id
               resource_id: resource uuid    (->resource.id)
+              counter_name: counter name
+              counter_type: counter type
+              counter_unit: counter unit
+              source_id: source id          (->source.id)
+              }
+        - sourceassoc
+          - the sources of the users and projects
+          - { project_id: project uuid      (->project.id)
               user_id: user uuid            (->user.id)
               source_id: source id          (->source.id)
               }
@@ -100,6 +147,42 @@ class SQLAlchemyStorage(base.StorageEngine):
         return Connection(conf)
 
 
+def make_metadata_rows(sample_id, metadata):
+    """Return the metadata table rows of the flattened metadata of a sample.
+
+    The nested keys are joined with dots, as in the metaqueries. The lists
+    and the texts too long to be indexed are left out.
+    """
+    rows = []
+    for key, value in utils.recursive_keypairs(metadata, separator='.'):
+        model = META_TYPE_MAP.get(type(value))
+        if model is None or (model is MetaText and len(value) > 255):
+            continue
+        rows.append(model(id=sample_id, meta_key=key, value=value))
+    return rows
+
+
+def make_metaquery_criteria(metaquery):
+    """Return the criteria on the sample ids matching a metaquery.
+
+    Each criterion is served by the (key, value) index of a metadata table.
+
+    :param metaquery: dict of the metadata values by 'metadata.' keys.
+    """
+    criteria = []
+    for key, value in metaquery.iteritems():
+        model = META_TYPE_MAP.get(type(value))
+        if model is None:
+            raise NotImplementedError(
+                _('Query on %(key)s is of %(type)s type and is not supported')
+                % {'key': key, 'type': type(value).__name__})
+        if key.startswith('metadata.'):
+            key = key[len('metadata.'):]
+        criteria.append(Meter.id.in_(select([model.id]).where(and_(
+            model.meta_key == key, model.value == value))))
+    return criteria
+
+
 def make_query_from_filter(query, sample_filter, require_meter=True):
     """Return a query dictionary based on the settings in the filter.
 
@@ -113,7 +196,7 @@ def make_query_from_filter(query, sample_filter, require_meter=True):
     elif require_meter:
         raise RuntimeError(_('Missing required meter specifier'))
     if sample_filter.source:
-        query = query.filter(Meter.sources.any(id=sample_filter.source))
+        query = query.filter(Meter.source_id == sample_filter.source)
     if sample_filter.start:
         ts_start = sample_filter.start
         if sample_filter.start_timestamp_op == 'gt':
@@ -134,7 +217,8 @@ def make_query_from_filter(query, sample_filter, require_meter=True):
         query = query.filter_by(resource_id=sample_filter.resource)
 
     if sample_filter.metaquery:
-        raise NotImplementedError(_('metaquery not implemented'))
+        query = query.filter(and_(
+            *make_metaquery_criteria(sample_filter.metaquery)))
 
     return query
 
@@ -142,29 +226,75 @@ def make_query_from_filter(query, sample_filter, require_meter=True):
 class Connection(base.Connection):
     """SqlAlchemy connection."""
 
+    # Maximum number of decoded metadata blobs kept in memory, and of
+    # metadata blob keys known to be stored
+    METADATA_CACHE_SIZE = 1000
+
+    # Number of seconds after which a metadata blob known to be stored is
+    # marked as used again when recording samples with it
+    METADATA_REFRESH_PERIOD = 3600
+
     def __init__(self, conf):
         url = conf.database.connection
         if url == 'sqlite://':
             conf.database.connection = \
                 os.environ.get('CEILOMETER_TEST_SQL_URL', url)
+        # UniqueName keys to ids, these rows are never updated nor deleted
+        self._unique_names = {}
+        self._partitioner = None
+        # Metadata blob keys to their JSON encoding, the blobs are never
+        # updated.
+        self._metadata_blobs = {}
+        # Metadata blob keys to the last time they were marked as used
+        self._known_blobs = {}
+
+    @property
+    def partitioner(self):
+        """The partitioner of the meter table, None if not partitioned."""
+        period = cfg.CONF.database.meter_partition_period
+        if period and self._partitioner is None:
+            engine = sqlalchemy_session.get_session().get_bind()
+            self._partitioner = partition.get_partitioner(engine, period)
+            if isinstance(self._partitioner,
+                          partition.PostgreSQLPartitioner):
+                # The partitioning trigger inserts the samples into the
+                # partitions, so INSERT ... RETURNING on the meter table
+                # itself returns no row: read the ids back separately.
+                Meter.__table__.implicit_returning = False
+        return self._partitioner
 
     def upgrade(self):
         session = sqlalchemy_session.get_session()
         migration.db_sync(session.get_bind())
+        if self.partitioner:
+            self.partitioner.setup()
+            self.partitioner.ensure(timeutils.utcnow())
 
     def clear(self):
         session = sqlalchemy_session.get_session()
         engine = session.get_bind()
         for table in reversed(Base.metadata.sorted_tables):
             engine.execute(table.delete())
+        self._unique_names = {}
+        self._metadata_blobs = {}
+        self._known_blobs = {}
 
-    @staticmethod
-    def record_metering_data(data):
+    def record_metering_data(self, data):
         """Write the data to the backend storage system.
 
         :param data: a dictionary such as returned by
                      ceilometer.meter.meter_message_from_counter
         """
+        if self.partitioner:
+            self.partitioner.ensure(data['timestamp'])
+        try:
+            self._record_metering_data(data)
+        except dbexc.DBDuplicateEntry:
+            # Another collector recorded the same resource meter or
+            # metadata blob in the meantime, which the replay reuses.
+            self._record_metering_data(data)
+
+    def _record_metering_data(self, data):
         session = sqlalchemy_session.get_session()
         with session.begin():
             if data['source']:
@@ -194,57 +324,182 @@ class Connection(base.Connection):
             rmetadata = data['resource_metadata']
 
             resource = session.merge(Resource(id=str(data['resource_id'])))
-            if not filter(lambda x: x.id == source.id, resource.sources):
-                resource.sources.append(source)
-            resource.project = project
-            resource.user = user
             # Current metadata being used and when it was last updated.
-            resource.resource_metadata = rmetadata
+            timestamp = data['timestamp']
+            if (resource.last_sample_timestamp is None or
+                    timestamp >= resource.last_sample_timestamp):
+                resource.project = project
+                resource.user = user
+                resource.source_id = data['source']
+                resource.resource_metadata = rmetadata
+                resource.last_sample_timestamp = timestamp
+            if (resource.first_sample_timestamp is None or
+                    timestamp < resource.first_sample_timestamp):
+                resource.first_sample_timestamp = timestamp
+            # Keep the catalog of the meters of the resource, so that
+            # listing resources and meters does not go through the samples.
+            resource_meter = dict(resource_id=resource.id,
+                                  counter_name=data['counter_name'],
+                                  counter_type=data['counter_type'],
+                                  counter_unit=data['counter_unit'],
+                                  source_id=data['source'])
+            if not session.query(ResourceMeter.id).filter_by(
+                    **resource_meter).first():
+                session.add(ResourceMeter(**resource_meter))
 
             # Record the raw data for the meter.
             meter = Meter(counter_type=data['counter_type'],
                           counter_unit=data['counter_unit'],
                           counter_name=data['counter_name'], resource=resource)
             session.add(meter)
-            if not filter(lambda x: x.id == source.id, meter.sources):
-                meter.sources.append(source)
+            meter.source_id = data['source']
             meter.project = project
             meter.user = user
             meter.timestamp = data['timestamp']
-            meter.resource_metadata = rmetadata
+            blob_used = None
+            if cfg.CONF.database.deduplicate_metadata:
+                meter.metadata_hash, blob_used = self._record_metadata_blob(
+                    session, rmetadata)
+            else:
+                meter.resource_metadata = rmetadata
             meter.counter_volume = data['counter_volume']
             meter.message_signature = data['message_signature']
             meter.message_id = data['message_id']
             session.flush()
 
-    @staticmethod
-    def clear_expired_metering_data(ttl):
+            # Index the metadata of the sample for the metaqueries
+            if rmetadata:
+                session.add_all(make_metadata_rows(meter.id, rmetadata))
+                session.flush()
+
+        # Only known once committed, to not keep blobs rolled back
+        if blob_used is not None:
+            if len(self._known_blobs) >= self.METADATA_CACHE_SIZE:
+                self._known_blobs = {}
+            self._known_blobs[meter.metadata_hash] = blob_used
+
+    def _record_metadata_blob(self, session, metadata):
+        """Return the key of the metadata blob, recording it if new.
+
+        A blob not marked as used for METADATA_REFRESH_PERIOD is marked
+        again, or recorded again if the expirer deleted it meanwhile, the
+        expirer keeping the orphan blobs used in twice that period.
+        Returns the key and the time the blob was marked as used, None
+        if it did not need to be.
+        """
+        value = json.dumps(metadata, sort_keys=True)
+        key = hashlib.sha1(value).hexdigest()
+        used = self._known_blobs.get(key)
+        if used is not None and not timeutils.is_older_than(
+                used, self.METADATA_REFRESH_PERIOD):
+            return key, None
+        now = timeutils.utcnow()
+        if session.query(MetadataBlob).filter_by(id=key).update(
+                {'last_used': now}, synchronize_session=False):
+            return key, now
+        compressed = cfg.CONF.database.compress_metadata
+        if compressed:
+            value = zlib.compress(value)
+        session.add(MetadataBlob(id=key, value=value, compressed=compressed,
+                                 last_used=now))
+        return key, now
+
+    def _get_metadata_blobs(self, session, keys):
+        """Return a dict mapping the given keys to their metadata.
+
+        The blobs are looked up in the cache, then in the database with a
+        single query.
+        """
+        missing = set(keys) - set(self._metadata_blobs)
+        if missing:
+            if (len(self._metadata_blobs) + len(missing) >
+                    self.METADATA_CACHE_SIZE):
+                self._metadata_blobs = {}
+            for blob in session.query(MetadataBlob).filter(
+                    MetadataBlob.id.in_(missing)):
+                value = blob.value
+                if blob.compressed:
+                    value = zlib.decompress(value)
+                self._metadata_blobs[blob.id] = value
+        return dict((key, json.loads(self._metadata_blobs[key]))
+                    for key in keys if key in self._metadata_blobs)
+
+    def clear_expired_metering_data(self, ttl):
         """Clear expired data from the backend storage system according to the
         time-to-live.
 
+        The partitions of the meter table holding expired samples only are
+        dropped, then the remaining expired samples are deleted in batches,
+        one transaction each, so that the tables are not locked for the
+        whole run and an interrupted run is resumed by the next one.
+
         :param ttl: Number of seconds to keep records for.
 
+        Returns the number of samples deleted, estimated for the dropped
+        partitions.
         """
         session = sqlalchemy_session.get_session()
-        query = session.query(Meter.id)
+        batch_size = cfg.CONF.database.expirer_batch_size
         end = timeutils.utcnow() - datetime.timedelta(seconds=ttl)
-        query = query.filter(Meter.timestamp < end)
-        query.delete()
-
-        query = session.query(User.id).filter(~User.id.in_(
-            session.query(Meter.user_id).group_by(Meter.user_id)
-        ))
-        query.delete(synchronize_session='fetch')
-
-        query = session.query(Project.id).filter(~Project.id.in_(
-            session.query(Meter.project_id).group_by(Meter.project_id)
-        ))
-        query.delete(synchronize_session='fetch')
-
-        query = session.query(Resource.id).filter(~Resource.id.in_(
-            session.query(Meter.resource_id).group_by(Meter.resource_id)
-        ))
-        query.delete(synchronize_session='fetch')
+        count = 0
+        if self.partitioner:
+            count += self.partitioner.expire(end)
+            LOG.info(_('Expired %d samples by dropping partitions'), count)
+        while True:
+            with session.begin():
+                ids = [row[0] for row in session.query(Meter.id).filter(
+                    Meter.timestamp < end).limit(batch_size)]
+                if not ids:
+                    break
+                for model in META_TABLES:
+                    session.query(model).filter(model.id.in_(ids)).delete(
+                        synchronize_session=False)
+                session.query(Meter).filter(Meter.id.in_(ids)).delete(
+                    synchronize_session=False)
+            count += len(ids)
+            LOG.info(_('Expired %d samples so far'), count)
+
+        # The first samples of some resources are gone
+        first_ts = select([func.min(Meter.timestamp)]).where(
+            Meter.resource_id == Resource.id).correlate(
+                Resource.__table__).as_scalar()
+        with session.begin():
+            session.query(Resource).filter(
+                Resource.first_sample_timestamp < end).update(
+                    {'first_sample_timestamp': first_ts},
+                    synchronize_session=False)
+
+        # The meter indexes on these columns make each check a lookup,
+        # rather than grouping the whole meter table.
+        orphans = [
+            (ResourceMeter, and_(
+                Meter.resource_id == ResourceMeter.resource_id,
+                Meter.counter_name == ResourceMeter.counter_name)),
+            (User, Meter.user_id == User.id),
+            (Project, Meter.project_id == Project.id),
+            (Resource, Meter.resource_id == Resource.id)]
+        if self.partitioner:
+            # The metadata of the samples of the dropped partitions
+            orphans.extend((model, Meter.id == model.id)
+                           for model in META_TABLES)
+        orphans = [(model, ~exists().where(has_samples))
+                   for model, has_samples in orphans]
+        # The blobs used lately may be referenced by samples being
+        # recorded, see _record_metadata_blob.
+        orphans.append((MetadataBlob, and_(
+            ~exists().where(Meter.metadata_hash == MetadataBlob.id),
+            MetadataBlob.last_used < timeutils.utcnow() - datetime.timedelta(
+                seconds=2 * self.METADATA_REFRESH_PERIOD))))
+        for model, orphan in orphans:
+            while True:
+                with session.begin():
+                    ids = [row[0] for row in session.query(model.id).filter(
+                        orphan).limit(batch_size)]
+                    if not ids:
+                        break
+                    session.query(model).filter(model.id.in_(ids)).delete(
+                        synchronize_session=False)
+        return count
 
     @staticmethod
     def get_users(source=None):
@@ -270,8 +525,7 @@ class Connection(base.Connection):
             query = query.filter(Project.sources.any(id=source))
         return (x[0] for x in query.all())
 
-    @staticmethod
-    def get_resources(user=None, project=None, source=None,
+    def get_resources(self, user=None, project=None, source=None,
                       start_timestamp=None, start_timestamp_op=None,
                       end_timestamp=None, end_timestamp_op=None,
                       metaquery={}, resource=None, pagination=None):
@@ -294,87 +548,123 @@ class Connection(base.Connection):
         # just fail.
         if pagination:
             raise NotImplementedError(_('Pagination not implemented'))
-        if metaquery:
-            raise NotImplementedError(_('metaquery not implemented'))
+        metaquery_criteria = make_metaquery_criteria(metaquery)
 
-        # (thomasm) We need to get the max timestamp first, since that's the
-        # most accurate. We also need to filter down in the subquery to
-        # constrain what we have to JOIN on later.
+        # The first and last sample timestamps, the latest metadata and the
+        # meters are maintained on the resource at ingest time, only a time
+        # range requires looking at the samples.
         session = sqlalchemy_session.get_session()
 
-        ts_subquery = session.query(
-            Meter.resource_id,
-            func.max(Meter.timestamp).label("max_ts"),
-            func.min(Meter.timestamp).label("min_ts")
-        ).group_by(Meter.resource_id)
-
-        # Here are the basic 'eq' operation filters for the sample data.
-        for column, value in [(Meter.resource_id, resource),
-                              (Meter.user_id, user),
-                              (Meter.project_id, project)]:
-            if value:
-                ts_subquery = ts_subquery.filter(column == value)
-
-        if source:
-            ts_subquery = ts_subquery.filter(
-                Meter.sources.any(id=source))
-
-        # Here we limit the samples being used to a specific time period,
-        # if requested.
-        if start_timestamp:
-            if start_timestamp_op == 'gt':
-                ts_subquery = ts_subquery.filter(
-                    Meter.timestamp > start_timestamp
-                )
-            else:
-                ts_subquery = ts_subquery.filter(
-                    Meter.timestamp >= start_timestamp
-                )
-        if end_timestamp:
-            if end_timestamp_op == 'le':
-                ts_subquery = ts_subquery.filter(
-                    Meter.timestamp <= end_timestamp
-                )
+        if start_timestamp or end_timestamp:
+            # Here are the basic 'eq' operation filters for the sample data.
+            criteria = [column == value
+                        for column, value in [(Meter.resource_id, resource),
+                                              (Meter.user_id, user),
+                                              (Meter.project_id, project),
+                                              (Meter.source_id, source)]
+                        if value]
+            criteria.extend(metaquery_criteria)
+
+            # Here we limit the samples being used to a specific time
+            # period.
+            if start_timestamp:
+                if start_timestamp_op == 'gt':
+                    criteria.append(Meter.timestamp > start_timestamp)
+                else:
+                    criteria.append(Meter.timestamp >= start_timestamp)
+            if end_timestamp:
+                if end_timestamp_op == 'le':
+                    criteria.append(Meter.timestamp <= end_timestamp)
+                else:
+                    criteria.append(Meter.timestamp < end_timestamp)
+
+            ts_subquery = session.query(
+                Meter.resource_id,
+                func.max(Meter.timestamp).label("max_ts"),
+                func.min(Meter.timestamp).label("min_ts")
+            ).filter(and_(*criteria)).group_by(Meter.resource_id).subquery()
+
+            # The user, project, source and metadata are the ones of the
+            # latest sample of the range, rather than of the resource.
+            query = session.query(
+                Resource,
+                ts_subquery.c.min_ts,
+                ts_subquery.c.max_ts,
+                Meter
+            ).filter(
+                Resource.id == ts_subquery.c.resource_id
+            ).filter(
+                Meter.resource_id == ts_subquery.c.resource_id
+            ).filter(
+                Meter.timestamp == ts_subquery.c.max_ts
+            ).filter(and_(*criteria)).order_by(desc(Meter.id))
+        else:
+            query = session.query(
+                Resource,
+                Resource.first_sample_timestamp,
+                Resource.last_sample_timestamp
+            )
+            if resource:
+                query = query.filter(Resource.id == resource)
+            # The resources having samples of the user or project, not
+            # only those whose latest sample is.
+            for column, value in [(Meter.user_id, user),
+                                  (Meter.project_id, project)]:
+                if value:
+                    query = query.filter(Resource.id.in_(
+                        select([Meter.resource_id]).where(column == value)))
+            if source:
+                query = query.filter(exists().where(and_(
+                    ResourceMeter.resource_id == Resource.id,
+                    ResourceMeter.source_id == source)))
+            if metaquery_criteria:
+                query = query.filter(Resource.id.in_(
+                    select([Meter.resource_id]).where(
+                        and_(*metaquery_criteria))))
+
+        query = query.options(subqueryload(Resource.resource_meters))
+
+        if start_timestamp or end_timestamp:
+            # Keep the last recorded of the samples at the end of the range
+            latest = {}
+            for row in query.all():
+                latest.setdefault(row[0].id, row)
+            rows = latest.values()
+        else:
+            rows = [(res, first_ts, last_ts, None)
+                    for res, first_ts, last_ts in query.all()]
+        blobs = self._get_metadata_blobs(
+            session, set(row[3].metadata_hash for row in rows
+                         if row[3] is not None and row[3].metadata_hash))
+
+        for res, first_ts, last_ts, sample in rows:
+            if sample is None:
+                user_id, project_id = res.user_id, res.project_id
+                source_id, metadata = res.source_id, res.resource_metadata
             else:
-                ts_subquery = ts_subquery.filter(
-                    Meter.timestamp < end_timestamp
-                )
-        ts_subquery = ts_subquery.subquery()
-
-        # Now we need to get the max Meter.id out of the leftover results, to
-        # break any ties.
-        agg_subquery = session.query(
-            func.max(Meter.id).label("max_id"),
-            ts_subquery
-        ).filter(
-            Meter.resource_id == ts_subquery.c.resource_id,
-            Meter.timestamp == ts_subquery.c.max_ts
-        ).group_by(Meter.resource_id).subquery()
-
-        query = session.query(
-            Meter,
-            agg_subquery.c.min_ts,
-            agg_subquery.c.max_ts
-        ).filter(
-            Meter.id == agg_subquery.c.max_id
-        )
-
-        for meter, first_ts, last_ts in query.all():
+                user_id, project_id = sample.user_id, sample.project_id
+                source_id = sample.source_id
+                metadata = (blobs.get(sample.metadata_hash, {})
+                            if sample.metadata_hash
+                            else sample.resource_metadata)
+            meters = sorted(set((m.counter_name, m.counter_type,
+                                 m.counter_unit)
+                                for m in res.resource_meters))
             yield api_models.Resource(
-                resource_id=meter.resource_id,
-                project_id=meter.project_id,
+                resource_id=res.id,
+                project_id=project_id,
                 first_sample_timestamp=first_ts,
                 last_sample_timestamp=last_ts,
-                source=meter.sources[0].id,
-                user_id=meter.user_id,
-                metadata=meter.resource_metadata,
+                source=source_id,
+                user_id=user_id,
+                metadata=metadata,
                 meter=[
                     api_models.ResourceMeter(
-                        counter_name=m.counter_name,
-                        counter_type=m.counter_type,
-                        counter_unit=m.counter_unit,
+                        counter_name=name,
+                        counter_type=type,
+                        counter_unit=unit,
                     )
-                    for m in meter.resource.meters
+                    for name, type, unit in meters
                 ],
             )
 
@@ -393,56 +683,49 @@ class Connection(base.Connection):
 
         if pagination:
             raise NotImplementedError(_('Pagination not implemented'))
-        if metaquery:
-            raise NotImplementedError(_('metaquery not implemented'))
 
         session = sqlalchemy_session.get_session()
 
-        # Meter table will store large records and join with resource
-        # will be very slow.
-        # subquery_meter is used to reduce meter records
-        # by selecting a record for each (resource_id, counter_name).
-        # max() is used to choice a meter record, so the latest record
-        # is selected for each (resource_id, counter_name).
-        #
-        subquery_meter = session.query(func.max(Meter.id).label('id')).\
-            group_by(Meter.resource_id, Meter.counter_name).subquery()
-
-        # The SQL of query_meter is essentially:
-        #
-        # SELECT meter.* FROM meter INNER JOIN
-        #  (SELECT max(meter.id) AS id FROM meter
-        #   GROUP BY meter.resource_id, meter.counter_name) AS anon_2
-        # ON meter.id = anon_2.id
-        #
-        query_meter = session.query(Meter).\
-            join(subquery_meter, Meter.id == subquery_meter.c.id)
-
-        alias_meter = aliased(Meter, query_meter.subquery())
-        query = session.query(Resource, alias_meter).join(
-            alias_meter, Resource.id == alias_meter.resource_id)
+        # The meters are read from their catalog, joined with the
+        # resources to get their owner.
+        query = session.query(Resource, ResourceMeter).join(
+            ResourceMeter, Resource.id == ResourceMeter.resource_id)
 
         if user is not None:
             query = query.filter(Resource.user_id == user)
         if source is not None:
-            query = query.filter(Resource.sources.any(id=source))
+            query = query.filter(ResourceMeter.source_id == source)
         if resource:
             query = query.filter(Resource.id == resource)
         if project is not None:
             query = query.filter(Resource.project_id == project)
-
+        if metaquery:
+            # The resources with samples matching the metaquery
+            query = query.filter(Resource.id.in_(
+                select([Meter.resource_id]).where(
+                    and_(*make_metaquery_criteria(metaquery)))))
+
+        # A meter sampled from several sources is listed once, with the
+        # source of the latest sample of the resource when it has it.
+        meters = {}
         for resource, meter in query.all():
+            key = (resource.id, meter.counter_name, meter.counter_type,
+                   meter.counter_unit)
+            if key not in meters or meter.source_id == resource.source_id:
+                meters[key] = (resource, meter)
+
+        # Listed in the order of the resources and the meter names
+        for key, (resource, meter) in sorted(meters.iteritems()):
             yield api_models.Meter(
                 name=meter.counter_name,
                 type=meter.counter_type,
                 unit=meter.counter_unit,
                 resource_id=resource.id,
                 project_id=resource.project_id,
-                source=resource.sources[0].id,
+                source=meter.source_id,
                 user_id=resource.user_id)
 
-    @staticmethod
-    def get_samples(sample_filter, limit=None):
+    def get_samples(self, sample_filter, limit=None):
         """Return an iterable of api_models.Samples.
 
         :param sample_filter: Filter.
@@ -458,16 +741,15 @@ class Connection(base.Connection):
         if limit:
             query = query.limit(limit)
         samples = query.from_self().order_by(desc(Meter.timestamp)).all()
+        blobs = self._get_metadata_blobs(
+            session, set(s.metadata_hash for s in samples if s.metadata_hash))
 
         for s in samples:
             # Remove the id generated by the database when
             # the sample was inserted. It is an implementation
             # detail that should not leak outside of the driver.
             yield api_models.Sample(
-                # Replace 'sources' with 'source' to meet the caller's
-                # expectation, Meter.sources contains one and only one
-                # source in the current implementation.
-                source=s.sources[0].id,
+                source=s.source_id,
                 counter_name=s.counter_name,
                 counter_type=s.counter_type,
                 counter_unit=s.counter_unit,
@@ -476,7 +758,9 @@ class Connection(base.Connection):
                 project_id=s.project_id,
                 resource_id=s.resource_id,
                 timestamp=s.timestamp,
-                resource_metadata=s.resource_metadata,
+                resource_metadata=(blobs.get(s.metadata_hash, {})
+                                   if s.metadata_hash
+                                   else s.resource_metadata),
                 message_id=s.message_id,
                 message_signature=s.message_signature,
             )
@@ -766,13 +1050,39 @@ class Connection(base.Connection):
                 session.flush()
         return unique
 
-    def _make_trait(self, trait_model, event, session=None):
+    def _get_unique_name_ids(self, session, keys):
+        """Return a dict mapping the given keys to their UniqueName ids.
+
+        The ids are looked up in the cache, then in the database with a
+        single query, and the missing UniqueName entries are created.
+
+        This may result in a flush.
+        """
+        ids = dict((key, self._unique_names[key])
+                   for key in keys if key in self._unique_names)
+        missing = set(keys) - set(ids)
+        if missing:
+            for unique in session.query(UniqueName).filter(
+                    UniqueName.key.in_(missing)):
+                ids.setdefault(unique.key, unique.id)
+            created = [UniqueName(key=key) for key in missing
+                       if key not in ids]
+            if created:
+                session.add_all(created)
+                session.flush()
+                ids.update((unique.key, unique.id) for unique in created)
+        return ids
+
+    def _make_trait(self, trait_model, event, session=None, name_id=None):
         """Make a new Trait from a Trait model.
 
         Doesn't flush or add to session.
         """
-        name = self._get_or_create_unique_name(trait_model.name,
-                                               session=session)
+        if name_id is None:
+            name = self._get_or_create_unique_name(trait_model.name,
+                                                   session=session)
+        else:
+            name = None
         value_map = Trait._value_map
         values = {'t_string': None, 't_float': None,
                   't_int': None, 't_datetime': None}
@@ -780,28 +1090,33 @@ class Connection(base.Connection):
         if trait_model.dtype == api_models.Trait.DATETIME_TYPE:
             value = utils.dt_to_decimal(value)
         values[value_map[trait_model.dtype]] = value
-        return Trait(name, event, trait_model.dtype, **values)
+        trait = Trait(name, event, trait_model.dtype, **values)
+        if name_id is not None:
+            trait.name_id = name_id
+        return trait
 
-    def _record_event(self, session, event_model):
+    def _record_event(self, session, event_model, names):
         """Store a single Event, including related Traits.
+
+        :param names: dict mapping the event and trait names to their
+                      UniqueName ids.
         """
         with session.begin(subtransactions=True):
-            unique = self._get_or_create_unique_name(event_model.event_name,
-                                                     session=session)
-
             generated = utils.dt_to_decimal(event_model.generated)
-            event = Event(event_model.message_id, unique, generated)
+            event = Event(event_model.message_id, None, generated)
+            event.unique_name_id = names[event_model.event_name]
             session.add(event)
 
             new_traits = []
             if event_model.traits:
                 for trait in event_model.traits:
-                    t = self._make_trait(trait, event, session=session)
+                    t = self._make_trait(trait, event,
+                                         name_id=names[trait.name])
                     session.add(t)
                     new_traits.append(t)
 
-        # Note: we don't flush here, explicitly (unless a new uniquename
-        # does it). Otherwise, just wait until all the Events are staged.
+        # Note: we don't flush here, explicitly. Otherwise, just wait
+        # until all the Events are staged.
         return (event, new_traits)
 
     def record_events(self, event_models):
@@ -814,25 +1129,65 @@ class Connection(base.Connection):
         storage.model.Event
         """
         session = sqlalchemy_session.get_session()
-        events = []
         problem_events = []
+
+        # Report the events already stored or repeated in the batch
+        # upfront, so that they don't abort the batch insertion.
+        with session.begin():
+            stored = set(row.message_id for row in session.query(
+                Event.message_id).filter(Event.message_id.in_(
+                    [model.message_id for model in event_models])))
+        to_record = []
         for event_model in event_models:
-            event = None
-            try:
-                with session.begin():
-                    event = self._record_event(session, event_model)
-                    session.flush()
-            except dbexc.DBDuplicateEntry:
+            if event_model.message_id in stored:
                 problem_events.append((api_models.Event.DUPLICATE,
                                        event_model))
-            except Exception as e:
-                LOG.exception('Failed to record event: %s', e)
-                problem_events.append((api_models.Event.UNKNOWN_PROBLEM,
-                                       event_model))
-            events.append(event)
+            else:
+                stored.add(event_model.message_id)
+                to_record.append(event_model)
+
+        keys = set()
+        for event_model in to_record:
+            keys.add(event_model.event_name)
+            keys.update(trait.name for trait in event_model.traits or [])
+        try:
+            with session.begin():
+                names = self._get_unique_name_ids(session, keys)
+        except Exception as e:
+            LOG.exception('Failed to record event names: %s', e)
+            problem_events.extend((api_models.Event.UNKNOWN_PROBLEM, model)
+                                  for model in to_record)
+            return problem_events
+        # Only cached once committed, to not keep ids rolled back
+        self._unique_names.update(names)
+
+        try:
+            with session.begin():
+                recorded = [self._record_event(session, event_model, names)
+                            for event_model in to_record]
+                session.flush()
+        except Exception:
+            # Find out which events are the problem by recording them
+            # one transaction at a time.
+            recorded = []
+            for event_model in to_record:
+                event = None
+                try:
+                    with session.begin():
+                        event = self._record_event(session, event_model,
+                                                   names)
+                        session.flush()
+                except dbexc.DBDuplicateEntry:
+                    problem_events.append((api_models.Event.DUPLICATE,
+                                           event_model))
+                except Exception as e:
+                    LOG.exception('Failed to record event: %s', e)
+                    problem_events.append((api_models.Event.UNKNOWN_PROBLEM,
+                                           event_model))
+                recorded.append(event)
 
         # Update the models with the underlying DB ID.
-        for model, actual in zip(event_models, events):
+        for model, actual in zip(to_record, recorded):
             if not actual:
                 continue
             actual_event, actual_traits = actual
@@ -843,58 +1198,109 @@ class Connection(base.Connection):
 
         return problem_events
 
+    def _get_unique_name_id(self, session, key):
+        """Return the UniqueName id of a key, or None if it is unknown."""
+        if key not in self._unique_names:
+            unique = self._get_unique(session, key)
+            if unique is None:
+                return None
+            self._unique_names[key] = unique.id
+        return self._unique_names[key]
+
+    def _make_event_query(self, session, event_filter):
+        """Return the query of the ids of the events matching a filter,
+        ordered by generation time, or None if nothing can match.
+        """
+        start = utils.dt_to_decimal(event_filter.start)
+        end = utils.dt_to_decimal(event_filter.end)
+        query = session.query(Event.id)\
+            .filter(Event.generated >= start, Event.generated <= end)
+
+        if event_filter.event_name:
+            name_id = self._get_unique_name_id(session,
+                                               event_filter.event_name)
+            if name_id is None:
+                return None
+            query = query.filter(Event.unique_name_id == name_id)
+
+        if event_filter.traits:
+            # All the conditions apply to a single trait, and match the
+            # (name_id, value) indexes.
+            conditions = [Trait.event_id == Event.id]
+            for key, value in event_filter.traits.iteritems():
+                if key == 'key':
+                    name_id = self._get_unique_name_id(session, value)
+                    if name_id is None:
+                        return None
+                    conditions.append(Trait.name_id == name_id)
+                elif key == 't_string':
+                    conditions.append(Trait.t_string == value)
+                elif key == 't_int':
+                    conditions.append(Trait.t_int == value)
+                elif key == 't_datetime':
+                    dt = utils.dt_to_decimal(value)
+                    conditions.append(Trait.t_datetime == dt)
+                elif key == 't_float':
+                    conditions.append(Trait.t_float == value)
+            query = query.filter(exists().where(and_(*conditions)))
+
+        if event_filter.marker:
+            marker = session.query(Event.generated, Event.id).filter(
+                Event.message_id == event_filter.marker).first()
+            if marker is None:
+                raise base.NoResultFound(
+                    _('Event %s not found') % event_filter.marker)
+            query = query.filter(or_(
+                Event.generated > marker.generated,
+                and_(Event.generated == marker.generated,
+                     Event.id > marker.id)))
+
+        query = query.order_by(Event.generated, Event.id)
+        if event_filter.limit:
+            query = query.limit(event_filter.limit)
+        return query
+
     def get_events(self, event_filter):
-        """Return an iterable of model.Event objects.
+        """Return an iterable of model.Event objects, ordered by
+        generation time.
 
         :param event_filter: EventFilter instance
         """
-
-        start = utils.dt_to_decimal(event_filter.start)
-        end = utils.dt_to_decimal(event_filter.end)
         session = sqlalchemy_session.get_session()
         with session.begin():
-            sub_query = session.query(Event.id)\
-                .join(Trait, Trait.event_id == Event.id)\
-                .filter(Event.generated >= start, Event.generated <= end)
-
-            if event_filter.event_name:
-                event_name = self._get_unique(session, event_filter.event_name)
-                sub_query = sub_query.filter(Event.unique_name == event_name)
-
-            if event_filter.traits:
-                for key, value in event_filter.traits.iteritems():
-                    if key == 'key':
-                        key = self._get_unique(session, value)
-                        sub_query = sub_query.filter(Trait.name == key)
-                    elif key == 't_string':
-                        sub_query = sub_query.filter(Trait.t_string == value)
-                    elif key == 't_int':
-                        sub_query = sub_query.filter(Trait.t_int == value)
-                    elif key == 't_datetime':
-                        dt = utils.dt_to_decimal(value)
-                        sub_query = sub_query.filter(Trait.t_datetime == dt)
-                    elif key == 't_float':
-                        sub_query = sub_query.filter(Trait.t_datetime == value)
-
-            sub_query = sub_query.subquery()
-
-            all_data = session.query(Trait)\
-                .join(sub_query, Trait.event_id == sub_query.c.id)
-
-            # Now convert the sqlalchemy objects back into Models ...
-            event_models_dict = {}
-            for trait in all_data.all():
-                event = event_models_dict.get(trait.event_id)
-                if not event:
-                    generated = utils.decimal_to_dt(trait.event.generated)
-                    event = api_models.Event(trait.event.message_id,
-                                             trait.event.unique_name.key,
-                                             generated, [])
-                    event_models_dict[trait.event_id] = event
-                value = trait.get_value()
-                trait_model = api_models.Trait(trait.name.key, trait.t_type,
-                                               value)
-                event.append_trait(trait_model)
-
-        event_models = event_models_dict.values()
-        return sorted(event_models, key=operator.attrgetter('generated'))
+            event_query = self._make_event_query(session, event_filter)
+            if event_query is None:
+                return
+            events = event_query.subquery()
+            event_name = aliased(UniqueName)
+            trait_name = aliased(UniqueName)
+            # A single select of the events and their traits, rather
+            # than loading the events and names of each trait lazily.
+            rows = session.query(Event.id, Event.message_id,
+                                 Event.generated, event_name.key,
+                                 trait_name.key, Trait.t_type,
+                                 Trait.t_string, Trait.t_float,
+                                 Trait.t_int, Trait.t_datetime)\
+                .join(events, Event.id == events.c.id)\
+                .join(event_name, Event.unique_name_id == event_name.id)\
+                .outerjoin(Trait, Trait.event_id == Event.id)\
+                .outerjoin(trait_name, Trait.name_id == trait_name.id)\
+                .order_by(Event.generated, Event.id)\
+                .yield_per(1000)
+
+            for event_id, event_rows in itertools.groupby(
+                    rows, key=operator.itemgetter(0)):
+                first = next(event_rows)
+                event = api_models.Event(first.message_id, first[3],
+                                         utils.decimal_to_dt(
+                                             first.generated), [])
+                for row in itertools.chain([first], event_rows):
+                    if row.t_type is None:
+                        # Event without trait
+                        continue
+                    value = getattr(row, Trait._value_map[row.t_type])
+                    if row.t_type == api_models.Trait.DATETIME_TYPE:
+                        value = utils.decimal_to_dt(value)
+                    event.append_trait(api_models.Trait(row[4], row.t_type,
+                                                        value))
+                yield event
@@ -0,0 +1,141 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Common code of the storage backends using pymongo
+"""
+
+import copy
+import time
+
+from oslo.config import cfg
+
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+from ceilometer.storage import base
+
+LOG = log.getLogger(__name__)
+
+
+class Connection(base.Connection):
+    """Base class of the MongoDB and DB2 connections.
+
+    Subclasses set self.db to their pymongo database.
+    """
+
+    # Number of seconds after which the known user and project sources are
+    # checked against the database again
+    KNOWN_SOURCES_PERIOD = 3600
+
+    def _forget_known_sources(self):
+        # (collection, id, source) known to be stored, to save the upserts
+        self._known_sources = set()
+        self._known_sources_since = time.time()
+
+    def record_metering_data(self, data):
+        """Write the data to the backend storage system.
+
+        :param data: a dictionary such as returned by
+                     ceilometer.meter.meter_message_from_counter
+        """
+        self.record_metering_data_batch([data])
+
+    def record_metering_data_batch(self, samples):
+        """Write the samples to the backend storage system.
+
+        The user and project sources known to be stored already are not
+        updated again, the updates of a resource are merged into one
+        keeping the metadata of its latest sample, and the samples are
+        inserted with a single bulk insert. The samples failing to be
+        inserted are logged and skipped.
+
+        :param samples: a list of dictionaries such as returned by
+                        ceilometer.meter.meter_message_from_counter
+        """
+        # Forget the known sources from time to time, as the users and
+        # projects left without samples are removed by the expirer.
+        ttl = cfg.CONF.database.time_to_live
+        if time.time() - self._known_sources_since > min(
+                self.KNOWN_SOURCES_PERIOD, ttl if ttl > 0 else float('inf')):
+            self._forget_known_sources()
+
+        # Make sure we know about the user and project
+        for collection, key in [(self.db.user, 'user_id'),
+                                (self.db.project, 'project_id')]:
+            for data in samples:
+                known = (collection.name, data[key], data['source'])
+                if known in self._known_sources:
+                    continue
+                collection.update(
+                    {'_id': data[key]},
+                    {'$addToSet': {'source': data['source'],
+                                   },
+                     },
+                    upsert=True,
+                )
+                self._known_sources.add(known)
+
+        # Record the updated resource metadata, from the latest sample
+        resources = {}
+        resource_meters = {}
+        for data in samples:
+            latest = resources.get(data['resource_id'])
+            if latest is None or data['timestamp'] >= latest['timestamp']:
+                resources[data['resource_id']] = data
+            meters = resource_meters.setdefault(data['resource_id'], [])
+            meter = {'counter_name': data['counter_name'],
+                     'counter_type': data['counter_type'],
+                     'counter_unit': data['counter_unit'],
+                     }
+            if meter not in meters:
+                meters.append(meter)
+        for resource_id, data in resources.iteritems():
+            meters = resource_meters[resource_id]
+            self.db.resource.update(
+                {'_id': resource_id},
+                {'$set': {'project_id': data['project_id'],
+                          'user_id': data['user_id'],
+                          'metadata': data['resource_metadata'],
+                          'source': data['source'],
+                          },
+                 '$addToSet': {'meter': {'$each': meters,
+                                         },
+                               },
+                 },
+                upsert=True,
+            )
+
+        # Record the raw data for the meters. Use copies so we do not
+        # modify data structures owned by our caller (the driver adds
+        # a new key '_id').
+        self._insert_meter_records([copy.copy(data) for data in samples])
+
+    def _insert_meter_records(self, records):
+        try:
+            self.db.meter.insert(records, continue_on_error=True)
+        except Exception as err:
+            # The other records are inserted nonetheless, only the ones
+            # missing are retried, so that none is stored twice.
+            LOG.warning(_('Failed to insert %(count)d samples at once, '
+                          'retrying the missing ones: %(err)s') %
+                        {'count': len(records), 'err': err})
+            ids = [record['_id'] for record in records]
+            stored = set(doc['_id'] for doc in self.db.meter.find(
+                {'_id': {'$in': ids}}, fields=['_id']))
+            for record in records:
+                if record['_id'] in stored:
+                    continue
+                try:
+                    self.db.meter.insert(record)
+                except Exception as err:
+                    LOG.exception(_('Failed to record metering data: %s')
+                                  % err)
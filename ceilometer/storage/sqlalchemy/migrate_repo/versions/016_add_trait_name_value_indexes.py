@@ -0,0 +1,37 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+VALUE_COLUMNS = ['t_string', 't_int', 't_float', 't_datetime']
+
+
+def _indexes(trait):
+    return [Index('ix_trait_name_id_%s' % column, trait.c.name_id,
+                  trait.c[column])
+            for column in VALUE_COLUMNS]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    trait = Table('trait', meta, autoload=True)
+    for index in _indexes(trait):
+        index.create(bind=migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    trait = Table('trait', meta, autoload=True)
+    for index in _indexes(trait):
+        index.drop(bind=migrate_engine)
@@ -0,0 +1,31 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+
+def _index(sourceassoc):
+    return Index('ix_sourceassoc_meter_id', sourceassoc.c.meter_id)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    sourceassoc = Table('sourceassoc', meta, autoload=True)
+    _index(sourceassoc).create(bind=migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    sourceassoc = Table('sourceassoc', meta, autoload=True)
+    _index(sourceassoc).drop(bind=migrate_engine)
@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer
+from sqlalchemy import MetaData, String, Table
+from sqlalchemy import func, select
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    resource = Table('resource', meta, autoload=True)
+    meter = Table('meter', meta, autoload=True)
+
+    first = Column('first_sample_timestamp', DateTime)
+    resource.create_column(first)
+    last = Column('last_sample_timestamp', DateTime)
+    resource.create_column(last)
+
+    resource_meter = Table(
+        'resource_meter', meta,
+        Column('id', Integer, primary_key=True),
+        Column('resource_id', String(255), ForeignKey('resource.id')),
+        Column('counter_name', String(255)),
+        Column('counter_type', String(255)),
+        Column('counter_unit', String(255)),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8')
+    resource_meter.create()
+    Index('ix_resource_meter_resource_id_counter_name',
+          resource_meter.c.resource_id,
+          resource_meter.c.counter_name).create(bind=migrate_engine)
+
+    # Populate from the samples recorded so far ...
+    resource.update().values(
+        first_sample_timestamp=select(
+            [func.min(meter.c.timestamp)]).where(
+                meter.c.resource_id == resource.c.id).as_scalar(),
+        last_sample_timestamp=select(
+            [func.max(meter.c.timestamp)]).where(
+                meter.c.resource_id == resource.c.id).as_scalar(),
+    ).execute()
+
+    meters = select([meter.c.resource_id, meter.c.counter_name,
+                     meter.c.counter_type, meter.c.counter_unit]).distinct()
+    for resource_id, name, type, unit in meters.execute():
+        resource_meter.insert().values(resource_id=resource_id,
+                                       counter_name=name,
+                                       counter_type=type,
+                                       counter_unit=unit).execute()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    resource_meter = Table('resource_meter', meta, autoload=True)
+    resource_meter.drop()
+
+    resource = Table('resource', meta, autoload=True)
+    first = Column('first_sample_timestamp', DateTime)
+    resource.drop_column(first)
+    last = Column('last_sample_timestamp', DateTime)
+    resource.drop_column(last)
@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Column, ForeignKey, MetaData, String, Table
+from sqlalchemy import select
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    resource_meter = Table('resource_meter', meta, autoload=True)
+    meter = Table('meter', meta, autoload=True)
+    sourceassoc = Table('sourceassoc', meta, autoload=True)
+    Table('source', meta, autoload=True)
+
+    source = Column('source_id', String(255), ForeignKey('source.id'))
+    resource_meter.create_column(source)
+
+    # Populate again, with the sources of the samples ...
+    resource_meter.delete().execute()
+    meters = select([meter.c.resource_id, meter.c.counter_name,
+                     meter.c.counter_type, meter.c.counter_unit,
+                     sourceassoc.c.source_id],
+                    from_obj=meter.join(
+                        sourceassoc,
+                        sourceassoc.c.meter_id == meter.c.id)).distinct()
+    for resource_id, name, type, unit, source_id in meters.execute():
+        resource_meter.insert().values(resource_id=resource_id,
+                                       counter_name=name,
+                                       counter_type=type,
+                                       counter_unit=unit,
+                                       source_id=source_id).execute()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    resource_meter = Table('resource_meter', meta, autoload=True)
+    source = Column('source_id', String(255))
+    resource_meter.drop_column(source)
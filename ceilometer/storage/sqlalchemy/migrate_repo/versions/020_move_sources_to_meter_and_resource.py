@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Column, ForeignKey, Index, MetaData, String, Table
+from sqlalchemy import func, null, select
+
+meta = MetaData()
+
+# Number of samples updated per statement
+BATCH_SIZE = 10000
+
+
+def _source_column():
+    return Column('source_id', String(255), ForeignKey('source.id'))
+
+
+def _meter_id_index(sourceassoc):
+    return Index('ix_sourceassoc_meter_id', sourceassoc.c.meter_id)
+
+
+def _meter_ranges(meter):
+    min_id, max_id = select([func.min(meter.c.id),
+                             func.max(meter.c.id)]).execute().first()
+    if min_id is None:
+        return []
+    return [(start, start + BATCH_SIZE)
+            for start in range(min_id, max_id + 1, BATCH_SIZE)]
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    meter = Table('meter', meta, autoload=True)
+    resource = Table('resource', meta, autoload=True)
+    sourceassoc = Table('sourceassoc', meta, autoload=True)
+    Table('source', meta, autoload=True)
+
+    meter.create_column(_source_column())
+    Index('ix_meter_source_id', meter.c.source_id).create(
+        bind=migrate_engine)
+    resource.create_column(_source_column())
+
+    # Populate the new columns, the samples a batch at a time ...
+    meter_source = select([func.min(sourceassoc.c.source_id)]).where(
+        sourceassoc.c.meter_id == meter.c.id).correlate(meter)
+    for start, end in _meter_ranges(meter):
+        meter.update().where(meter.c.id >= start).where(
+            meter.c.id < end).values(
+                source_id=meter_source.as_scalar()).execute()
+    resource.update().values(source_id=select(
+        [func.min(sourceassoc.c.source_id)]).where(
+            sourceassoc.c.resource_id == resource.c.id).correlate(
+                resource).as_scalar()).execute()
+
+    sourceassoc.delete().where(sourceassoc.c.meter_id != null()).execute()
+    sourceassoc.delete().where(
+        sourceassoc.c.resource_id != null()).execute()
+    # Only needed to look the samples up until their sources moved
+    _meter_id_index(sourceassoc).drop(bind=migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    meter = Table('meter', meta, autoload=True)
+    resource = Table('resource', meta, autoload=True)
+    sourceassoc = Table('sourceassoc', meta, autoload=True)
+
+    for start, end in _meter_ranges(meter):
+        rows = select([meter.c.id, meter.c.source_id]).where(
+            meter.c.id >= start).where(meter.c.id < end).execute()
+        values = [{'meter_id': meter_id, 'source_id': source_id}
+                  for meter_id, source_id in rows]
+        if values:
+            sourceassoc.insert().execute(values)
+    values = [{'resource_id': resource_id, 'source_id': source_id}
+              for resource_id, source_id in select(
+                  [resource.c.id, resource.c.source_id]).execute()]
+    if values:
+        sourceassoc.insert().execute(values)
+    _meter_id_index(sourceassoc).create(bind=migrate_engine)
+
+    Index('ix_meter_source_id', meter.c.source_id).drop(bind=migrate_engine)
+    meter.drop_column(_source_column())
+    resource.drop_column(_source_column())
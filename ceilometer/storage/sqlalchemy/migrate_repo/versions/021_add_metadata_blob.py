@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Boolean, Column, Index, LargeBinary, MetaData
+from sqlalchemy import String, Table
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    metadata_blob = Table(
+        'metadata_blob', meta,
+        Column('id', String(40), primary_key=True),
+        Column('value', LargeBinary),
+        Column('compressed', Boolean),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8')
+    metadata_blob.create()
+
+    # The samples recorded so far keep their metadata inline
+    meter = Table('meter', meta, autoload=True)
+    metadata_hash = Column('metadata_hash', String(40))
+    meter.create_column(metadata_hash)
+    Index('ix_meter_metadata_hash', meter.c.metadata_hash).create(
+        bind=migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    meter = Table('meter', meta, autoload=True)
+    Index('ix_meter_metadata_hash', meter.c.metadata_hash).drop(
+        bind=migrate_engine)
+    meter.drop_column('metadata_hash')
+    metadata_blob = Table('metadata_blob', meta, autoload=True)
+    metadata_blob.drop()
@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import zlib
+
+from sqlalchemy import BigInteger, Boolean, Column, Float, Index, Integer
+from sqlalchemy import MetaData, String, Table
+from sqlalchemy import func, select
+
+from ceilometer import utils
+
+meta = MetaData()
+
+TABLES = [('metadata_text', 'ix_meta_text_key_value', String(255)),
+          ('metadata_bool', 'ix_meta_bool_key_value', Boolean),
+          ('metadata_int', 'ix_meta_int_key_value', BigInteger),
+          ('metadata_float', 'ix_meta_float_key_value', Float(53))]
+
+# Metadata tables of the value types, as in make_metadata_rows
+TYPE_TABLES = {bool: 'metadata_bool',
+               str: 'metadata_text',
+               unicode: 'metadata_text',
+               int: 'metadata_int',
+               long: 'metadata_int',
+               float: 'metadata_float'}
+
+# Number of samples read per query
+BATCH_SIZE = 10000
+
+
+def _meter_ranges(meter):
+    min_id, max_id = select([func.min(meter.c.id),
+                             func.max(meter.c.id)]).execute().first()
+    if min_id is None:
+        return []
+    return [(start, start + BATCH_SIZE)
+            for start in range(min_id, max_id + 1, BATCH_SIZE)]
+
+
+def _fill_tables(meter, metadata_blob, tables):
+    """Flatten the metadata of the recorded samples into the tables."""
+    samples = select([meter.c.id, meter.c.resource_metadata,
+                      metadata_blob.c.value, metadata_blob.c.compressed],
+                     from_obj=meter.outerjoin(
+                         metadata_blob,
+                         meter.c.metadata_hash == metadata_blob.c.id))
+    for start, end in _meter_ranges(meter):
+        rows = samples.where(meter.c.id >= start)
+        rows = rows.where(meter.c.id < end).execute()
+        values = dict((name, []) for name in tables)
+        for sample_id, metadata, blob, compressed in rows:
+            if blob is not None:
+                metadata = zlib.decompress(blob) if compressed else blob
+            if not metadata:
+                continue
+            metadata = json.loads(metadata)
+            if not isinstance(metadata, dict):
+                continue
+            for key, value in utils.recursive_keypairs(metadata,
+                                                       separator='.'):
+                name = TYPE_TABLES.get(type(value))
+                if name is None or (name == 'metadata_text' and
+                                    len(value) > 255):
+                    continue
+                values[name].append({'id': sample_id, 'meta_key': key,
+                                     'value': value})
+        for name, table in tables.iteritems():
+            if values[name]:
+                table.insert().execute(values[name])
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    meter = Table('meter', meta, autoload=True)
+    metadata_blob = Table('metadata_blob', meta, autoload=True)
+    tables = {}
+    for name, index, type in TABLES:
+        table = Table(
+            name, meta,
+            Column('id', Integer, primary_key=True, autoincrement=False),
+            Column('meta_key', String(255), primary_key=True),
+            Column('value', type),
+            mysql_engine='InnoDB',
+            mysql_charset='utf8')
+        table.create()
+        tables[name] = table
+    _fill_tables(meter, metadata_blob, tables)
+    # Indexed once filled, which is faster
+    for name, index, type in TABLES:
+        table = tables[name]
+        Index(index, table.c.meta_key, table.c.value).create(
+            bind=migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for name, index, type in TABLES:
+        Table(name, meta, autoload=True).drop()
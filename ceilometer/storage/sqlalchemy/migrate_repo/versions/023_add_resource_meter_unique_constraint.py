@@ -0,0 +1,52 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from migrate.changeset.constraint import UniqueConstraint
+from sqlalchemy import MetaData, Table
+from sqlalchemy import and_, func, select
+
+meta = MetaData()
+
+COLUMNS = ['resource_id', 'counter_name', 'counter_type', 'counter_unit',
+           'source_id']
+
+
+def _unique(resource_meter):
+    return UniqueConstraint(*COLUMNS, name='uniq_resource_meter0meter',
+                            table=resource_meter)
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    resource_meter = Table('resource_meter', meta, autoload=True)
+    columns = [resource_meter.c[name] for name in COLUMNS]
+
+    # Remove the duplicates recorded by concurrent collectors so far
+    duplicates = select(columns).group_by(*columns).having(
+        func.count(resource_meter.c.id) > 1)
+    for values in duplicates.execute().fetchall():
+        ids = [row[0] for row in select([resource_meter.c.id]).where(
+            and_(*[column == value
+                   for column, value in zip(columns, values)])).order_by(
+                       resource_meter.c.id).execute()]
+        resource_meter.delete().where(
+            resource_meter.c.id.in_(ids[1:])).execute()
+
+    _unique(resource_meter).create()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    resource_meter = Table('resource_meter', meta, autoload=True)
+    _unique(resource_meter).drop()
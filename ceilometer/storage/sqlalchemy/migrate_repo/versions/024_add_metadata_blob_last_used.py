@@ -0,0 +1,34 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import Column, DateTime, MetaData, Table
+
+from ceilometer.openstack.common import timeutils
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    metadata_blob = Table('metadata_blob', meta, autoload=True)
+    last_used = Column('last_used', DateTime)
+    metadata_blob.create_column(last_used)
+    # The blobs recorded so far may be in use
+    metadata_blob.update().values(last_used=timeutils.utcnow()).execute()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    metadata_blob = Table('metadata_blob', meta, autoload=True)
+    metadata_blob.drop_column('last_used')
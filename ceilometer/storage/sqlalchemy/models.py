@@ -23,8 +23,8 @@ import urlparse
 
 from oslo.config import cfg
 from sqlalchemy import Column, Integer, String, Table, ForeignKey, DateTime, \
-    Index, UniqueConstraint
-from sqlalchemy import Float, Boolean, Text
+    Index, UniqueConstraint, BigInteger
+from sqlalchemy import Float, Boolean, LargeBinary, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
@@ -122,14 +122,19 @@ class Meter(Base):
         Index('ix_meter_user_id', 'user_id'),
         Index('ix_meter_project_id', 'project_id'),
         Index('idx_meter_rid_cname', 'resource_id', 'counter_name'),
+        Index('ix_meter_source_id', 'source_id'),
+        Index('ix_meter_metadata_hash', 'metadata_hash'),
     )
     id = Column(Integer, primary_key=True)
     counter_name = Column(String(255))
-    sources = relationship("Source", secondary=lambda: sourceassoc)
+    source_id = Column(String(255), ForeignKey('source.id'))
     user_id = Column(String(255), ForeignKey('user.id'))
     project_id = Column(String(255), ForeignKey('project.id'))
     resource_id = Column(String(255), ForeignKey('resource.id'))
     resource_metadata = Column(JSONEncodedDict())
+    # Key of the metadata in metadata_blob, used instead of the inline
+    # resource_metadata when the metadata are deduplicated.
+    metadata_hash = Column(String(40))
     counter_type = Column(String(255))
     counter_unit = Column(String(255))
     counter_volume = Column(Float(53))
@@ -138,6 +143,71 @@ class Meter(Base):
     message_id = Column(String(1000))
 
 
+class MetadataBlob(Base):
+    """Distinct resource metadata of the samples, keyed by their SHA-1."""
+
+    __tablename__ = 'metadata_blob'
+    id = Column(String(40), primary_key=True)
+    # The JSON encoded metadata, compressed with zlib if compressed is set
+    value = Column(LargeBinary)
+    compressed = Column(Boolean)
+    # Last time a sample was recorded with the metadata, approximately
+    last_used = Column(DateTime)
+
+
+class MetaText(Base):
+    """Metering text metadata.
+
+    The metadata tables hold the flattened resource metadata of the
+    samples, keyed by the sample id. They have no foreign key to the meter
+    table, which may be partitioned.
+    """
+
+    __tablename__ = 'metadata_text'
+    __table_args__ = (
+        Index('ix_meta_text_key_value', 'meta_key', 'value'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    meta_key = Column(String(255), primary_key=True)
+    value = Column(String(255))
+
+
+class MetaBool(Base):
+    """Metering boolean metadata."""
+
+    __tablename__ = 'metadata_bool'
+    __table_args__ = (
+        Index('ix_meta_bool_key_value', 'meta_key', 'value'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    meta_key = Column(String(255), primary_key=True)
+    value = Column(Boolean)
+
+
+class MetaBigInt(Base):
+    """Metering integer metadata."""
+
+    __tablename__ = 'metadata_int'
+    __table_args__ = (
+        Index('ix_meta_int_key_value', 'meta_key', 'value'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    meta_key = Column(String(255), primary_key=True)
+    value = Column(BigInteger)
+
+
+class MetaFloat(Base):
+    """Metering float metadata."""
+
+    __tablename__ = 'metadata_float'
+    __table_args__ = (
+        Index('ix_meta_float_key_value', 'meta_key', 'value'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    meta_key = Column(String(255), primary_key=True)
+    value = Column(Float(53))
+
+
 class User(Base):
     __tablename__ = 'user'
     id = Column(String(255), primary_key=True)
@@ -162,11 +232,33 @@ class Resource(Base):
         Index('resource_user_id_project_id_key', 'user_id', 'project_id')
     )
     id = Column(String(255), primary_key=True)
-    sources = relationship("Source", secondary=lambda: sourceassoc)
+    source_id = Column(String(255), ForeignKey('source.id'))
     resource_metadata = Column(JSONEncodedDict(5000))
     user_id = Column(String(255), ForeignKey('user.id'))
     project_id = Column(String(255), ForeignKey('project.id'))
+    first_sample_timestamp = Column(DateTime)
+    last_sample_timestamp = Column(DateTime)
     meters = relationship("Meter", backref='resource')
+    resource_meters = relationship("ResourceMeter")
+
+
+class ResourceMeter(Base):
+    """The meters a resource has samples of, from each source."""
+
+    __tablename__ = 'resource_meter'
+    __table_args__ = (
+        Index('ix_resource_meter_resource_id_counter_name',
+              'resource_id', 'counter_name'),
+        UniqueConstraint('resource_id', 'counter_name', 'counter_type',
+                         'counter_unit', 'source_id',
+                         name='uniq_resource_meter0meter'),
+    )
+    id = Column(Integer, primary_key=True)
+    resource_id = Column(String(255), ForeignKey('resource.id'))
+    counter_name = Column(String(255))
+    counter_type = Column(String(255))
+    counter_unit = Column(String(255))
+    source_id = Column(String(255), ForeignKey('source.id'))
 
 
 class Alarm(Base):
@@ -271,6 +363,10 @@ class Trait(Base):
         Index('ix_trait_t_datetime', 't_datetime'),
         Index('ix_trait_t_type', 't_type'),
         Index('ix_trait_t_float', 't_float'),
+        Index('ix_trait_name_id_t_string', 'name_id', 't_string'),
+        Index('ix_trait_name_id_t_int', 'name_id', 't_int'),
+        Index('ix_trait_name_id_t_float', 'name_id', 't_float'),
+        Index('ix_trait_name_id_t_datetime', 'name_id', 't_datetime'),
     )
     id = Column(Integer, primary_key=True)
 
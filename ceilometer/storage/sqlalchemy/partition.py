@@ -0,0 +1,332 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Time range partitions of the meter table.
+
+The samples are spread over one partition per day or week, so that the
+queries bounded in time only read the partitions they overlap and the
+expired samples are removed by dropping whole partitions.
+
+PostgreSQL partitions are tables inheriting from meter, checking their
+time range, the samples inserted into meter being routed to them by a
+trigger. MySQL partitions are native range partitions of meter.
+SQLite has no partitioning: each partition is emulated by a table of the
+period and dropping it deletes the samples of the period from meter.
+"""
+
+import datetime
+
+from sqlalchemy import text
+
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+# Number of days of each partitioning period
+PERIODS = {'daily': 1, 'weekly': 7}
+
+PREFIX = 'meter_p'
+
+
+def period_start(timestamp, period):
+    """Return the start of the partitioning period including timestamp.
+
+    Weeks start on Mondays.
+    """
+    start = datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+    if period == 'weekly':
+        start -= datetime.timedelta(days=start.weekday())
+    return start
+
+
+def period_end(start, period):
+    return start + datetime.timedelta(days=PERIODS[period])
+
+
+def partition_name(start):
+    return PREFIX + start.strftime('%Y%m%d')
+
+
+class Partitioner(object):
+    """Manage the partitions of the meter table of a database."""
+
+    def __init__(self, engine, period):
+        if period not in PERIODS:
+            raise ValueError(_('Unknown meter partition period: %s') % period)
+        self.engine = engine
+        self.period = period
+        # Partition ranges known to exist, as (start, end) pairs
+        self._ranges = None
+
+    def setup(self):
+        """Turn the meter table into a partitioned one, if not done yet."""
+
+    def partitions(self):
+        """Return the (name, start, end) of the partitions.
+
+        The start of a partition holding all the older samples is None.
+        """
+        raise NotImplementedError()
+
+    def _create(self, start, end):
+        """Create the partition of a period, doing nothing if it exists.
+        """
+        raise NotImplementedError()
+
+    def _drop(self, name, start, end):
+        """Drop a partition and return the (estimated) number of samples
+        it held.
+        """
+        raise NotImplementedError()
+
+    def _covered(self, timestamp):
+        return any((start is None or start <= timestamp) and timestamp < end
+                   for start, end in self._ranges)
+
+    def _load_ranges(self):
+        self._ranges = [(start, end)
+                        for name, start, end in self.partitions()]
+
+    def ensure(self, timestamp):
+        """Make sure that a partition can hold a sample taken at timestamp.
+        """
+        if self._ranges is None:
+            self._load_ranges()
+        if self._covered(timestamp):
+            return
+        start = period_start(timestamp, self.period)
+        end = period_end(start, self.period)
+        LOG.info(_('Creating meter partition %s') % partition_name(start))
+        try:
+            self._create(start, end)
+        except Exception:
+            # Another collector may have created the partition meanwhile
+            self._load_ranges()
+            if not self._covered(timestamp):
+                raise
+        else:
+            self._load_ranges()
+
+    def expire(self, before):
+        """Drop the partitions ending before the given datetime.
+
+        Returns the (estimated) number of samples dropped.
+        """
+        count = 0
+        for name, start, end in self.partitions():
+            if end <= before:
+                LOG.info(_('Dropping meter partition %s') % name)
+                count += self._drop(name, start, end)
+        self._ranges = None
+        return count
+
+
+class PostgreSQLPartitioner(Partitioner):
+
+    TRUNC = {'daily': 'day', 'weekly': 'week'}
+
+    INDEXES = [('timestamp', ['timestamp']),
+               ('user_id', ['user_id']),
+               ('project_id', ['project_id']),
+               ('source_id', ['source_id']),
+               ('metadata_hash', ['metadata_hash']),
+               ('rid_cname', ['resource_id', 'counter_name'])]
+
+    def setup(self):
+        # The samples recorded before stay in the meter table itself
+        self.engine.execute(text("""
+CREATE OR REPLACE FUNCTION meter_insert_partition() RETURNS TRIGGER AS $$
+BEGIN
+    EXECUTE 'INSERT INTO ' || quote_ident('%(prefix)s' ||
+        to_char(date_trunc(TG_ARGV[0], NEW.timestamp), 'YYYYMMDD')) ||
+        ' SELECT ($1).*' USING NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql""" % {'prefix': PREFIX}))
+        self.engine.execute(text(
+            "DROP TRIGGER IF EXISTS meter_insert_partition ON meter"))
+        self.engine.execute(text(
+            "CREATE TRIGGER meter_insert_partition "
+            "BEFORE INSERT ON meter FOR EACH ROW "
+            "EXECUTE PROCEDURE meter_insert_partition('%s')"
+            % self.TRUNC[self.period]))
+
+    def partitions(self):
+        rows = self.engine.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'meter'"))
+        partitions = []
+        for name, in rows:
+            start = datetime.datetime.strptime(name[len(PREFIX):], '%Y%m%d')
+            partitions.append((name, start, period_end(start, self.period)))
+        return sorted(partitions, key=lambda p: p[1])
+
+    def _exists(self, relation):
+        return self.engine.execute(text(
+            "SELECT count(*) FROM pg_class WHERE relname = :name"),
+            name=relation).scalar() > 0
+
+    def _create_relation(self, relation, statement):
+        """Create a table or index, unless it exists already."""
+        if self._exists(relation):
+            return
+        try:
+            self.engine.execute(text(statement))
+        except Exception:
+            # Created by another collector in the meantime
+            if not self._exists(relation):
+                raise
+
+    def _create(self, start, end):
+        name = partition_name(start)
+        self._create_relation(name, (
+            "CREATE TABLE %s (CHECK (timestamp >= '%s' AND timestamp < '%s'))"
+            " INHERITS (meter)" % (name, start, end)))
+        self._create_relation(name + '_pkey', (
+            "ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY (id)"
+            % (name, name)))
+        for suffix, columns in self.INDEXES:
+            index = 'ix_%s_%s' % (name, suffix)
+            self._create_relation(index, (
+                "CREATE INDEX %s ON %s (%s)"
+                % (index, name, ', '.join(columns))))
+
+    def _drop(self, name, start, end):
+        count = self.engine.execute(text(
+            "SELECT reltuples FROM pg_class WHERE relname = :name"),
+            name=name).scalar()
+        self.engine.execute(text("DROP TABLE %s" % name))
+        return int(count or 0)
+
+
+class MySQLPartitioner(Partitioner):
+
+    # Partition of the samples newer than the last period, kept empty
+    LAST = 'pmax'
+    # Partition of the samples recorded before partitioning
+    FIRST = PREFIX + 'old'
+
+    @staticmethod
+    def _to_days(dt):
+        return dt.toordinal() + 365
+
+    @staticmethod
+    def _from_days(days):
+        return datetime.datetime.fromordinal(int(days) - 365)
+
+    def setup(self):
+        if self.partitions():
+            return
+        # Partitioned tables can neither have foreign keys nor unique keys
+        # without the partitioning column.
+        fkeys = self.engine.execute(text(
+            "SELECT table_name, constraint_name "
+            "FROM information_schema.key_column_usage "
+            "WHERE table_schema = DATABASE() AND "
+            "(table_name = 'meter' OR referenced_table_name = 'meter') AND "
+            "referenced_table_name IS NOT NULL")).fetchall()
+        for table, fkey in fkeys:
+            self.engine.execute(text(
+                "ALTER TABLE %s DROP FOREIGN KEY %s" % (table, fkey)))
+        start = period_start(datetime.datetime.utcnow(), self.period)
+        self.engine.execute(text(
+            "ALTER TABLE meter MODIFY timestamp DATETIME NOT NULL, "
+            "DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)"))
+        self.engine.execute(text(
+            "ALTER TABLE meter PARTITION BY RANGE (TO_DAYS(timestamp)) ("
+            "PARTITION %s VALUES LESS THAN (%d), "
+            "PARTITION %s VALUES LESS THAN MAXVALUE)"
+            % (self.FIRST, self._to_days(start), self.LAST)))
+
+    def partitions(self):
+        rows = self.engine.execute(text(
+            "SELECT partition_name, partition_description "
+            "FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = 'meter' AND "
+            "partition_name IS NOT NULL "
+            "ORDER BY partition_ordinal_position"))
+        partitions = []
+        start = None
+        for name, description in rows:
+            if name == self.LAST:
+                continue
+            end = self._from_days(description)
+            partitions.append((name, start, end))
+            start = end
+        return partitions
+
+    def _create(self, start, end):
+        # Only the last period can be added, any gap before it is
+        # included in its partition.
+        if any(name == partition_name(start)
+               for name, ignored, ignored in self.partitions()):
+            return
+        self.engine.execute(text(
+            "ALTER TABLE meter REORGANIZE PARTITION %s INTO ("
+            "PARTITION %s VALUES LESS THAN (%d), "
+            "PARTITION %s VALUES LESS THAN MAXVALUE)"
+            % (self.LAST, partition_name(start), self._to_days(end),
+               self.LAST)))
+
+    def _drop(self, name, start, end):
+        count = self.engine.execute(text(
+            "SELECT table_rows FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = 'meter' AND "
+            "partition_name = :name"), name=name).scalar()
+        self.engine.execute(text(
+            "ALTER TABLE meter DROP PARTITION %s" % name))
+        return int(count or 0)
+
+
+class SQLitePartitioner(Partitioner):
+
+    def partitions(self):
+        rows = self.engine.execute(text(
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name LIKE '%s%%'" % PREFIX))
+        partitions = []
+        for name, in rows:
+            start = datetime.datetime.strptime(name[len(PREFIX):], '%Y%m%d')
+            partitions.append((name, start, period_end(start, self.period)))
+        return sorted(partitions, key=lambda p: p[1])
+
+    def _create(self, start, end):
+        self.engine.execute(text(
+            "CREATE TABLE IF NOT EXISTS %s AS SELECT * FROM meter WHERE 0"
+            % partition_name(start)))
+
+    def _drop(self, name, start, end):
+        count = self.engine.execute(text(
+            "DELETE FROM meter WHERE timestamp >= :start AND "
+            "timestamp < :end"), start=start, end=end).rowcount
+        self.engine.execute(text("DROP TABLE %s" % name))
+        return count
+
+
+PARTITIONERS = {'postgresql': PostgreSQLPartitioner,
+                'mysql': MySQLPartitioner,
+                'sqlite': SQLitePartitioner}
+
+
+def get_partitioner(engine, period):
+    """Return the partitioner of the meter table of the engine database.
+    """
+    try:
+        partitioner = PARTITIONERS[engine.name]
+    except KeyError:
+        raise NotImplementedError(
+            _('Meter partitions not implemented for %s') % engine.name)
+    return partitioner(engine, period)
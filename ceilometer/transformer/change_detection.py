@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from ceilometer.openstack.common.gettextutils import _
+from ceilometer.openstack.common import log
+from ceilometer.openstack.common import timeutils
+from ceilometer import sample
+from ceilometer import transformer
+
+LOG = log.getLogger(__name__)
+
+
+class ChangeDetectionTransformer(transformer.TransformerBase):
+    """Transformer dropping cumulative samples whose volume did not change.
+
+    The last emitted volume and timestamp are remembered per resource and
+    meter. A cumulative sample carrying the same volume as the last
+    emitted one is dropped, unless at least heartbeat seconds elapsed
+    since then, in which case it is emitted as a keepalive. Samples of
+    other types are passed through untouched.
+    """
+
+    def __init__(self, heartbeat=3600, **kwargs):
+        """Initialize transformer with configured parameters.
+
+        :param heartbeat: number of seconds after which an unchanged
+                          sample is emitted anyway
+        """
+        self.heartbeat = heartbeat
+        self.cache = {}
+        super(ChangeDetectionTransformer, self).__init__(**kwargs)
+
+    def handle_sample(self, context, s):
+        """Handle a sample, dropping it if unchanged."""
+        if s.type != sample.TYPE_CUMULATIVE:
+            return s
+
+        key = (s.resource_id, s.name)
+        prev = self.cache.get(key)
+        timestamp = timeutils.parse_isotime(s.timestamp)
+        if prev:
+            prev_volume, prev_timestamp = prev
+            if (prev_volume == s.volume and
+                    timeutils.delta_seconds(prev_timestamp, timestamp)
+                    < self.heartbeat):
+                LOG.debug(_('dropping unchanged sample: %s') % (s,))
+                return None
+        self.cache[key] = (s.volume, timestamp)
+        return s
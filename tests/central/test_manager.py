@@ -18,8 +18,11 @@
 """Tests for ceilometer/central/manager.py
 """
 
+import eventlet
 import mock
 from keystoneclient.v2_0 import client as ksclient
+from oslo.config import cfg
+from stevedore import extension
 
 from ceilometer.central import manager
 from ceilometer.tests import base
@@ -45,3 +48,77 @@ class TestRunTasks(agentbase.BaseAgentManagerTestCase):
 
     def tearDown(self):
         super(TestRunTasks, self).tearDown()
+
+    def test_leave_on_stop(self):
+        self.mgr.partition_coordinator = mock.Mock()
+        manager.AgentService('host', 'topic', self.mgr).stop()
+        self.mgr.partition_coordinator.leave.assert_called_once_with()
+
+    def test_membership_heartbeat(self):
+        cfg.CONF.set_override('membership_url', 'sqlite://', group='central')
+        mgr = manager.AgentManager()
+        self.assertIsNotNone(mgr.partition_coordinator.backend)
+        with mock.patch('ceilometer.pipeline.setup_pipeline'):
+            mgr.initialize_service_hook(mock.MagicMock())
+        self.assertEqual(mgr.partition_coordinator.backend.get_members(60),
+                         [mgr.partition_coordinator.member_id])
+        mgr.service.tg.add_timer.assert_any_call(
+            cfg.CONF.central.membership_heartbeat,
+            mgr.partition_coordinator.heartbeat)
+
+
+class TestConcurrentPolling(agentbase.BaseAgentManagerTestCase):
+
+    class PollsterSlow(agentbase.TestPollster):
+        samples = []
+        test_data = agentbase.default_test_data
+
+        def get_samples(self, manager, cache, instance=None):
+            eventlet.sleep(5)
+            return super(TestConcurrentPolling.PollsterSlow,
+                         self).get_samples(manager, cache, instance)
+
+    def setup_manager(self):
+        self.mgr = manager.AgentManager()
+
+    def create_extension_manager(self):
+        mgr = super(TestConcurrentPolling, self).create_extension_manager()
+        mgr.extensions.append(
+            extension.Extension('testslow', None, None, self.PollsterSlow()))
+        return mgr
+
+    def setUp(self):
+        super(TestConcurrentPolling, self).setUp()
+        self.stubs.Set(ksclient, 'Client', lambda *args, **kwargs: None)
+
+    def tearDown(self):
+        self.PollsterSlow.samples = []
+        super(TestConcurrentPolling, self).tearDown()
+
+    def test_pollster_timeout(self):
+        cfg.CONF.set_override('pollster_timeout', 1, group='central')
+        self.pipeline_cfg[0]['counters'] = ['test', 'testslow']
+        self.setup_pipeline()
+        polling_tasks = self.mgr.setup_polling_tasks()
+        self.mgr.interval_task(polling_tasks.get(60))
+        pub = self.mgr.pipeline_manager.pipelines[0].publishers[0]
+        self.assertEqual(pub.samples, [self.Pollster.test_data])
+        self.assertEqual(len(self.PollsterSlow.samples), 0)
+
+    def test_keystone_client_reused(self):
+        auth_ref = mock.Mock()
+        auth_ref.will_expire_soon.return_value = False
+        client = mock.Mock(auth_ref=auth_ref)
+        client_factory = mock.Mock(return_value=client)
+        self.stubs.Set(ksclient, 'Client', client_factory)
+        polling_tasks = self.mgr.setup_polling_tasks()
+
+        self.mgr.interval_task(polling_tasks.get(60))
+        self.mgr.interval_task(polling_tasks.get(60))
+        self.assertEqual(client_factory.call_count, 1)
+
+        auth_ref.will_expire_soon.return_value = True
+        self.mgr.interval_task(polling_tasks.get(60))
+        self.assertEqual(client_factory.call_count, 2)
+        auth_ref.will_expire_soon.assert_called_with(
+            cfg.CONF.central.keystone_token_expiry_margin)
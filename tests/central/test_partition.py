@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2013 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Tests for ceilometer/central/partition.py
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from ceilometer.central import partition
+from ceilometer.tests import base
+
+
+class TestHashRing(base.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(partition.HashRing([]).get_node('foo'))
+
+    def test_distribution(self):
+        ring = partition.HashRing(['a', 'b', 'c'])
+        owners = [ring.get_node('resource-%d' % i) for i in range(300)]
+        for member in ('a', 'b', 'c'):
+            self.assertTrue(owners.count(member) > 50)
+
+    def test_stable_on_join(self):
+        keys = ['resource-%d' % i for i in range(300)]
+        before = partition.HashRing(['a', 'b', 'c'])
+        after = partition.HashRing(['a', 'b', 'c', 'd'])
+        for key in keys:
+            # Only the resources taken over by the new member move
+            if after.get_node(key) != 'd':
+                self.assertEqual(after.get_node(key), before.get_node(key))
+
+    def test_unicode_key(self):
+        ring = partition.HashRing(['a', 'b'])
+        self.assertIn(ring.get_node(u'été'), ('a', 'b'))
+
+
+class TestSQLiteMembership(base.TestCase):
+
+    def setUp(self):
+        super(TestSQLiteMembership, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.url = 'sqlite:///' + os.path.join(self.tempdir, 'central.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        super(TestSQLiteMembership, self).tearDown()
+
+    def test_get_backend(self):
+        self.assertIsInstance(partition.get_backend(self.url),
+                              partition.SQLiteMembership)
+
+    def test_members_shared(self):
+        agent1 = partition.SQLiteMembership(self.url)
+        agent2 = partition.SQLiteMembership(self.url)
+        agent1.heartbeat('agent1')
+        agent2.heartbeat('agent2')
+        self.assertEqual(agent1.get_members(60), ['agent1', 'agent2'])
+        agent2.leave('agent2')
+        self.assertEqual(agent1.get_members(60), ['agent1'])
+
+    def test_members_expire(self):
+        backend = partition.SQLiteMembership(self.url)
+        backend.heartbeat('agent1')
+        with mock.patch.object(time, 'time', return_value=time.time() + 61):
+            backend.heartbeat('agent2')
+            self.assertEqual(backend.get_members(60), ['agent2'])
+
+
+class TestPartitionCoordinator(base.TestCase):
+
+    def setUp(self):
+        super(TestPartitionCoordinator, self).setUp()
+        self.backend = partition.SQLiteMembership('sqlite://')
+        self.resources = ['resource-%d' % i for i in range(100)]
+
+    def _coordinator(self, member_id):
+        coordinator = partition.PartitionCoordinator(self.backend, member_id)
+        coordinator.heartbeat()
+        return coordinator
+
+    def test_no_backend(self):
+        coordinator = partition.PartitionCoordinator()
+        self.assertEqual(coordinator.extract_my_subset(iter(self.resources)),
+                         self.resources)
+
+    def test_alone(self):
+        coordinator = self._coordinator('agent1')
+        self.assertEqual(coordinator.extract_my_subset(self.resources),
+                         self.resources)
+
+    def test_split(self):
+        coordinators = [self._coordinator('agent%d' % i) for i in range(3)]
+        subsets = [c.extract_my_subset(self.resources) for c in coordinators]
+        self.assertEqual(sorted(sum(subsets, [])), sorted(self.resources))
+        for subset in subsets:
+            self.assertTrue(len(subset) < len(self.resources))
+
+    def test_key(self):
+        coordinator1 = self._coordinator('agent1')
+        self._coordinator('agent2')
+        items = [{'id': r} for r in self.resources]
+        self.assertEqual(
+            [i['id'] for i in coordinator1.extract_my_subset(
+                items, key=lambda i: i['id'])],
+            coordinator1.extract_my_subset(self.resources))
+
+    def test_rebalance_on_leave(self):
+        coordinator1 = self._coordinator('agent1')
+        coordinator2 = self._coordinator('agent2')
+        self.assertNotEqual(coordinator1.extract_my_subset(self.resources),
+                            self.resources)
+        coordinator2.leave()
+        self.assertEqual(coordinator1.extract_my_subset(self.resources),
+                         self.resources)
+
+    def test_backend_failure_keeps_partitioning(self):
+        coordinator1 = self._coordinator('agent1')
+        self._coordinator('agent2')
+        subset = coordinator1.extract_my_subset(self.resources)
+        with mock.patch.object(self.backend, 'get_members',
+                               side_effect=Exception('boom')):
+            self.assertEqual(coordinator1.extract_my_subset(self.resources),
+                             subset)
+
+    def test_heartbeat_failure(self):
+        coordinator = partition.PartitionCoordinator(mock.Mock(), 'agent1')
+        coordinator.backend.heartbeat.side_effect = Exception('boom')
+        coordinator.heartbeat()
@@ -18,6 +18,8 @@
 """Tests for ceilometer/collector/dispatcher/database.py
 """
 from datetime import datetime
+
+import mock
 from oslo.config import cfg
 
 from ceilometer.collector.dispatcher import database
@@ -44,12 +46,36 @@ class TestDispatcherDB(tests_base.TestCase):
         )
 
         self.dispatcher.storage_conn = self.mox.CreateMock(base.Connection)
-        self.dispatcher.storage_conn.record_metering_data(msg)
+        self.dispatcher.storage_conn.record_metering_data_batch([msg])
         self.mox.ReplayAll()
 
         self.dispatcher.record_metering_data(self.ctx, msg)
         self.mox.VerifyAll()
 
+    def test_batch_failure(self):
+        msgs = []
+        for volume in (1, 2):
+            msg = {'counter_name': 'test',
+                   'resource_id': self.id(),
+                   'counter_volume': volume,
+                   }
+            msg['message_signature'] = rpc.compute_signature(
+                msg,
+                cfg.CONF.publisher_rpc.metering_secret,
+            )
+            msgs.append(msg)
+
+        conn = mock.Mock()
+        conn.record_metering_data_batch.side_effect = Exception('boom')
+        conn.record_metering_data.side_effect = [Exception('bad'), None]
+        self.dispatcher.storage_conn = conn
+
+        self.dispatcher.record_metering_data(self.ctx, msgs)
+        # The samples are retried one at a time, and the failure of the
+        # first one does not prevent recording the second one.
+        self.assertEqual(conn.record_metering_data.call_args_list,
+                         [mock.call(msg) for msg in msgs])
+
     def test_invalid_message(self):
         msg = {'counter_name': 'test',
                'resource_id': self.id(),
@@ -64,6 +90,9 @@ class TestDispatcherDB(tests_base.TestCase):
             def record_metering_data(self, data):
                 self.called = True
 
+            def record_metering_data_batch(self, samples):
+                self.called = True
+
         self.dispatcher.storage_conn = ErrorConnection()
 
         self.dispatcher.record_metering_data(self.ctx, msg)
@@ -87,7 +116,7 @@ class TestDispatcherDB(tests_base.TestCase):
         expected['timestamp'] = datetime(2012, 7, 2, 13, 53, 40)
 
         self.dispatcher.storage_conn = self.mox.CreateMock(base.Connection)
-        self.dispatcher.storage_conn.record_metering_data(expected)
+        self.dispatcher.storage_conn.record_metering_data_batch([expected])
         self.mox.ReplayAll()
 
         self.dispatcher.record_metering_data(self.ctx, msg)
@@ -108,7 +137,7 @@ class TestDispatcherDB(tests_base.TestCase):
         expected['timestamp'] = datetime(2012, 9, 30, 23, 31, 50, 262000)
 
         self.dispatcher.storage_conn = self.mox.CreateMock(base.Connection)
-        self.dispatcher.storage_conn.record_metering_data(expected)
+        self.dispatcher.storage_conn.record_metering_data_batch([expected])
         self.mox.ReplayAll()
 
         self.dispatcher.record_metering_data(self.ctx, msg)
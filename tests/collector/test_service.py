@@ -31,6 +31,7 @@ from stevedore.tests import manager as test_manager
 from ceilometer.collector import service
 from ceilometer.compute import notifications
 from ceilometer.openstack.common import timeutils
+from ceilometer import plugin
 from ceilometer import sample
 from ceilometer.storage import base
 from ceilometer.storage import models
@@ -180,6 +181,11 @@ class TestCollectorService(TestCollector):
         self.srv = service.CollectorService('the-host', 'the-topic')
         self.ctx = None
 
+    def _set_notification_plugins(self, extensions):
+        self.srv.notification_manager = test_manager.TestExtensionManager(
+            extensions)
+        self.srv.event_type_index = plugin.EventTypeIndex(extensions)
+
     @patch('ceilometer.pipeline.setup_pipeline', MagicMock())
     def test_init_host(self):
         # If we try to create a real RPC connection, init_host() never
@@ -197,7 +203,7 @@ class TestCollectorService(TestCollector):
         with patch('ceilometer.openstack.common.rpc.create_connection'):
             self.srv.start()
         self.srv.pipeline_manager.pipelines[0] = MagicMock()
-        self.srv.notification_manager = test_manager.TestExtensionManager(
+        self._set_notification_plugins(
             [extension.Extension('test',
                                  None,
                                  None,
@@ -208,16 +214,87 @@ class TestCollectorService(TestCollector):
         self.assertTrue(
             self.srv.pipeline_manager.publisher.called)
 
+    @patch('ceilometer.pipeline.setup_pipeline', MagicMock())
+    def test_process_notification_single_publish(self):
+        with patch('ceilometer.openstack.common.rpc.create_connection'):
+            self.srv.start()
+        self._set_notification_plugins(
+            [extension.Extension('instance', None, None,
+                                 notifications.Instance()),
+             extension.Extension('memory', None, None,
+                                 notifications.Memory()),
+             ])
+        self.srv.process_notification(TEST_NOTICE)
+        publisher = self.srv.pipeline_manager.publisher
+        self.assertEqual(publisher.call_count, 1)
+        p = publisher.return_value.__enter__.return_value
+        self.assertEqual(p.call_count, 1)
+        self.assertEqual(sorted(s.name for s in p.call_args[0][0]),
+                         ['instance', 'memory'])
+
+    @patch('ceilometer.pipeline.setup_pipeline', MagicMock())
+    def test_process_notification_batched(self):
+        cfg.CONF.set_override('notification_batch_size', 4,
+                              group='collector')
+        with patch('ceilometer.openstack.common.rpc.create_connection'):
+            self.srv.start()
+        self._set_notification_plugins(
+            [extension.Extension('instance', None, None,
+                                 notifications.Instance()),
+             extension.Extension('memory', None, None,
+                                 notifications.Memory()),
+             ])
+        publisher = self.srv.pipeline_manager.publisher
+        self.srv.process_notification(TEST_NOTICE)
+        self.assertFalse(publisher.called)
+        self.assertEqual(len(self.srv.pending_samples), 2)
+        self.srv.process_notification(TEST_NOTICE)
+        self.assertEqual(publisher.call_count, 1)
+        self.assertEqual(self.srv.pending_samples, [])
+        p = publisher.return_value.__enter__.return_value
+        self.assertEqual(len(p.call_args[0][0]), 4)
+
+        self.srv.process_notification(TEST_NOTICE)
+        self.srv.stop()
+        self.assertEqual(publisher.call_count, 2)
+        self.assertEqual(len(p.call_args[0][0]), 2)
+
+    @patch('ceilometer.pipeline.setup_pipeline', MagicMock())
+    def test_batch_timeout(self):
+        cfg.CONF.set_override('notification_batch_size', 4,
+                              group='collector')
+        with patch('ceilometer.openstack.common.rpc.create_connection'):
+            with patch.object(self.srv.tg, 'add_timer') as add_timer:
+                self.srv.start()
+        add_timer.assert_any_call(
+            cfg.CONF.collector.notification_batch_timeout,
+            self.srv.flush_samples)
+
+    @patch('ceilometer.pipeline.setup_pipeline', MagicMock())
+    def test_process_notification_plugin_error(self):
+        with patch('ceilometer.openstack.common.rpc.create_connection'):
+            self.srv.start()
+        broken = MagicMock(event_types=['compute.instance.*'])
+        broken.process_notification.side_effect = Exception('boom')
+        self._set_notification_plugins(
+            [extension.Extension('broken', None, None, broken),
+             extension.Extension('instance', None, None,
+                                 notifications.Instance()),
+             ])
+        self.srv.process_notification(TEST_NOTICE)
+        p = self.srv.pipeline_manager.publisher.return_value.__enter__()
+        self.assertEqual([s.name for s in p.call_args[0][0]], ['instance'])
+
     def test_process_notification_no_events(self):
         cfg.CONF.set_override("store_events", False, group="collector")
-        self.srv.notification_manager = MagicMock()
+        self._set_notification_plugins([])
         with patch.object(self.srv, '_message_to_event') as fake_msg_to_event:
             self.srv.process_notification({})
             self.assertFalse(fake_msg_to_event.called)
 
     def test_process_notification_with_events(self):
         cfg.CONF.set_override("store_events", True, group="collector")
-        self.srv.notification_manager = MagicMock()
+        self._set_notification_plugins([])
         with patch.object(self.srv, '_message_to_event') as fake_msg_to_event:
             self.srv.process_notification({})
             self.assertTrue(fake_msg_to_event.called)
@@ -279,6 +356,32 @@ class TestCollectorService(TestCollector):
         self.assertRaises(service.UnableToSaveEventException,
                           self.srv._message_to_event, message)
 
+    @patch('ceilometer.collector.service.prepare_service', MagicMock())
+    def test_collector_workers(self):
+        with patch('ceilometer.openstack.common.service.launch') as launch:
+            service.collector()
+            self.assertIsNone(launch.call_args[1]['workers'])
+            cfg.CONF.set_override('workers', 4, group='collector')
+            service.collector()
+            self.assertEqual(launch.call_args[1]['workers'], 4)
+
+    def test_set_qos(self):
+        cfg.CONF.set_override('prefetch_count', 10, group='collector')
+        self.srv.conn = MagicMock()
+        connection = self.srv.conn.connection
+        reconnect = connection.reconnect
+        self.srv._set_qos()
+        connection.channel.basic_qos.assert_called_once_with(0, 10, False)
+        connection.channel = MagicMock()
+        connection.reconnect()
+        reconnect.assert_called_once_with()
+        connection.channel.basic_qos.assert_called_once_with(0, 10, False)
+
+    def test_set_qos_no_limit(self):
+        self.srv.conn = MagicMock()
+        self.srv._set_qos()
+        self.assertFalse(self.srv.conn.connection.channel.basic_qos.called)
+
     def test_extract_when(self):
         now = timeutils.utcnow()
         modified = now + datetime.timedelta(minutes=1)
@@ -17,10 +17,15 @@
 # under the License.
 """Tests for ceilometer/agent/manager.py
 """
+import datetime
+
 import mock
+from oslo.config import cfg
 
 from ceilometer import nova_client
 from ceilometer.compute import manager
+from ceilometer.compute.virt import inspector as virt_inspector
+from ceilometer.openstack.common import timeutils
 from ceilometer.tests import base
 from tests import agentbase
 
@@ -82,3 +87,91 @@ class TestRunTasks(agentbase.BaseAgentManagerTestCase):
         mgr = manager.AgentManager()
         polling_task = manager.PollingTask(mgr)
         polling_task.poll_and_publish()
+
+
+class TestInstanceInventory(base.TestCase):
+
+    @staticmethod
+    def _fake_instance(uuid, host=None):
+        instance = mock.MagicMock()
+        instance.id = uuid
+        setattr(instance, 'OS-EXT-SRV-ATTR:host', host or cfg.CONF.host)
+        return instance
+
+    def _set_domains(self, *uuids):
+        self.inspector.inspect_instances.return_value = [
+            virt_inspector.Instance(name='instance-%s' % uuid, UUID=uuid)
+            for uuid in uuids]
+
+    def setUp(self):
+        super(TestInstanceInventory, self).setUp()
+        self.nv = mock.Mock()
+        self.inspector = mock.Mock()
+        self.inventory = manager.InstanceInventory(self.nv, self.inspector)
+        self.nv.instance_get_all_by_host.return_value = [
+            self._fake_instance('a'), self._fake_instance('b')]
+        self._set_domains('a', 'b')
+
+    def test_seed(self):
+        instances = self.inventory.get_instances()
+        self.assertEqual(sorted(i.id for i in instances), ['a', 'b'])
+        self.nv.instance_get_all_by_host.assert_called_once_with(
+            cfg.CONF.host)
+        self.assertFalse(self.nv.instance_get.called)
+
+    def test_no_change(self):
+        self.inventory.get_instances()
+        instances = self.inventory.get_instances()
+        self.assertEqual(len(instances), 2)
+        self.assertEqual(self.nv.instance_get_all_by_host.call_count, 1)
+        self.assertFalse(self.nv.instance_get.called)
+
+    def test_new_instance(self):
+        self.inventory.get_instances()
+        self._set_domains('a', 'b', 'c')
+        self.nv.instance_get.return_value = self._fake_instance('c')
+        instances = self.inventory.get_instances()
+        self.assertEqual(sorted(i.id for i in instances), ['a', 'b', 'c'])
+        self.nv.instance_get.assert_called_once_with('c')
+        self.inspector.invalidate_topology.assert_called_once_with('c')
+
+    def test_deleted_instance(self):
+        self.inventory.get_instances()
+        self._set_domains('a')
+        self.nv.instance_get.return_value = None
+        instances = self.inventory.get_instances()
+        self.assertEqual([i.id for i in instances], ['a'])
+        self.nv.instance_get.assert_called_once_with('b')
+
+    def test_migrated_instance(self):
+        self.inventory.get_instances()
+        self._set_domains('a')
+        self.nv.instance_get.return_value = self._fake_instance(
+            'b', host='other-host')
+        instances = self.inventory.get_instances()
+        self.assertEqual([i.id for i in instances], ['a'])
+
+    def test_stopped_instance(self):
+        self.inventory.get_instances()
+        self._set_domains('a')
+        self.nv.instance_get.return_value = self._fake_instance('b')
+        self.assertEqual(len(self.inventory.get_instances()), 2)
+        self.assertEqual(len(self.inventory.get_instances()), 2)
+        self.nv.instance_get.assert_called_once_with('b')
+
+    def test_resync(self):
+        timeutils.set_time_override(datetime.datetime(2013, 9, 1, 12, 0))
+        self.addCleanup(timeutils.clear_time_override)
+        self.inventory.get_instances()
+        timeutils.advance_time_seconds(
+            cfg.CONF.instance_inventory_resync_interval + 1)
+        self.inventory.get_instances()
+        self.assertEqual(self.nv.instance_get_all_by_host.call_count, 2)
+
+
+class TestInventoryRunTasks(TestRunTasks):
+
+    def setUp(self):
+        super(TestInventoryRunTasks, self).setUp()
+        cfg.CONF.set_override('instance_discovery_method', 'inventory')
+        self.stubs.Set(self.mgr.inventory, '_get_active', lambda: set())
@@ -19,7 +19,12 @@
 """Tests for libvirt inspector.
 """
 
+import datetime
+
+from oslo.config import cfg
+
 from ceilometer.compute.virt.libvirt import inspector as libvirt_inspector
+from ceilometer.openstack.common import timeutils
 from ceilometer.tests import base as test_base
 
 
@@ -101,6 +106,8 @@ class TestLibvirtInspection(test_base.TestCase):
              </domain>
         """
 
+        self.domain.UUIDString().AndReturn('uuid-1')
+        self.domain.ID().AndReturn(1)
         self.domain.XMLDesc(0).AndReturn(dom_xml)
         self.domain.interfaceStats('vnet0').AndReturn((1L, 2L, 0L, 0L,
                                                        3L, 4L, 0L, 0L))
@@ -167,6 +174,8 @@ class TestLibvirtInspection(test_base.TestCase):
              </domain>
         """
 
+        self.domain.UUIDString().AndReturn('uuid-1')
+        self.domain.ID().AndReturn(1)
         self.domain.XMLDesc(0).AndReturn(dom_xml)
 
         self.domain.blockStats('vda').AndReturn((1L, 2L, 3L, 4L, -1))
@@ -181,3 +190,130 @@ class TestLibvirtInspection(test_base.TestCase):
         self.assertEqual(info0.read_bytes, 2L)
         self.assertEqual(info0.write_requests, 3L)
         self.assertEqual(info0.write_bytes, 4L)
+
+
+class TestLibvirtInstances(test_base.TestCase):
+
+    def test_inspect_instances(self):
+        inspector = libvirt_inspector.LibvirtInspector()
+        inspector.connection = self.mox.CreateMockAnything()
+        domain = self.mox.CreateMockAnything()
+        inspector.connection.getCapabilities()
+        inspector.connection.numOfDomains().AndReturn(1)
+        inspector.connection.getCapabilities()
+        inspector.connection.listDomainsID().AndReturn([0, 1])
+        inspector.connection.getCapabilities()
+        inspector.connection.lookupByID(1).AndReturn(domain)
+        domain.name().AndReturn('instance-00000001')
+        domain.UUIDString().AndReturn('uuid-1')
+        self.mox.ReplayAll()
+
+        instances = list(inspector.inspect_instances())
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(instances[0].name, 'instance-00000001')
+        self.assertEqual(instances[0].UUID, 'uuid-1')
+
+
+class TestLibvirtTopologyCache(test_base.TestCase):
+
+    DOM_XML = """
+         <domain type='kvm'>
+             <devices>
+                 <disk type='file' device='disk'>
+                     <target dev='vda' bus='virtio'/>
+                 </disk>
+                 <interface type='bridge'>
+                     <mac address='fa:16:3e:71:ec:6d'/>
+                     <target dev='vnet0'/>
+                 </interface>
+             </devices>
+         </domain>
+    """
+
+    def setUp(self):
+        super(TestLibvirtTopologyCache, self).setUp()
+        self.inspector = libvirt_inspector.LibvirtInspector()
+        self.domain = self.mox.CreateMockAnything()
+
+    def _expect_domain(self, generation, parse):
+        self.domain.UUIDString().AndReturn('uuid-1')
+        self.domain.ID().AndReturn(generation)
+        if parse:
+            self.domain.XMLDesc(0).AndReturn(self.DOM_XML)
+
+    def test_cache_hit(self):
+        self._expect_domain(1, parse=True)
+        self._expect_domain(1, parse=False)
+        self.mox.ReplayAll()
+
+        first = self.inspector._get_topology(self.domain)
+        second = self.inspector._get_topology(self.domain)
+        self.assertEqual(first, second)
+        self.assertEqual(first[1], ['vda'])
+        self.assertEqual(first[0][0].name, 'vnet0')
+        self.assertEqual(self.inspector.get_topology_cache_stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_generation_change(self):
+        self._expect_domain(1, parse=True)
+        self._expect_domain(2, parse=True)
+        self.mox.ReplayAll()
+
+        self.inspector._get_topology(self.domain)
+        self.inspector._get_topology(self.domain)
+        self.assertEqual(self.inspector.topology_cache_hits, 0)
+        self.assertEqual(self.inspector.topology_cache_misses, 2)
+
+    def test_expiry(self):
+        self._expect_domain(1, parse=True)
+        self._expect_domain(1, parse=True)
+        self.mox.ReplayAll()
+
+        now = datetime.datetime(2013, 9, 1, 12, 0, 0)
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+        self.inspector._get_topology(self.domain)
+        timeutils.advance_time_seconds(cfg.CONF.libvirt_topology_cache_ttl
+                                       + 1)
+        self.inspector._get_topology(self.domain)
+        self.assertEqual(self.inspector.topology_cache_misses, 2)
+
+    def test_expired_entries_pruned(self):
+        self._expect_domain(1, parse=True)
+        other = self.mox.CreateMockAnything()
+        other.UUIDString().AndReturn('uuid-2')
+        other.ID().AndReturn(1)
+        other.XMLDesc(0).AndReturn(self.DOM_XML)
+        self.mox.ReplayAll()
+
+        now = datetime.datetime(2013, 9, 1, 12, 0, 0)
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+        self.inspector._get_topology(self.domain)
+        timeutils.advance_time_seconds(cfg.CONF.libvirt_topology_cache_ttl
+                                       + 1)
+        # uuid-1 is gone, and never looked up again
+        self.inspector._get_topology(other)
+        self.assertEqual(self.inspector.get_topology_cache_stats(),
+                         {'hits': 0, 'misses': 2, 'size': 1})
+
+    def test_invalidate(self):
+        self._expect_domain(1, parse=True)
+        self._expect_domain(1, parse=True)
+        self.mox.ReplayAll()
+
+        self.inspector._get_topology(self.domain)
+        self.inspector.invalidate_topology('uuid-1')
+        self.inspector._get_topology(self.domain)
+        self.assertEqual(self.inspector.topology_cache_misses, 2)
+
+    def test_cache_disabled(self):
+        cfg.CONF.set_override('libvirt_topology_cache_ttl', 0)
+        self.domain.XMLDesc(0).AndReturn(self.DOM_XML)
+        self.domain.XMLDesc(0).AndReturn(self.DOM_XML)
+        self.mox.ReplayAll()
+
+        self.inspector._get_topology(self.domain)
+        self.inspector._get_topology(self.domain)
+        self.assertEqual(self.inspector.get_topology_cache_stats(),
+                         {'hits': 0, 'misses': 2, 'size': 0})
@@ -83,7 +83,7 @@ class TestEnergyPollster(base.TestCase):
                        self.fake_iter_probes)
 
     @staticmethod
-    def fake_iter_probes(self, ksclient, cache):
+    def fake_iter_probes(self, ksclient, cache, partition_coordinator):
         probes = PROBE_DICT['probes']
         for key, value in probes.iteritems():
             probe_dict = value
@@ -143,7 +143,7 @@ class TestPowerPollster(base.TestCase):
                        self.fake_iter_probes)
 
     @staticmethod
-    def fake_iter_probes(self, ksclient, cache):
+    def fake_iter_probes(self, ksclient, cache, partition_coordinator):
         probes = PROBE_DICT['probes']
         for key, value in probes.iteritems():
             probe_dict = value
@@ -17,11 +17,13 @@
 # under the License.
 
 import mock
+from oslo.config import cfg
 
 from ceilometer.tests import base
 from ceilometer.image import glance
 from ceilometer.central import manager
 from ceilometer.openstack.common import context
+from ceilometer import plugin
 
 
 IMAGE_LIST = [
@@ -143,11 +145,129 @@ class TestImagePollster(base.TestCase):
     def test_iter_images_cached(self):
         # Tests whether the iter_images method returns the values from
         # the cache
-        cache = {'images': []}
+        cache = {'images': glance._SharedIterator(iter([]))}
         images = list(glance.ImagePollster().
                       _iter_images(self.manager.keystone, cache))
         self.assertEqual(images, [])
 
+    def test_iter_images_paginated(self):
+        cfg.CONF.set_override('glance_page_size', 2)
+        client = mock.Mock()
+        client.images.list.side_effect = lambda **kwargs: iter(IMAGE_LIST)
+        self.stubs.Set(glance._Base, 'get_glance_client',
+                       lambda self, ksclient: client)
+        images = list(glance.ImagePollster().
+                      _iter_images(self.manager.keystone, {}))
+        self.assertEqual([image.id for image in images],
+                         [image.id for image in IMAGE_LIST[:3]])
+        self.assertEqual(client.images.list.call_args_list,
+                         [mock.call(filters={'is_public': True},
+                                    page_size=2),
+                          mock.call(filters={'is_public': False},
+                                    page_size=2)])
+
+    def test_iter_images_partitioned(self):
+        coordinator = mock.Mock()
+        coordinator.iter_my_subset.side_effect = (
+            lambda images, key: (i for i in images
+                                 if key(i) == IMAGE_LIST[0].id))
+        images = list(glance.ImagePollster().
+                      _iter_images(self.manager.keystone, {}, coordinator))
+        self.assertEqual([image.id for image in images], [IMAGE_LIST[0].id])
+
+    def test_iter_images_lazy(self):
+        client = mock.Mock()
+        client.images.list.side_effect = lambda **kwargs: iter(IMAGE_LIST)
+        self.stubs.Set(glance._Base, 'get_glance_client',
+                       lambda self, ksclient: client)
+        cache = {}
+        images = glance.ImagePollster()._iter_images(self.manager.keystone,
+                                                     cache)
+        self.assertEqual(next(images).id, IMAGE_LIST[0].id)
+        # The private images are not listed until they are needed
+        self.assertEqual(client.images.list.call_count, 1)
+        # and the images already listed are shared with other pollsters
+        sizes = glance.ImageSizePollster()._iter_images(
+            self.manager.keystone, cache)
+        self.assertEqual([image.id for image in sizes],
+                         [image.id for image in IMAGE_LIST[:3]])
+        self.assertEqual(client.images.list.call_count, 2)
+        self.assertEqual([image.id for image in images],
+                         [image.id for image in IMAGE_LIST[1:3]])
+
+    def test_iter_images_dropped_once_read(self):
+        client = mock.Mock()
+        client.images.list.side_effect = lambda **kwargs: iter(IMAGE_LIST)
+        self.stubs.Set(glance._Base, 'get_glance_client',
+                       lambda self, ksclient: client)
+        cache = plugin.new_cache([glance.ImagePollster(),
+                                  glance.ImageSizePollster()])
+        images = glance.ImagePollster()._iter_images(self.manager.keystone,
+                                                     cache)
+        next(images)
+        next(images)
+        # Kept for the other pollster of the cache
+        self.assertEqual(len(cache['images']._items), 2)
+        sizes = glance.ImageSizePollster()._iter_images(
+            self.manager.keystone, cache)
+        next(sizes)
+        # Only the images a reader did not pass yet are kept
+        self.assertEqual(len(cache['images']._items), 1)
+        self.assertEqual([image.id for image in sizes],
+                         [image.id for image in IMAGE_LIST[1:3]])
+        self.assertEqual(len(cache['images']._items), 1)
+        list(images)
+        self.assertEqual(len(cache['images']._items), 0)
+
+    def test_iter_images_late_reader(self):
+        client = mock.Mock()
+        client.images.list.side_effect = lambda **kwargs: iter(IMAGE_LIST)
+        self.stubs.Set(glance._Base, 'get_glance_client',
+                       lambda self, ksclient: client)
+        cache = plugin.new_cache([glance.ImagePollster()])
+        list(glance.ImagePollster()._iter_images(self.manager.keystone,
+                                                 cache))
+        # The images were dropped, they are listed again
+        sizes = list(glance.ImageSizePollster()._iter_images(
+            self.manager.keystone, cache))
+        self.assertEqual([image.id for image in sizes],
+                         [image.id for image in IMAGE_LIST[:3]])
+        self.assertEqual(client.images.list.call_count, 4)
+
+    def test_iter_images_error_raised_to_all_readers(self):
+        def list_images(**kwargs):
+            yield IMAGE_LIST[0]
+            raise glance.glanceclient.exc.HTTPInternalServerError()
+        client = mock.Mock()
+        client.images.list.side_effect = list_images
+        self.stubs.Set(glance._Base, 'get_glance_client',
+                       lambda self, ksclient: client)
+        cache = {}
+        images = glance.ImagePollster()._iter_images(self.manager.keystone,
+                                                     cache)
+        sizes = glance.ImageSizePollster()._iter_images(
+            self.manager.keystone, cache)
+        self.assertEqual(next(images).id, IMAGE_LIST[0].id)
+        self.assertRaises(glance.glanceclient.exc.HTTPInternalServerError,
+                          next, images)
+        self.assertEqual(next(sizes).id, IMAGE_LIST[0].id)
+        # Rather than the end of a truncated listing
+        self.assertRaises(glance.glanceclient.exc.HTTPInternalServerError,
+                          next, sizes)
+
+    def test_images_shared_in_cache(self):
+        get_images = mock.Mock(side_effect=lambda ksclient: iter(IMAGE_LIST))
+        self.stubs.Set(glance._Base, '_get_images', get_images)
+        cache = {}
+        images = list(glance.ImagePollster().get_samples(self.manager,
+                                                         cache))
+        sizes = list(glance.ImageSizePollster().get_samples(self.manager,
+                                                            cache))
+        self.assertEqual(get_images.call_count, 1)
+        self.assertEqual(len(images), len(sizes))
+        self.assertEqual(images[0].resource_metadata,
+                         glance._Base.extract_image_metadata(IMAGE_LIST[0]))
+
     def test_image(self):
         samples = list(glance.ImagePollster().get_samples(self.manager, {}))
         self.assertEqual(len(samples), 3)
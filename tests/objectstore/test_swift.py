@@ -20,6 +20,7 @@
 import collections
 
 import mock
+from oslo.config import cfg
 import testscenarios
 
 from ceilometer.central import manager
@@ -65,7 +66,7 @@ class TestSwiftPollster(base.TestCase):
     def fake_ks_service_catalog_url_for(*args, **kwargs):
         raise exceptions.EndpointNotFound("Fake keystone exception")
 
-    def fake_iter_accounts(self, ksclient, cache):
+    def fake_iter_accounts(self, ksclient, cache, partition_coordinator):
         for i in ACCOUNTS:
             yield i
 
@@ -76,7 +77,7 @@ class TestSwiftPollster(base.TestCase):
         self.manager = TestManager()
 
     def test_iter_accounts_no_cache(self):
-        def empty_account_info(obj, ksclient, cache):
+        def empty_account_info(obj, ksclient, tenants):
             return []
         self.stubs.Set(self.factory, '_get_account_info',
                        empty_account_info)
@@ -96,8 +97,10 @@ class TestSwiftPollster(base.TestCase):
         )
         self.stubs.Set(swift_client, 'head_account',
                        ksclient)
+        self.stubs.Set(swift_client, 'http_connection',
+                       mock.Mock(return_value=(None, mock.Mock())))
         self.stubs.Set(self.factory, '_neaten_url',
-                       mock.Mock())
+                       mock.Mock(return_value='http://127.0.0.1:8080/v1/'))
         Tenant = collections.namedtuple('Tenant', 'id')
         cache = {
             self.pollster.CACHE_KEY_TENANT: [Tenant(ACCOUNTS[0][0])],
@@ -106,6 +109,55 @@ class TestSwiftPollster(base.TestCase):
         self.assertTrue(self.pollster.CACHE_KEY_HEAD in cache)
         self.assertEqual(data[0][0], ACCOUNTS[0][0])
 
+    def test_iter_accounts_partitioned(self):
+        Tenant = collections.namedtuple('Tenant', 'id')
+        tenants = [Tenant(t) for t, _ in ACCOUNTS]
+        get_account_info = mock.Mock(return_value=[])
+        self.stubs.Set(self.pollster, '_get_account_info', get_account_info)
+        coordinator = mock.Mock()
+        coordinator.extract_my_subset.return_value = tenants[:1]
+        cache = {self.pollster.CACHE_KEY_TENANT: tenants}
+        list(self.pollster._iter_accounts(mock.Mock(), cache, coordinator))
+        self.assertEqual(coordinator.extract_my_subset.call_args[0][0],
+                         tenants)
+        self.assertEqual(get_account_info.call_args[0][1], tenants[:1])
+        # The shared tenant list is left untouched for other pollsters
+        self.assertEqual(cache[self.pollster.CACHE_KEY_TENANT], tenants)
+
+    def _do_test_get_account_info(self, head_account):
+        Tenant = collections.namedtuple('Tenant', 'id')
+        conn = mock.Mock()
+        http_connection = mock.Mock(return_value=(None, conn))
+        self.stubs.Set(swift_client, 'http_connection', http_connection)
+        self.stubs.Set(swift_client, 'head_account', head_account)
+        tenants = [Tenant(t) for t, _ in ACCOUNTS]
+        ksclient = mock.Mock()
+        ksclient.service_catalog.url_for.return_value = 'http://swift:8080'
+        data = list(self.pollster._get_account_info(ksclient, tenants))
+        return data, http_connection, conn
+
+    def test_get_account_info_reuses_connection(self):
+        cfg.CONF.set_override('swift_account_workers', 1)
+        accounts = dict(ACCOUNTS)
+
+        def head_account(url, token, http_conn):
+            return accounts[url.rsplit('AUTH_', 1)[1]]
+
+        data, http_connection, conn = self._do_test_get_account_info(
+            head_account)
+        self.assertEqual(data, ACCOUNTS)
+        self.assertEqual(http_connection.call_count, 1)
+        conn.close.assert_called_once_with()
+
+    def test_get_account_info_partial(self):
+        def head_account(url, token, http_conn):
+            if url.endswith(ACCOUNTS[0][0]):
+                raise swift_client.ClientException('Account HEAD failed')
+            return ACCOUNTS[1][1]
+
+        data, _, _ = self._do_test_get_account_info(head_account)
+        self.assertEqual(data, [ACCOUNTS[1]])
+
     def test_neaten_url(self):
         test_endpoint = 'http://127.0.0.1:8080'
         test_tenant_id = 'a7fd1695fa154486a647e44aa99a1b9b'
@@ -18,7 +18,10 @@
 import datetime
 import math
 
+import mock
+
 from ceilometer.storage import base
+from ceilometer.storage import impl_log
 from ceilometer.tests import base as test_base
 
 
@@ -60,3 +63,11 @@ class BaseTest(test_base.TestCase):
         sort_keys_resource = base._handle_sort_key('resource', 'project_id')
         self.assertEquals(sort_keys_resource,
                           ['project_id', 'user_id', 'timestamp'])
+
+    def test_record_metering_data_batch_skips_failures(self):
+        conn = impl_log.Connection(None)
+        with mock.patch.object(conn, 'record_metering_data',
+                               side_effect=[Exception('boom'), None]) as rec:
+            conn.record_metering_data_batch(['bad', 'good'])
+        self.assertEqual(rec.call_args_list,
+                         [mock.call('bad'), mock.call('good')])
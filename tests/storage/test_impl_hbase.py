@@ -24,23 +24,44 @@
   running the tests. Make sure the Thrift server is running on that server.
 
 """
+import contextlib
+import datetime
+
 from oslo.config import cfg
 
+from ceilometer.publisher import rpc
+from ceilometer import sample
+from ceilometer import storage
+from ceilometer.storage import impl_hbase
 from ceilometer.storage.impl_hbase import Connection
-from ceilometer.storage.impl_hbase import MConnection
+from ceilometer.storage.impl_hbase import MConnectionPool
+from ceilometer.storage.impl_hbase import MTable
+from ceilometer.storage import models
+from ceilometer.storage.base import NoResultFound
 from ceilometer.tests import db as tests_db
 
 
 class HBaseEngineTestBase(tests_db.TestBase):
     database_connection = 'hbase://__test__'
 
+    def _make_sample(self, name, second):
+        s = sample.Sample(name, sample.TYPE_GAUGE, unit='', volume=1,
+                          user_id='user-id', project_id='project-id',
+                          resource_id='resource-id',
+                          timestamp=datetime.datetime(2012, 7, 2, 10, 40,
+                                                      second),
+                          resource_metadata={'display_name': 'test-server'},
+                          source='test')
+        return rpc.meter_message_from_counter(
+            s, cfg.CONF.publisher_rpc.metering_secret)
+
 
 class ConnectionTest(HBaseEngineTestBase):
 
     def test_hbase_connection(self):
         cfg.CONF.database.connection = self.database_connection
         conn = Connection(cfg.CONF)
-        self.assertIsInstance(conn.conn, MConnection)
+        self.assertIsInstance(conn.conn_pool, MConnectionPool)
 
         class TestConn(object):
             def __init__(self, host, port):
@@ -50,7 +71,239 @@ class ConnectionTest(HBaseEngineTestBase):
                 pass
 
         cfg.CONF.database.connection = 'hbase://test_hbase:9090'
-        self.stubs.Set(Connection, '_get_connection',
+        self.stubs.Set(Connection, '_get_connection_pool',
                        lambda self, x: TestConn(x['host'], x['port']))
         conn = Connection(cfg.CONF)
-        self.assertIsInstance(conn.conn, TestConn)
+        self.assertIsInstance(conn.conn_pool, TestConn)
+
+
+class UpgradeTest(HBaseEngineTestBase):
+
+    def test_meter_time_to_live(self):
+        cfg.CONF.set_override('time_to_live', 456789, group='database')
+        self.conn.clear()
+        self.conn.upgrade()
+        self.assertEqual({'f': {'time_to_live': 456789}},
+                         self.conn.conn_pool.conn.table('meter').families)
+
+    def test_meter_no_time_to_live(self):
+        cfg.CONF.set_override('time_to_live', -1, group='database')
+        self.conn.clear()
+        self.conn.upgrade()
+        self.assertEqual({'f': {}},
+                         self.conn.conn_pool.conn.table('meter').families)
+
+
+class MetaqueryTest(HBaseEngineTestBase):
+
+    def test_metadata_columns(self):
+        self.assertEqual({'f:r_flavor.name': 'm1.tiny',
+                          'f:r_flavor.ram': '512',
+                          'f:r_public': 'true'},
+                         impl_hbase._metadata_columns(
+                             {'flavor': {'name': u'm1.tiny', 'ram': 512},
+                              'public': True}))
+
+    def test_metaquery_filter(self):
+        q = impl_hbase.make_query(metaquery={'metadata.flavor.ram': 512,
+                                             'metadata.name': "it's"},
+                                  require_meter=False, query_only=True)
+        self.assertEqual("SingleColumnValueFilter "
+                         "('f', 'r_flavor.ram', =, 'binary:512', true, true)"
+                         " AND SingleColumnValueFilter "
+                         "('f', 'r_name', =, 'binary:it''s', true, true)",
+                         q)
+
+    def test_rekey_rewrites_metadata_columns(self):
+        msg = self._make_sample('cpu', 1)
+        msg['resource_metadata'] = {'flavor': {'name': 'm1.tiny'}}
+        self.conn.record_metering_data(msg)
+        # The columns of the rows written before they were flattened
+        conn = self.conn.conn_pool.conn
+        for table in [conn.table('meter'), conn.table('resource')]:
+            for data in table._rows.values():
+                del data['f:r_flavor.name']
+                data['f:r_flavor'] = "{u'name': u'm1.tiny'}"
+        metaquery = {'metadata.flavor.name': 'm1.tiny'}
+        f = storage.SampleFilter(metaquery=metaquery)
+        self.assertEqual([], list(self.conn.get_samples(f)))
+
+        self.assertEqual(1, self.conn.rekey_meter_rows())
+        self.assertEqual(1, len(list(self.conn.get_samples(f))))
+        self.assertEqual(1, len(list(self.conn.get_meters(
+            metaquery=metaquery))))
+        self.assertNotIn('f:r_flavor', conn.table('resource').row(
+            'resource-id'))
+        self.assertEqual(0, self.conn.rekey_meter_rows())
+
+
+class RecordTest(HBaseEngineTestBase):
+
+    def test_known_rows_not_read_nor_written_again(self):
+        reads = []
+        puts = []
+        row = MTable.row
+        put = MTable.put
+        self.stubs.Set(MTable, 'row', lambda table, key: (
+            reads.append(table.name) or row(table, key)))
+        self.stubs.Set(MTable, 'put', lambda table, key, data, **kwargs: (
+            puts.append(table.name) or put(table, key, data, **kwargs)))
+        self.conn.record_metering_data_batch(
+            [self._make_sample('cpu', 1), self._make_sample('memory', 2),
+             self._make_sample('cpu', 3)])
+        self.assertEqual(['user', 'project'], reads)
+        self.assertEqual(['user', 'project', 'resource', 'resource',
+                          'meter', 'meter', 'meter'], puts)
+        self.assertEqual(['cpu', 'memory'],
+                         sorted(m.name for m in self.conn.get_meters()))
+
+    def test_cell_timestamp_rounded_up(self):
+        self.assertEqual(1341225660000, impl_hbase._cell_timestamp(
+            datetime.datetime(2012, 7, 2, 10, 40, 1)))
+        self.assertEqual(1341225600000, impl_hbase._cell_timestamp(
+            datetime.datetime(2012, 7, 2, 10, 40)))
+
+
+class GetMetersTest(HBaseEngineTestBase):
+
+    def test_several_meters_per_resource(self):
+        # The second sample only writes its own meter column on the
+        # resource row, keeping the first one.
+        self.conn.record_metering_data(self._make_sample('cpu', 1))
+        self.conn.record_metering_data(self._make_sample('memory', 2))
+        meters = list(self.conn.get_meters(resource='resource-id'))
+        self.assertEqual(['cpu', 'memory'], sorted(m.name for m in meters))
+        self.assertEqual(set(['resource-id']),
+                         set(m.resource_id for m in meters))
+
+
+class EventTest(HBaseEngineTestBase):
+
+    def setUp(self):
+        super(EventTest, self).setUp()
+        self.start = datetime.datetime(2013, 12, 31, 5, 0)
+        self.end = datetime.datetime(2013, 12, 31, 6, 0)
+        self.conn.record_events(
+            [models.Event('id-%d' % i, 'type-%d' % (i % 2),
+                          self.start + datetime.timedelta(seconds=i), [])
+             for i in range(6)])
+        self.scanned = []
+        scan = MTable.scan
+
+        def counting_scan(table, **kwargs):
+            for key, data in scan(table, **kwargs):
+                self.scanned.append(key)
+                yield key, data
+
+        self.stubs.Set(MTable, 'scan', counting_scan)
+
+    def test_page_stops_at_limit(self):
+        events = self.conn.get_events(
+            storage.EventFilter(self.start, self.end, limit=2))
+        self.assertEqual(['id-0', 'id-1'], [e.message_id for e in events])
+        self.assertEqual(2, len(self.scanned))
+
+    def test_marker_looked_up_by_rowkey(self):
+        events = self.conn.get_events(
+            storage.EventFilter(self.start, self.end, marker='id-2',
+                                limit=2))
+        self.assertEqual(['id-3', 'id-4'], [e.message_id for e in events])
+        self.assertEqual(2, len(self.scanned))
+
+    def test_unknown_marker(self):
+        self.assertRaises(NoResultFound, self.conn.get_events,
+                          storage.EventFilter(self.start, self.end,
+                                              marker='id-6'))
+        self.assertEqual([], self.scanned)
+
+
+class ConnectionPoolTest(HBaseEngineTestBase):
+
+    def setUp(self):
+        super(ConnectionPoolTest, self).setUp()
+        self.conn.record_metering_data(self._make_sample('cpu', 1))
+        self.in_use = 0
+        pooled = self.conn.conn_pool.connection
+
+        @contextlib.contextmanager
+        def connection():
+            self.in_use += 1
+            with pooled() as conn:
+                yield conn
+            self.in_use -= 1
+
+        self.conn.conn_pool.connection = connection
+
+    def assertReleasedWhileIterated(self, results):
+        for result in results:
+            self.assertEqual(0, self.in_use)
+
+    def test_get_samples(self):
+        self.assertReleasedWhileIterated(
+            self.conn.get_samples(storage.SampleFilter(meter='cpu')))
+
+    def test_get_meters(self):
+        self.assertReleasedWhileIterated(self.conn.get_meters())
+
+    def test_get_projects(self):
+        self.assertReleasedWhileIterated(self.conn.get_projects())
+
+    def test_get_users(self):
+        self.assertReleasedWhileIterated(self.conn.get_users())
+
+
+class LRUCacheTest(HBaseEngineTestBase):
+
+    def test_least_recently_used_evicted(self):
+        cache = impl_hbase.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        cache['c'] = 3
+        self.assertEqual(2, len(cache))
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+
+class MeterBucketsTest(HBaseEngineTestBase):
+
+    def setUp(self):
+        super(MeterBucketsTest, self).setUp()
+        cfg.CONF.set_override('hbase_meter_buckets', 4, group='database')
+        self.conn.record_metering_data_batch(
+            [self._make_sample('cpu', second) for second in range(10)])
+
+    def _meter_rows(self):
+        return sorted(self.conn.conn_pool.conn.table('meter')._rows)
+
+    def test_rows_spread_over_buckets(self):
+        rows = self._meter_rows()
+        self.assertEqual(10, len(rows))
+        self.assertTrue(len(set(row[:4] for row in rows)) > 1)
+        self.assertTrue(all(row[:4] in ['000_', '001_', '002_', '003_']
+                            for row in rows))
+
+    def test_get_samples_merged_in_time_order(self):
+        f = storage.SampleFilter(meter='cpu')
+        self.assertEqual(
+            [datetime.datetime(2012, 7, 2, 10, 40, second)
+             for second in reversed(range(10))],
+            [s.timestamp for s in self.conn.get_samples(f)])
+        f = storage.SampleFilter(
+            meter='cpu', start=datetime.datetime(2012, 7, 2, 10, 40, 3),
+            end=datetime.datetime(2012, 7, 2, 10, 40, 6))
+        self.assertEqual(3, len(list(self.conn.get_samples(f))))
+
+    def test_rekey_meter_rows(self):
+        cfg.CONF.set_override('hbase_meter_buckets', 0, group='database')
+        self.assertEqual(10, self.conn.rekey_meter_rows())
+        self.assertTrue(all(row.startswith('cpu_')
+                            for row in self._meter_rows()))
+        self.assertEqual(0, self.conn.rekey_meter_rows())
+        f = storage.SampleFilter(meter='cpu')
+        self.assertEqual(10, len(list(self.conn.get_samples(f))))
+
+    def test_too_many_buckets(self):
+        cfg.CONF.set_override('hbase_meter_buckets', 1000, group='database')
+        self.assertRaises(ValueError, Connection, cfg.CONF)
@@ -68,6 +68,16 @@ class MongoDBConnection(MongoDBEngineTestBase):
         expect = {'k3': {'$lt': 'v3'}, 'k2': {'eq': 'v2'}, 'k1': {'eq': 'v1'}}
         self.assertEqual(ret, expect)
 
+    def test_insert_meter_records_skips_failures(self):
+        self.conn.db.meter.insert({'_id': 'stored', 'counter_volume': 1})
+        # The first record fails, being stored already
+        self.conn._insert_meter_records([
+            {'_id': 'stored', 'counter_volume': 2},
+            {'_id': 'new', 'counter_volume': 3}])
+        self.assertEqual([('new', 3), ('stored', 1)],
+                         sorted((m['_id'], m['counter_volume'])
+                                for m in self.conn.db.meter.find()))
+
 
 class MongoDBTestMarkerBase(test_storage_scenarios.DBTestBase,
                             MongoDBEngineTestBase):
@@ -124,6 +134,14 @@ class IndexTest(MongoDBEngineTestBase):
         self.assertTrue(self.conn.db.meter.ensure_index('foo',
                                                         name='meter_ttl'))
 
+    def test_event_indexes(self):
+        self.conn.upgrade()
+        indexes = self.conn.db.event.index_information()
+        self.assertEqual([('event_type', 1), ('generated', 1)],
+                         indexes['event_type_idx']['key'])
+        self.assertEqual([('generated', 1)],
+                         indexes['event_generated_idx']['key'])
+
 
 class CompatibilityTest(test_storage_scenarios.DBTestBase,
                         MongoDBEngineTestBase):
@@ -26,10 +26,19 @@
 import datetime
 from mock import patch
 
+from oslo.config import cfg
+
+from ceilometer.openstack.common.db.sqlalchemy import session as \
+    sqlalchemy_session
+from ceilometer.openstack.common import timeutils
+from ceilometer import storage
 from ceilometer.storage import models
+from ceilometer.storage.sqlalchemy import models as sql_models
+from ceilometer.storage.sqlalchemy import partition
 from ceilometer.storage.sqlalchemy.models import table_args
 from ceilometer import utils
 from ceilometer.tests import db as tests_db
+from tests.storage import test_storage_scenarios
 
 
 class EventTestBase(tests_db.TestBase):
@@ -103,6 +112,17 @@ class EventTest(EventTestBase):
         self.assertEqual(trait.t_datetime, utils.dt_to_decimal(now))
         self.assertIsNotNone(trait.name)
 
+    def test_save_events_ids(self):
+        now = datetime.datetime.utcnow()
+        trait = models.Trait("trait_A", models.Trait.TEXT_TYPE, "my_text")
+        m = [models.Event("1", "Foo", now, None),
+             models.Event("2", "Zoo", now, [trait])]
+        self.conn.record_events(m)
+        for model in m:
+            self.assertTrue(model.id >= 0)
+        self.assertNotEqual(m[0].id, m[1].id)
+        self.assertTrue(trait.id >= 0)
+
     def test_bad_event(self):
         now = datetime.datetime.utcnow()
         m = [models.Event("1", "Foo", now, []),
@@ -115,9 +135,282 @@ class EventTest(EventTestBase):
         for bad, event in problem_events:
             self.assertEquals(models.Event.UNKNOWN_PROBLEM, bad)
 
+    def test_bad_event_in_batch(self):
+        now = datetime.datetime.utcnow()
+        m = [models.Event("1", "Foo", now, []),
+             models.Event("2", "Zoo", now, [])]
+        record_event = self.conn._record_event
+
+        def fail_first(session, event_model, names):
+            if event_model.message_id == "1":
+                raise MyException("Boom")
+            return record_event(session, event_model, names)
+
+        with patch.object(self.conn, "_record_event",
+                          side_effect=fail_first):
+            problem_events = self.conn.record_events(m)
+        self.assertEqual([(models.Event.UNKNOWN_PROBLEM, m[0])],
+                         problem_events)
+        self.assertTrue(m[1].id >= 0)
+
+    def test_unique_names_cached(self):
+        now = datetime.datetime.utcnow()
+        trait = models.Trait("trait_A", models.Trait.TEXT_TYPE, "my_text")
+        self.conn.record_events([models.Event("1", "Foo", now, [trait])])
+        self.assertEqual(set(['Foo', 'trait_A']),
+                         set(self.conn._unique_names))
+        self.assertEqual(self.conn._get_or_create_unique_name("Foo").id,
+                         self.conn._unique_names['Foo'])
+
+        # Cached names are not looked up in the database anymore
+        self.conn._unique_names['Bar'] = self.conn._unique_names['Foo']
+        self.conn.record_events([models.Event("2", "Bar", now, [trait])])
+        session = sqlalchemy_session.get_session()
+        event = session.query(sql_models.Event).filter(
+            sql_models.Event.message_id == "2").one()
+        self.assertEqual(event.unique_name.key, 'Foo')
+        self.assertEqual(0, session.query(sql_models.UniqueName).filter(
+            sql_models.UniqueName.key == 'Bar').count())
+
 
 class ModelTest(tests_db.TestBase):
     database_connection = 'mysql://localhost'
 
     def test_model_table_args(self):
         self.assertIsNotNone(table_args())
+
+
+class ExpirerTest(test_storage_scenarios.DBTestBase):
+    database_connection = 'sqlite://'
+
+    def prepare_data(self):
+        for i in range(5):
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, 2, 10, 40 + i),
+                resource_id='resource-%d' % i,
+                source='test')
+
+    def test_clear_expired_in_batches(self):
+        self.create_and_store_sample(
+            timestamp=datetime.datetime(2012, 7, 2, 10, 39),
+            resource_id='resource-3',
+            source='test')
+        cfg.CONF.set_override('expirer_batch_size', 2, group='database')
+        timeutils.utcnow.override_time = datetime.datetime(2012, 7, 2, 10, 45)
+        self.assertEqual(4, self.conn.clear_expired_metering_data(150))
+        f = storage.SampleFilter(meter='instance')
+        self.assertEqual(['test', 'test'],
+                         [s.source for s in self.conn.get_samples(f)])
+        resources = sorted(self.conn.get_resources(),
+                           key=lambda r: r.resource_id)
+        self.assertEqual(['resource-3', 'resource-4'],
+                         [r.resource_id for r in resources])
+        self.assertEqual(datetime.datetime(2012, 7, 2, 10, 43),
+                         resources[0].first_sample_timestamp)
+
+
+class PartitionTest(test_storage_scenarios.DBTestBase):
+    database_connection = 'sqlite://'
+
+    def prepare_data(self):
+        cfg.CONF.set_override('meter_partition_period', 'daily',
+                              group='database')
+        for day in [2, 2, 3, 5]:
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, day, 10, 40),
+                resource_id='resource-%d' % day,
+                source='test')
+
+    def _partitions(self):
+        return [name for name, start, end
+                in self.conn.partitioner.partitions()]
+
+    def test_partitions_created(self):
+        self.assertEqual(['meter_p20120702', 'meter_p20120703',
+                          'meter_p20120705'],
+                         self._partitions())
+
+    def test_create_existing_partition(self):
+        self.conn.partitioner._create(datetime.datetime(2012, 7, 2),
+                                      datetime.datetime(2012, 7, 3))
+        self.assertEqual(3, len(self._partitions()))
+
+    def test_ensure_partition_created_concurrently(self):
+        partitioner = self.conn.partitioner
+        # Another collector created the partition after ours were listed
+        partitioner._ranges = []
+        with patch.object(partitioner, '_create',
+                          side_effect=ValueError('already exists')):
+            partitioner.ensure(datetime.datetime(2012, 7, 2, 12))
+            self.assertRaises(ValueError, partitioner.ensure,
+                              datetime.datetime(2012, 7, 9, 12))
+
+    def test_weekly_period(self):
+        self.assertEqual(datetime.datetime(2012, 7, 2),
+                         partition.period_start(
+                             datetime.datetime(2012, 7, 8, 23, 59),
+                             'weekly'))
+
+    def test_clear_expired_drops_partitions(self):
+        timeutils.utcnow.override_time = datetime.datetime(2012, 7, 5, 12)
+        self.assertEqual(3, self.conn.clear_expired_metering_data(86400))
+        self.assertEqual(['meter_p20120705'], self._partitions())
+        f = storage.SampleFilter(meter='instance')
+        self.assertEqual(['resource-5'],
+                         [s.resource_id for s in self.conn.get_samples(f)])
+        self.assertEqual(['resource-5'],
+                         [r.resource_id for r in self.conn.get_resources()])
+
+
+class MetadataBlobTest(test_storage_scenarios.DBTestBase):
+    database_connection = 'sqlite://'
+
+    compress = False
+
+    def prepare_data(self):
+        cfg.CONF.set_override('deduplicate_metadata', True, group='database')
+        cfg.CONF.set_override('compress_metadata', self.compress,
+                              group='database')
+        timeutils.utcnow.override_time = datetime.datetime(2012, 7, 2, 10, 45)
+        for minute, flavor in [(40, 'm1.tiny'), (41, 'm1.tiny'),
+                               (42, 'm1.small')]:
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, 2, 10, minute),
+                metadata={'flavor': flavor})
+
+    def test_metadata_deduplicated(self):
+        session = sqlalchemy_session.get_session()
+        blobs = session.query(sql_models.MetadataBlob).all()
+        self.assertEqual(2, len(blobs))
+        self.assertEqual([self.compress, self.compress],
+                         [b.compressed for b in blobs])
+        self.assertEqual([None, None, None],
+                         [m.resource_metadata
+                          for m in session.query(sql_models.Meter)])
+
+    def test_get_samples(self):
+        f = storage.SampleFilter(meter='instance')
+        self.assertEqual(['m1.small', 'm1.tiny', 'm1.tiny'],
+                         [s.resource_metadata['flavor']
+                          for s in self.conn.get_samples(f)])
+
+    def test_clear_expired_orphan_blobs(self):
+        grace = 2 * self.conn.METADATA_REFRESH_PERIOD
+        timeutils.utcnow.override_time = datetime.datetime(
+            2012, 7, 2, 10, 45, 1) + datetime.timedelta(seconds=grace)
+        self.conn.clear_expired_metering_data(210 + grace)
+        session = sqlalchemy_session.get_session()
+        self.assertEqual(1, session.query(sql_models.MetadataBlob).count())
+
+    def test_clear_expired_keeps_recent_orphan_blobs(self):
+        # The blobs may be about to be referenced by new samples
+        self.conn.clear_expired_metering_data(150)
+        session = sqlalchemy_session.get_session()
+        self.assertEqual(2, session.query(sql_models.MetadataBlob).count())
+
+
+class CompressedMetadataBlobTest(MetadataBlobTest):
+    compress = True
+
+
+class MetaqueryTest(test_storage_scenarios.DBTestBase):
+    database_connection = 'sqlite://'
+
+    def prepare_data(self):
+        for i, flavor in enumerate(['m1.tiny', 'm1.small']):
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, 2, 10, 40 + i),
+                resource_id='resource-%d' % i,
+                metadata={'flavor': {'name': flavor, 'ram': 512 * (i + 1)},
+                          'public': bool(i),
+                          'load': 0.5,
+                          'tags': ['a', 'b'],
+                          'long': 'x' * 256})
+
+    def test_metadata_rows(self):
+        session = sqlalchemy_session.get_session()
+        self.assertEqual(
+            [('flavor.name', 'm1.tiny')],
+            [(m.meta_key, m.value)
+             for m in session.query(sql_models.MetaText).filter_by(
+                 value='m1.tiny')])
+        self.assertEqual(2, session.query(sql_models.MetaBool).count())
+        self.assertEqual(2, session.query(sql_models.MetaBigInt).count())
+        self.assertEqual(2, session.query(sql_models.MetaFloat).count())
+        self.assertEqual(2, session.query(sql_models.MetaText).count())
+
+    def test_get_samples_by_typed_metaquery(self):
+        f = storage.SampleFilter(metaquery={'metadata.flavor.ram': 1024,
+                                            'metadata.public': True})
+        self.assertEqual(['resource-1'],
+                         [s.resource_id for s in self.conn.get_samples(f)])
+
+    def test_get_resources_by_nested_metaquery(self):
+        q = {'metadata.flavor.name': 'm1.tiny'}
+        self.assertEqual(['resource-0'],
+                         [r.resource_id
+                          for r in self.conn.get_resources(metaquery=q)])
+        self.assertEqual(['resource-0'],
+                         [r.resource_id for r in self.conn.get_resources(
+                             metaquery=q,
+                             start_timestamp=datetime.datetime(2012, 7, 2))])
+
+    def test_get_meters_by_metaquery(self):
+        q = {'metadata.load': 0.5}
+        self.assertEqual(['resource-0', 'resource-1'],
+                         sorted(m.resource_id
+                                for m in self.conn.get_meters(metaquery=q)))
+
+    def test_unsupported_metaquery_type(self):
+        q = {'metadata.tags': ['a', 'b']}
+        self.assertRaises(NotImplementedError, list,
+                          self.conn.get_meters(metaquery=q))
+
+    def test_clear_expired_metadata(self):
+        timeutils.utcnow.override_time = datetime.datetime(2012, 7, 2, 10, 45)
+        self.conn.clear_expired_metering_data(270)
+        session = sqlalchemy_session.get_session()
+        self.assertEqual(['flavor.name', 'flavor.ram', 'load', 'public'],
+                         sorted(m.meta_key
+                                for model in [sql_models.MetaText,
+                                              sql_models.MetaBigInt,
+                                              sql_models.MetaFloat,
+                                              sql_models.MetaBool]
+                                for m in session.query(model)))
+
+
+class ResourceMeterTest(test_storage_scenarios.DBTestBase):
+    database_connection = 'sqlite://'
+
+    def prepare_data(self):
+        for minute in [41, 40]:
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, 2, 10, minute),
+                metadata={'tag': 'at-%d' % minute},
+                source='test')
+
+    def test_resource_materialized(self):
+        session = sqlalchemy_session.get_session()
+        self.assertEqual(1, session.query(sql_models.ResourceMeter).count())
+        resource = session.query(sql_models.Resource).get('resource-id')
+        self.assertEqual(datetime.datetime(2012, 7, 2, 10, 40),
+                         resource.first_sample_timestamp)
+        self.assertEqual(datetime.datetime(2012, 7, 2, 10, 41),
+                         resource.last_sample_timestamp)
+        self.assertEqual({'tag': 'at-41'}, resource.resource_metadata)
+        self.assertEqual('test', resource.source_id)
+        self.assertEqual(['test', 'test'],
+                         [m.source_id
+                          for m in session.query(sql_models.Meter)])
+
+    def test_get_meters_sorted(self):
+        for resource_id, name in [('resource-b', 'cpu'),
+                                  ('resource-a', 'memory'),
+                                  ('resource-a', 'cpu')]:
+            self.create_and_store_sample(
+                timestamp=datetime.datetime(2012, 7, 2, 10, 42),
+                resource_id=resource_id, name=name)
+        self.assertEqual([('resource-a', 'cpu'), ('resource-a', 'memory'),
+                          ('resource-b', 'cpu'), ('resource-id', 'instance')],
+                         [(m.resource_id, m.name)
+                          for m in self.conn.get_meters()])
@@ -258,6 +258,22 @@ class ResourceTest(DBTestBase,
         self.assertEqual(set(resource_ids),
                          set(['resource-id-2', 'resource-id-3']))
 
+    def test_get_resources_time_range_latest_sample(self):
+        self.create_and_store_sample(
+            timestamp=datetime.datetime(2012, 7, 2, 10, 45),
+            user_id='user-id-later',
+            metadata={'display_name': 'test-server', 'tag': 'later'},
+            source='test-1')
+        resources = list(self.conn.get_resources(
+            resource='resource-id',
+            end_timestamp=datetime.datetime(2012, 7, 2, 10, 41)))
+        self.assertEqual(1, len(resources))
+        # The resource as of the latest sample of the range
+        self.assertEqual('user-id', resources[0].user_id)
+        self.assertEqual('self.counter', resources[0].metadata['tag'])
+        self.assertEqual(datetime.datetime(2012, 7, 2, 10, 40),
+                         resources[0].last_sample_timestamp)
+
     def test_get_resources_by_source(self):
         resources = list(self.conn.get_resources(source='test-1'))
         self.assertEqual(len(resources), 1)
@@ -413,6 +429,27 @@ class MeterTest(DBTestBase,
         results = list(self.conn.get_meters(project='project-id'))
         self.assertEqual(len(results), 2)
 
+    def test_get_meters_by_source(self):
+        results = list(self.conn.get_meters(source='test-1'))
+        self.assertEqual(['resource-id'], [m.resource_id for m in results])
+        self.assertEqual('test-1', results[0].source)
+
+    def test_get_meters_several_per_resource(self):
+        self.create_and_store_sample(
+            timestamp=datetime.datetime(2012, 7, 2, 10, 45),
+            name='cpu', source='test-1')
+        results = list(self.conn.get_meters(resource='resource-id'))
+        self.assertEqual(['cpu', 'instance'],
+                         sorted(m.name for m in results))
+
+    def test_get_meters_several_sources(self):
+        # The meter of resource-id-alternate is sampled from test-2 and
+        # then from test-3
+        results = list(self.conn.get_meters(
+            resource='resource-id-alternate'))
+        self.assertEqual(1, len(results))
+        self.assertEqual('test-3', results[0].source)
+
     def test_get_meters_by_metaquery(self):
         q = {'metadata.display_name': 'test-server'}
         results = list(self.conn.get_meters(metaquery=q))
@@ -627,8 +664,10 @@ class RawSampleTest(DBTestBase,
 
     def test_clear_metering_data(self):
         # NOTE(jd) Override this test in MongoDB because our code doesn't clear
-        # the collections, this is handled by MongoDB TTL feature.
-        if cfg.CONF.database.connection.startswith('mongodb://'):
+        # the collections, this is handled by MongoDB TTL feature. The same
+        # goes for the HBase column family TTL.
+        if cfg.CONF.database.connection.startswith(('mongodb://',
+                                                    'hbase://')):
             return
 
         timeutils.utcnow.override_time = datetime.datetime(2012, 7, 2, 10, 45)
@@ -645,8 +684,10 @@ class RawSampleTest(DBTestBase,
 
     def test_clear_metering_data_no_data_to_remove(self):
         # NOTE(jd) Override this test in MongoDB because our code doesn't clear
-        # the collections, this is handled by MongoDB TTL feature.
-        if cfg.CONF.database.connection.startswith('mongodb://'):
+        # the collections, this is handled by MongoDB TTL feature. The same
+        # goes for the HBase column family TTL.
+        if cfg.CONF.database.connection.startswith(('mongodb://',
+                                                    'hbase://')):
             return
 
         timeutils.utcnow.override_time = datetime.datetime(2010, 7, 2, 10, 45)
@@ -1850,6 +1891,52 @@ class CounterDataTypeTest(DBTestBase,
         self.assertEqual(results[0].counter_volume, 1938495037.53697)
 
 
+class RecordBatchTest(DBTestBase,
+                      tests_db.MixinTestsWithBackendScenarios):
+    def prepare_data(self):
+        self.msgs = []
+        for name, minute, tag in [('cpu', 41, 'second'),
+                                  ('instance', 40, 'first'),
+                                  ('instance', 42, 'third')]:
+            c = sample.Sample(
+                name,
+                sample.TYPE_CUMULATIVE,
+                unit='',
+                volume=1,
+                user_id='user-id',
+                project_id='project-id',
+                resource_id='resource-id',
+                timestamp=datetime.datetime(2012, 7, 2, 10, minute),
+                resource_metadata={'tag': tag},
+                source='test-1',
+            )
+            self.msgs.append(rpc.meter_message_from_counter(
+                c,
+                cfg.CONF.publisher_rpc.metering_secret,
+            ))
+        self.conn.record_metering_data_batch(self.msgs)
+
+    def test_samples_recorded(self):
+        f = storage.SampleFilter(meter='instance')
+        results = list(self.conn.get_samples(f))
+        self.assertEqual(2, len(results))
+        f = storage.SampleFilter(meter='cpu')
+        results = list(self.conn.get_samples(f))
+        self.assertEqual(1, len(results))
+
+    def test_resource_updates_merged(self):
+        resources = list(self.conn.get_resources())
+        self.assertEqual(1, len(resources))
+        self.assertEqual('third', resources[0].metadata['tag'])
+        meters = list(self.conn.get_meters(resource='resource-id'))
+        self.assertEqual(['cpu', 'instance'], sorted(m.name for m in meters))
+
+    def test_known_sources(self):
+        self.conn.record_metering_data_batch(self.msgs)
+        self.assertEqual(['user-id'], list(self.conn.get_users()))
+        self.assertEqual(['project-id'], list(self.conn.get_projects()))
+
+
 class AlarmTestBase(DBTestBase):
     def add_some_alarms(self):
         alarms = [models.Alarm('r3d', 'red-alert',
@@ -2008,18 +2095,20 @@ class EventTest(EventTestBase):
         self.assertEquals(models.Event.DUPLICATE, bad[0])
 
     def test_save_events_no_traits(self):
-        now = datetime.datetime.utcnow()
+        now = datetime.datetime(2013, 12, 31, 5, 0)
         m = [models.Event("1", "Foo", now, None),
              models.Event("2", "Zoo", now, [])]
-        self.conn.record_events(m)
-        for model in m:
-            self.assertTrue(model.id >= 0)
-        self.assertNotEqual(m[0].id, m[1].id)
+        self.assertEqual([], self.conn.record_events(m))
+        event_filter = storage.EventFilter(now, now)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(["1", "2"], sorted(e.message_id for e in events))
+        for event in events:
+            self.assertEqual([], event.traits)
 
     def test_save_events_traits(self):
         event_models = []
+        now = datetime.datetime(2013, 12, 31, 5, 0)
         for event_name in ['Foo', 'Bar', 'Zoo']:
-            now = datetime.datetime.utcnow()
             trait_models = \
                 [models.Trait(name, dtype, value)
                     for name, dtype, value in [
@@ -2031,10 +2120,17 @@ class EventTest(EventTestBase):
                 models.Event("id_%s" % event_name,
                              event_name, now, trait_models))
 
-        self.conn.record_events(event_models)
-        for model in event_models:
-            for trait in model.traits:
-                self.assertTrue(trait.id >= 0)
+        self.assertEqual([], self.conn.record_events(event_models))
+        event_filter = storage.EventFilter(now, now)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(3, len(events))
+        for event in events:
+            self.assertEqual(
+                [('trait_A', models.Trait.TEXT_TYPE, "my_text"),
+                 ('trait_B', models.Trait.INT_TYPE, 199),
+                 ('trait_C', models.Trait.FLOAT_TYPE, 1.23456)],
+                sorted((t.name, t.dtype, t.value)
+                       for t in event.traits)[:3])
 
 
 class GetEventTest(EventTestBase):
@@ -2065,7 +2161,7 @@ class GetEventTest(EventTestBase):
 
     def test_simple_get(self):
         event_filter = storage.EventFilter(self.start, self.end)
-        events = self.conn.get_events(event_filter)
+        events = list(self.conn.get_events(event_filter))
         self.assertEqual(3, len(events))
         start_time = None
         for i, name in enumerate(["Foo", "Bar", "Zoo"]):
@@ -2079,16 +2175,63 @@ class GetEventTest(EventTestBase):
 
     def test_simple_get_event_name(self):
         event_filter = storage.EventFilter(self.start, self.end, "Bar")
-        events = self.conn.get_events(event_filter)
+        events = list(self.conn.get_events(event_filter))
         self.assertEqual(1, len(events))
         self.assertEqual(events[0].event_name, "Bar")
         self.assertEqual(4, len(events[0].traits))
 
+    def test_get_event_trait_filter_float(self):
+        trait_filters = {'key': 'trait_C', 't_float': 100.123456}
+        event_filter = storage.EventFilter(self.start, self.end,
+                                           traits=trait_filters)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(1, len(events))
+        self.assertEqual(events[0].event_name, "Bar")
+
+    def test_get_event_unknown_name(self):
+        event_filter = storage.EventFilter(self.start, self.end, "Unknown")
+        self.assertEqual([], list(self.conn.get_events(event_filter)))
+
+    def test_get_event_paginated(self):
+        event_filter = storage.EventFilter(self.start, self.end, limit=2)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(["Foo", "Bar"], [e.event_name for e in events])
+        self.assertEqual(4, len(events[1].traits))
+        event_filter = storage.EventFilter(self.start, self.end, limit=2,
+                                           marker=events[-1].message_id)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(["Zoo"], [e.event_name for e in events])
+
+    def test_get_event_name_paginated(self):
+        self.conn.record_events([
+            models.Event("id_Foo_%d" % i, "Foo",
+                         self.start + datetime.timedelta(minutes=i), [])
+            for i in range(1, 4)])
+        event_filter = storage.EventFilter(self.start, self.end, "Foo",
+                                           limit=2)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(["id_Foo", "id_Foo_1"],
+                         [e.message_id for e in events])
+        event_filter = storage.EventFilter(self.start, self.end, "Foo",
+                                           limit=2,
+                                           marker=events[-1].message_id)
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(["id_Foo_2", "id_Foo_3"],
+                         [e.message_id for e in events])
+
+    def test_get_event_without_traits(self):
+        self.conn.record_events([models.Event("id_empty", "Empty",
+                                              self.start, [])])
+        event_filter = storage.EventFilter(self.start, self.end, "Empty")
+        events = list(self.conn.get_events(event_filter))
+        self.assertEqual(1, len(events))
+        self.assertEqual([], events[0].traits)
+
     def test_get_event_trait_filter(self):
         trait_filters = {'key': 'trait_B', 't_int': 101}
         event_filter = storage.EventFilter(self.start, self.end,
                                            traits=trait_filters)
-        events = self.conn.get_events(event_filter)
+        events = list(self.conn.get_events(event_filter))
         self.assertEqual(1, len(events))
         self.assertEqual(events[0].event_name, "Bar")
         self.assertEqual(4, len(events[0].traits))
@@ -18,10 +18,12 @@
 # under the License.
 
 import mock
+from oslo.config import cfg
 
 import novaclient
 from ceilometer.tests import base
 from ceilometer import nova_client
+from ceilometer.openstack.common import timeutils
 
 
 class TestNovaClient(base.TestCase):
@@ -95,6 +97,22 @@ class TestNovaClient(base.TestCase):
         self.assertEqual(instances[0].kernel_id, 11)
         self.assertEqual(instances[0].ramdisk_id, 21)
 
+    def test_instance_get(self):
+        instance = self.fake_servers_list()[0]
+        self.stubs.Set(self.nv.nova_client.servers, 'get',
+                       lambda uuid: instance)
+
+        instance = self.nv.instance_get(42)
+        self.assertEqual(instance.flavor['name'], 'm1.tiny')
+        self.assertEqual(instance.image['name'], 'ubuntu-12.04-x86')
+
+    def test_instance_get_not_found(self):
+        def fake_servers_get(uuid):
+            raise novaclient.exceptions.NotFound('foobar')
+        self.stubs.Set(self.nv.nova_client.servers, 'get', fake_servers_get)
+
+        self.assertIsNone(self.nv.instance_get(42))
+
     @staticmethod
     def fake_servers_list_unknown_flavor(*args, **kwargs):
         a = mock.MagicMock()
@@ -191,3 +209,46 @@ class TestNovaClient(base.TestCase):
         instance = results[0]
         self.assertIsNone(instance.kernel_id)
         self.assertEqual(instance.ramdisk_id, 21)
+
+    def test_flavor_and_image_cache(self):
+        flavors_get = mock.Mock(side_effect=self.fake_flavors_get)
+        images_get = mock.Mock(side_effect=self.fake_images_get)
+        self.stubs.Set(self.nv.nova_client.flavors, 'get', flavors_get)
+        self.stubs.Set(self.nv.nova_client.images, 'get', images_get)
+
+        for i in range(3):
+            self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.assertEqual(flavors_get.call_count, 1)
+        self.assertEqual(images_get.call_count, 1)
+        self.assertEqual(self.nv.get_cache_stats(),
+                         {'hits': 4, 'misses': 2, 'hit_rate': 4 / 6.0})
+
+    def test_cache_not_found(self):
+        flavors_get = mock.Mock(side_effect=self.fake_flavors_get)
+        self.stubs.Set(self.nv.nova_client.flavors, 'get', flavors_get)
+
+        for i in range(2):
+            instances = self.fake_servers_list_unknown_flavor()
+            self.nv._with_flavor_and_image(instances)
+            self.assertEqual(instances[0].flavor['name'], 'unknown-id-666')
+        self.assertEqual(flavors_get.call_count, 1)
+
+    def test_cache_expiry(self):
+        flavors_get = mock.Mock(side_effect=self.fake_flavors_get)
+        self.stubs.Set(self.nv.nova_client.flavors, 'get', flavors_get)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        timeutils.advance_time_seconds(cfg.CONF.nova_metadata_cache_ttl + 1)
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.assertEqual(flavors_get.call_count, 2)
+
+    def test_cache_disabled(self):
+        cfg.CONF.set_override('nova_metadata_cache_ttl', 0)
+        flavors_get = mock.Mock(side_effect=self.fake_flavors_get)
+        self.stubs.Set(self.nv.nova_client.flavors, 'get', flavors_get)
+
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.nv._with_flavor_and_image(self.fake_servers_list())
+        self.assertEqual(flavors_get.call_count, 2)
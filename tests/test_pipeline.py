@@ -26,6 +26,7 @@ from ceilometer import publisher
 from ceilometer.publisher import test as test_publisher
 from ceilometer import transformer
 from ceilometer.transformer import accumulator
+from ceilometer.transformer import change_detection
 from ceilometer.transformer import conversions
 from ceilometer.openstack.common import timeutils
 from ceilometer import pipeline
@@ -50,6 +51,7 @@ class TestPipeline(base.TestCase):
             'cache': accumulator.TransformerAccumulator,
             'unit_conversion': conversions.ScalingTransformer,
             'rate_of_change': conversions.RateOfChangeTransformer,
+            'change_detection': change_detection.ChangeDetectionTransformer,
         }
 
         if name in class_name_ext:
@@ -1021,3 +1023,51 @@ class TestPipeline(base.TestCase):
         self.assertEqual(len(publisher.samples), 0)
         pipe.flush(None)
         self.assertEqual(len(publisher.samples), 0)
+
+    def _do_test_change_detection(self, volumes, type=sample.TYPE_CUMULATIVE,
+                                  offset=10):
+        self.pipeline_cfg[0]['transformers'] = [
+            {
+                'name': 'change_detection',
+                'parameters': {'heartbeat': 30},
+            },
+        ]
+        self.pipeline_cfg[0]['counters'] = ['cpu']
+        now = timeutils.utcnow()
+        counters = [
+            sample.Sample(
+                name='cpu',
+                type=type,
+                volume=volume,
+                unit='ns',
+                user_id='test_user',
+                project_id='test_proj',
+                resource_id='test_resource',
+                timestamp=(now + datetime.timedelta(
+                    seconds=offset * i)).isoformat(),
+                resource_metadata={}
+            )
+            for i, volume in enumerate(volumes)
+        ]
+
+        pipeline_manager = pipeline.PipelineManager(self.pipeline_cfg,
+                                                    self.transformer_manager)
+        pipe = pipeline_manager.pipelines[0]
+        for counter in counters:
+            pipe.publish_samples(None, [counter])
+        pipe.flush(None)
+        publisher = pipeline_manager.pipelines[0].publishers[0]
+        return [s.volume for s in publisher.samples]
+
+    def test_change_detection_drops_unchanged(self):
+        volumes = self._do_test_change_detection([1, 1, 2, 2, 3])
+        self.assertEqual(volumes, [1, 2, 3])
+
+    def test_change_detection_heartbeat(self):
+        volumes = self._do_test_change_detection([1, 1, 1, 1, 1])
+        self.assertEqual(volumes, [1, 1])
+
+    def test_change_detection_ignores_gauge(self):
+        volumes = self._do_test_change_detection([1, 1, 1],
+                                                 type=sample.TYPE_GAUGE)
+        self.assertEqual(volumes, [1, 1, 1])
@@ -16,6 +16,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import eventlet
+from stevedore import extension
+
 from ceilometer import plugin
 from ceilometer.tests import base
 
@@ -107,3 +110,80 @@ class NotificationBaseTestCase(base.TestCase):
         n = self.FakeNetworkPlugin()
         self.assertTrue(len(list(c.to_samples(TEST_NOTIFICATION))) > 0)
         self.assertEqual(len(list(n.to_samples(TEST_NOTIFICATION))), 0)
+
+
+class EventTypeIndexTestCase(base.TestCase):
+
+    class FakePlugin(plugin.NotificationBase):
+        event_types = []
+
+        def __init__(self, event_types):
+            self.event_types = event_types
+
+        def get_exchange_topics(self, conf):
+            return
+
+        def process_notification(self, message):
+            return [message]
+
+    def setUp(self):
+        super(EventTypeIndexTestCase, self).setUp()
+        self.exts = [
+            extension.Extension(name, None, None, self.FakePlugin(types))
+            for name, types in [('exact', ['compute.instance.start']),
+                                ('compute', ['compute.*']),
+                                ('start', ['*.start', 'compute.*.start']),
+                                ('network', ['network.*', 'port.create']),
+                                ]]
+        self.index = plugin.EventTypeIndex(self.exts)
+
+    def _names(self, event_type):
+        return [ext.name for ext in self.index.get_extensions(event_type)]
+
+    def test_matches_to_samples(self):
+        for event_type in ['compute.instance.start', 'compute.foo',
+                           'network.create', 'port.create', 'image.start',
+                           'port.delete', 'other']:
+            self.assertEqual(
+                self._names(event_type),
+                [ext.name for ext in self.exts
+                 if list(ext.obj.to_samples({'event_type': event_type}))])
+
+    def test_load_order(self):
+        self.assertEqual(self._names('compute.instance.start'),
+                         ['exact', 'compute', 'start'])
+
+    def test_memoized(self):
+        first = self.index.get_extensions('compute.foo')
+        self.assertIs(self.index.get_extensions('compute.foo'), first)
+
+    def test_no_event_type(self):
+        self.assertEqual(self._names(None), [])
+
+
+class GetCachedTestCase(base.TestCase):
+
+    def test_filled_once_concurrently(self):
+        calls = []
+
+        def fill():
+            calls.append(None)
+            # Let the other greenthreads run while filling
+            eventlet.sleep(0)
+            return ['value']
+
+        cache = {}
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda _: plugin.get_cached(cache, 'key', fill), range(4)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['value']] * 4)
+
+    def test_cached(self):
+        cache = {'key': 'value'}
+        self.assertEqual(plugin.get_cached(cache, 'key', None), 'value')
+
+    def test_count_cache_readers(self):
+        cache = plugin.new_cache([1, 'a', 2])
+        self.assertEqual(plugin.count_cache_readers(cache, int), 2)
+        self.assertEqual(plugin.count_cache_readers({}, int), None)
@@ -67,3 +67,8 @@ class TestUtils(tests_base.TestCase):
                                  ('b', 'B'),
                                  ('nested.a', 'A'),
                                  ('nested.b', 'B')])
+
+    def test_recursive_keypairs_with_separator_deeply_nested(self):
+        data = {'nested': {'nested': {'a': 'A'}}}
+        pairs = list(utils.recursive_keypairs(data, '.'))
+        self.assertEqual(pairs, [('nested.nested.a', 'A')])